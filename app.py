@@ -4,26 +4,38 @@ Site Mirror Tool - Flask API for frontend integration
 Downloads websites using wget and generates a markdown site map
 """
 
-from flask import Flask, request, jsonify, send_from_directory, send_file
+from flask import Flask, request, jsonify, send_from_directory, send_file, Response
 from flask_cors import CORS
 import os
 import sys
 import subprocess
 import shutil
 from pathlib import Path
-from urllib.parse import urlparse
+from urllib.parse import urlparse, quote
 import time
 import threading
 import uuid
-# Add Playwright imports
-from playwright.sync_api import sync_playwright
 from urllib.parse import urljoin
-import urllib.request
 import json
-import zipfile
+import html
+import socket
 import tempfile
-import io
-import glob
+import queue
+import asyncio
+
+import archives
+import browser_pool
+from blobstore import BlobStore, file_digest
+import crawler
+from httpcache import HTTPCache, link_or_copy
+import filemanifest
+import imageproc
+import metrics
+import renderer
+import rewriter
+import sitemaps
+from jobstore import ACTIVE_STATUSES, TERMINAL_STATUSES, open_job_store
+from scheduler import JobScheduler, QueueFull, JobCancelled
 
 app = Flask(__name__)
 CORS(app)
@@ -31,10 +43,72 @@ CORS(app)
 # Configuration
 DOWNLOAD_DIR = 'downloads'
 os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+CRAWL_ENGINE = os.environ.get('CRAWL_ENGINE', 'async')  # 'async' (in-process crawler) or 'wget'
+CRAWL_ENGINES = ('async', 'wget')
+MAX_WORKERS = int(os.environ.get('MAX_WORKERS', 4))  # downloads running at once
+MAX_QUEUE_DEPTH = int(os.environ.get('MAX_QUEUE_DEPTH', 100))  # downloads waiting before we return 429
+BLOB_STORE_ENABLED = os.environ.get('BLOB_STORE', '1') == '1'  # dedupe identical files across downloads
+BLOB_STORE_DIR = os.path.join(DOWNLOAD_DIR, '.blobs')  # same filesystem as the mirrors, for hardlinks
+CRAWL_STATE_DIR = os.path.join(DOWNLOAD_DIR, '.state')  # per-download validators for refreshes
+JOB_STORE = os.environ.get('JOB_STORE', 'sqlite')  # 'sqlite' (shared by every server process) or 'memory'
+JOB_STORE_PATH = os.environ.get('JOB_STORE_PATH', os.path.join(DOWNLOAD_DIR, '.jobs.sqlite3'))
+DOWNLOADS_PAGE_SIZE = 100  # /api/downloads entries per page unless ?limit= says otherwise
+PROGRESS_INTERVAL = 0.25  # seconds between crawl progress writes to the job store
+CANCEL_POLL_INTERVAL = 1  # seconds between checks for cancel requests made on other processes
+STREAM_HEARTBEAT = 15  # seconds between keep-alive comments on idle event streams
+METRICS_DIR = os.path.join(DOWNLOAD_DIR, '.metrics')  # one file of phase totals per server process
+HTTP_CACHE_ENABLED = os.environ.get('HTTP_CACHE', '1') == '1'  # share fetched responses between jobs
+HTTP_CACHE_DIR = os.path.join(DOWNLOAD_DIR, '.http-cache')  # same filesystem as the mirrors, for hardlinks
+HTTP_CACHE_MAX_BYTES = int(os.environ.get('HTTP_CACHE_MAX_BYTES', 1024 ** 3))
+HTTP_CACHE_TTL = int(os.environ.get('HTTP_CACHE_TTL', 3600))  # seconds, for responses without Cache-Control
+FILE_MANIFEST_DIR = os.path.join(DOWNLOAD_DIR, '.manifests')  # per-download index of the served files
+PRECOMPRESSED_DIR = os.path.join(DOWNLOAD_DIR, '.precompressed')  # gzip/brotli variants by content hash
+PRECOMPRESS = os.environ.get('PRECOMPRESS', '1') == '1'  # write compressed variants of text files
+ARCHIVE_CACHE_DIR = os.environ.get('ARCHIVE_CACHE_DIR', 'archive_cache')
+ARCHIVE_CACHE_MAX_BYTES = int(os.environ.get('ARCHIVE_CACHE_MAX_BYTES', 2 * 1024 ** 3))
+IMAGE_CAPTURE_MODE = os.environ.get('IMAGE_CAPTURE_MODE', 'network')  # 'network' (keep what the browser loaded) or 'fetch'
+IMAGE_SCROLL = os.environ.get('IMAGE_SCROLL', '1') == '1'  # scroll the page to trigger lazy-loaded images
+IMAGE_SCROLL_STEPS = 30  # viewport heights scrolled at most
+IMAGE_THUMBNAILS = os.environ.get('IMAGE_THUMBNAILS', '0') == '1'  # write images/thumbnails/ (needs Pillow)
+IMAGE_METADATA_INTERVAL = 0.5  # seconds between image_metadata.json updates while images are processed
+MAX_BATCH_URLS = int(os.environ.get('MAX_BATCH_URLS', 1000))  # URLs one batch may mirror
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', MAX_WORKERS))  # downloads of one batch queued or running at once
+BATCH_POLL_INTERVAL = 0.5  # seconds between batch progress updates
+DOWNLOAD_TTL = int(os.environ.get('DOWNLOAD_TTL', 0))  # seconds unused before a download is deleted; 0 keeps them
+DOWNLOAD_QUOTA_BYTES = int(os.environ.get('DOWNLOAD_QUOTA_BYTES', 0))  # least recently used downloads go beyond this; 0 is no quota
+JANITOR_INTERVAL = int(os.environ.get('JANITOR_INTERVAL', 300))  # seconds between cleanup passes
+ACCESS_TOUCH_INTERVAL = 60  # seconds between last_access writes for one download
+DELETE_RETRY_AFTER = 600  # seconds before a deletion interrupted by a crash is finished by the janitor
+TEMP_MAX_AGE = 24 * 3600  # seconds before a leftover in-memory download scratch dir is removed
+AUTO_RESUME = os.environ.get('AUTO_RESUME', '1') == '1'  # continue crawls interrupted by a restart from their checkpoint
+
+def process_start_time(pid):
+    """When pid started, in clock ticks since boot, or None where /proc is unavailable"""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            return f.read().rsplit(')', 1)[1].split()[19]
+    except (OSError, IndexError):
+        return None
+
+# Tells this server apart from an earlier one that had the same PID (e.g. PID 1 after a container restart)
+INSTANCE_ID = process_start_time(os.getpid()) or uuid.uuid4().hex[:12]
+
+def worker_id():
+    """Identifies this server process as the owner of the jobs it queues"""
+    return f"{socket.gethostname()}:{os.getpid()}:{INSTANCE_ID}"
 
 # Global variables for tracking downloads
-download_status = {}
-download_lock = threading.Lock()
+job_store = open_job_store(JOB_STORE, JOB_STORE_PATH)
+last_touched = {}  # download_id -> when this process last wrote its last_access
+janitor_stats = {'runs': 0, 'deleted': 0, 'bytes_freed': 0, 'tracked_bytes': None, 'last_run': None}
+job_scheduler = JobScheduler(workers=MAX_WORKERS, max_queue=MAX_QUEUE_DEPTH)
+archive_cache = archives.ArchiveCache(ARCHIVE_CACHE_DIR, ARCHIVE_CACHE_MAX_BYTES)
+blob_store = BlobStore(BLOB_STORE_DIR) if BLOB_STORE_ENABLED else None
+http_cache = HTTPCache(HTTP_CACHE_DIR, HTTP_CACHE_MAX_BYTES, HTTP_CACHE_TTL) if HTTP_CACHE_ENABLED else None
+crawler.set_http_cache(http_cache)
+crawler.set_renderer(renderer.render_html)
+file_manifests = filemanifest.FileManifests(FILE_MANIFEST_DIR, PRECOMPRESSED_DIR, precompress=PRECOMPRESS)
+metrics_registry = metrics.MetricsRegistry(METRICS_DIR, worker_id().replace(':', '-'))
 
 def validate_url(url):
     """Validate URL format"""
@@ -58,162 +132,552 @@ def check_wget_installed():
         return False, "wget is not installed. Please install wget to use this tool."
     return True, None
 
-def get_main_website_folder(output_dir):
-    # Find the first directory inside output_dir (should be the website folder)
-    for entry in os.listdir(output_dir):
-        full_path = os.path.join(output_dir, entry)
-        if os.path.isdir(full_path):
-            return full_path
-    return output_dir  # fallback
+def get_main_website_folder(output_dir, url=None):
+    """Website folder inside output_dir: the one of url's host if given and present, else the first by name"""
+    if url:
+        host_folder = os.path.join(output_dir, crawler.url_to_local_path(url).split(os.sep)[0])
+        if os.path.isdir(host_folder):
+            return host_folder
+    folders = sorted(entry for entry in os.listdir(output_dir)
+                     if not entry.startswith('.') and os.path.isdir(os.path.join(output_dir, entry)))
+    return os.path.join(output_dir, folders[0]) if folders else output_dir  # fallback
+
+def classify_image(filename, alt, class_name, width, height):
+    """Tag an image as logo, hero, banner, icon, product or gallery"""
+    if "logo" in filename.lower() or "logo" in class_name.lower():
+        return "logo"
+    if width and height and width >= 1000 and height >= 300:
+        return "hero"
+    if any(keyword in alt.lower() or keyword in class_name.lower() for keyword in ["header", "banner", "hero"]):
+        return "banner"
+    if width and height and width < 100 and height < 100:
+        return "icon"
+    if any(keyword in alt.lower() or keyword in filename.lower() for keyword in ["product", "cover", "item", "feature"]):
+        return "product"
+    return "gallery"
+
+async def scroll_page(page):
+    """Scroll through the page so lazy-loaded images start loading"""
+    await page.evaluate(
+        """async (maxSteps) => {
+            for (let step = 0; step < maxSteps; step++) {
+                window.scrollBy(0, window.innerHeight);
+                await new Promise(resolve => setTimeout(resolve, 100));
+                if (window.innerHeight + window.scrollY >= document.body.scrollHeight) break;
+            }
+        }""",
+        IMAGE_SCROLL_STEPS
+    )
+    try:
+        await page.wait_for_load_state("networkidle", timeout=5000)
+    except Exception:
+        pass  # pages that keep polling never go idle; keep whatever loaded
+
+async def collect_page_images(url, capture_dir=None, scroll=False):
+    """Render the page in a pooled browser.
+
+    Returns (images, captured): the attributes of every <img>, and when capture_dir
+    is given, {url: filename} for each image response the browser received, with
+    its body already written to capture_dir.
+    """
+    captured = {}
+    pending = set()
+
+    async def save_response(response):
+        body = await response.body()
+        filename = imageproc.staged_name(response.url)
+        path = os.path.join(capture_dir, filename)
+        with open(path + ".part", "wb") as f:
+            f.write(body)
+        os.replace(path + ".part", path)
+        captured[response.url] = filename
+
+    def on_response(response):
+        # Covers srcset, <picture> and CSS backgrounds, not just <img src>
+        if response.request.resource_type == "image" and response.ok and response.url.startswith("http"):
+            pending.add(asyncio.ensure_future(save_response(response)))
+
+    async def drain():
+        # Images keep arriving while earlier ones are saved; wait until none is left
+        while pending:
+            tasks = list(pending)
+            pending.difference_update(tasks)
+            for result in await asyncio.gather(*tasks, return_exceptions=True):
+                if isinstance(result, Exception):
+                    print(f"Failed to capture image response: {result}")
+
+    async with browser_pool.pool.page() as page:
+        if capture_dir:
+            page.on("response", on_response)
+        try:
+            # The page's subresources load on their own, but the navigation is paced with the crawler
+            async with crawler.host_limiter.slot(url):
+                await page.goto(url)
+            if scroll:
+                await scroll_page(page)
+            # One round trip for all images instead of one per attribute
+            images = await page.eval_on_selector_all(
+                "img",
+                """els => els.map(el => ({
+                    src: el.getAttribute('src'),
+                    currentSrc: el.currentSrc,
+                    alt: el.getAttribute('alt'),
+                    className: el.getAttribute('class'),
+                    width: el.getAttribute('width'),
+                    height: el.getAttribute('height')
+                }))"""
+            )
+        finally:
+            # Every save finishes before the page closes, even when loading it failed
+            await drain()
+            if capture_dir:
+                page.remove_listener("response", on_response)
+    return images, captured
+
+def image_entry(full_url, img, info, error):
+    """Metadata of one image; real dimensions from the file win over the <img> attributes"""
+    alt = img["alt"] or ""
+    class_name = img["className"] or ""
+    width = img["width"]
+    height = img["height"]
+    width = int(width) if width and width.isdigit() else None
+    height = int(height) if height and height.isdigit() else None
+    if info and info["width"] and info["height"]:
+        width, height = info["width"], info["height"]
+    filename = info["filename"] if info else imageproc.image_filename(full_url)
+    tag = classify_image(filename, alt, class_name, width, height)
+    return {
+        "filename": filename,
+        "alt": alt,
+        "width": width,
+        "height": height,
+        "src": full_url,
+        "tag": tag,
+        "format": info and info["format"],
+        "bytes": info and info["bytes"],
+        "sha256": info and info["sha256"],
+        "thumbnail": info and info["thumbnail"],
+        "duplicate_of": info and info["duplicate_of"],
+        "error": error or (info and info["error"])
+    }
+
+def write_image_metadata(path, image_data):
+    """Replace image_metadata.json, so readers never see a half-written file"""
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(image_data, f, indent=2, ensure_ascii=False)
+    os.replace(path + ".tmp", path)
 
-def download_images_with_playwright(url, output_dir):
+def download_images_with_playwright(url, output_dir, job_metrics=None):
     """Download all images from the given URL using Playwright into the website folder's images subfolder"""
-    website_folder = get_main_website_folder(output_dir)
+    job_metrics = job_metrics or metrics.JobMetrics()
+    website_folder = get_main_website_folder(output_dir, url)
     images_dir = os.path.join(website_folder, "images")
-    os.makedirs(images_dir, exist_ok=True)
-    image_data = []
-    with sync_playwright() as p:
-        browser = p.chromium.launch()
-        page = browser.new_page()
-        page.goto(url)
-        images = page.query_selector_all("img")
+    # Images are downloaded under per-URL names first, and named once their content is known
+    incoming_dir = os.path.join(images_dir, imageproc.INCOMING_DIR)
+    os.makedirs(incoming_dir, exist_ok=True)
+    try:
+        capture_dir = incoming_dir if IMAGE_CAPTURE_MODE == "network" else None
+        with job_metrics.phase('render') as phase:
+            images, captured = crawler.run_sync(collect_page_images(url, capture_dir, scroll=IMAGE_SCROLL))
+            phase['requests'] = 1 + len(captured)
+            phase['bytes'] = sum(os.path.getsize(os.path.join(incoming_dir, name)) for name in set(captured.values())
+                                 if os.path.exists(os.path.join(incoming_dir, name)))
+
+        # Fetch whatever the browser did not load (everything, in fetch mode) concurrently on the shared pool
+        downloads = {}
         for img in images:
-            src = img.get_attribute("src")
-            if src:
-                full_url = urljoin(url, src)
-                try:
-                    filename = os.path.basename(src)
-                    filepath = os.path.join(images_dir, filename)
-                    urllib.request.urlretrieve(full_url, filepath)
-                    alt = img.get_attribute("alt") or ""
-                    class_name = img.get_attribute("class") or ""
-                    width = img.get_attribute("width")
-                    height = img.get_attribute("height")
-                    width = int(width) if width and width.isdigit() else None
-                    height = int(height) if height and height.isdigit() else None
-                    tag = "gallery"
-                    if "logo" in filename.lower() or "logo" in class_name.lower():
-                        tag = "logo"
-                    elif width and height and width >= 1000 and height >= 300:
-                        tag = "hero"
-                    elif any(keyword in alt.lower() or keyword in class_name.lower() for keyword in ["header", "banner", "hero"]):
-                        tag = "banner"
-                    elif width and height and width < 100 and height < 100:
-                        tag = "icon"
-                    elif any(keyword in alt.lower() or keyword in filename.lower() for keyword in ["product", "cover", "item", "feature"]):
-                        tag = "product"
-                    image_data.append({
-                        "filename": filename,
-                        "alt": alt,
-                        "width": width,
-                        "height": height,
-                        "src": full_url,
-                        "tag": tag
-                    })
-                except Exception as e:
-                    print(f"Failed to download {full_url}: {e}")
-        browser.close()
-    # Save image metadata to a JSON file in the website folder
-    import json
-    image_metadata_path = os.path.join(website_folder, "image_metadata.json")
-    with open(image_metadata_path, "w", encoding="utf-8") as f:
-        json.dump(image_data, f, indent=2, ensure_ascii=False)
-    return image_data
+            full_url = img["currentSrc"] or (img["src"] and urljoin(url, img["src"]))
+            if full_url and full_url not in downloads and urlparse(full_url).scheme in ('http', 'https'):
+                downloads[full_url] = img
+        to_fetch = [full_url for full_url in downloads if full_url not in captured]
+        with job_metrics.phase('image_fetch') as phase:
+            results = crawler.run_sync(crawler.fetch_many(
+                [(full_url, os.path.join(incoming_dir, imageproc.staged_name(full_url))) for full_url in to_fetch]
+            ))
+            errors = {full_url: error for full_url, (_, error, _) in zip(to_fetch, results)}
+            cached = sum(1 for _, _, from_cache in results if from_cache)
+            phase['requests'] = len(to_fetch) - cached
+            # Captured while rendering, or served by the shared HTTP cache
+            phase['cache_hits'] = len(downloads) - len(to_fetch) + cached
+            phase['bytes'] = sum(size for size, _, from_cache in results if size and not from_cache)
+            phase['errors'] = sum(1 for error in errors.values() if error)
+
+        # Images only seen on the network (CSS backgrounds, <picture> sources) have no attributes
+        for full_url in captured:
+            if full_url not in downloads:
+                downloads[full_url] = {"alt": None, "className": None, "width": None, "height": None}
+
+        for full_url, error in errors.items():
+            if error:
+                print(f"Failed to download {full_url}: {error}")
+        arrived = [(full_url, os.path.join(incoming_dir, imageproc.staged_name(full_url)))
+                   for full_url in downloads if not errors.get(full_url)]
+
+        # Hash, probe and name the images in a process pool; image_metadata.json fills up as they finish
+        image_metadata_path = os.path.join(website_folder, "image_metadata.json")
+        processed = {}
+        last_write = time.monotonic()
+        with job_metrics.phase('image_process') as phase:
+            for full_url, info in imageproc.process_images(images_dir, arrived, thumbnails=IMAGE_THUMBNAILS):
+                processed[full_url] = info
+                phase['requests'] += 1
+                phase['bytes'] += info['bytes'] or 0
+                phase['cache_hits'] += bool(info['duplicate_of'])
+                phase['errors'] += bool(info['error'])
+                if time.monotonic() - last_write >= IMAGE_METADATA_INTERVAL:
+                    last_write = time.monotonic()
+                    write_image_metadata(image_metadata_path, [
+                        image_entry(done_url, downloads[done_url], done_info, None)
+                        for done_url, done_info in processed.items()
+                    ])
+
+        image_data = [image_entry(full_url, img, processed.get(full_url), errors.get(full_url))
+                      for full_url, img in downloads.items()]
+        # Save image metadata to a JSON file in the website folder
+        write_image_metadata(image_metadata_path, image_data)
+        return image_data
+    finally:
+        imageproc.clear_incoming(images_dir)
+
+def image_url_map(output_dir, url, image_data):
+    """{image URL: path relative to output_dir} for the images saved into the images folder"""
+    images_dir = os.path.join(get_main_website_folder(output_dir, url), "images")
+    return {
+        image["src"]: os.path.relpath(os.path.join(images_dir, image["filename"]), output_dir).replace(os.sep, '/')
+        for image in image_data if not image["error"]
+    }
+
+def crawl_scope(data, default_depth):
+    """CrawlScope from a request body, or (None, error response) if its options are invalid"""
+    try:
+        return crawler.CrawlScope.from_options(data, default_depth), None
+    except ValueError as e:
+        return None, (jsonify({'error': 'Invalid crawl options', 'message': str(e)}), 400)
+
+def build_wget_command(url, output_dir, scope):
+    """wget command used by the fallback engine.
+
+    wget has no page or MIME type limits, so max_pages and mime_types only apply to
+    the async crawler; include/exclude patterns apply to every file, not just pages.
+    Render mode needs the async crawler (see download_settings).
+    """
+    command = [
+        'wget',
+        '-p',                    # download all files needed to display HTML page
+        '-k',                    # convert links to work locally
+        '-e', 'robots=off',      # ignore robots.txt
+        '--html-extension',      # save files with .html extension
+        '--convert-links',       # convert links to work locally
+        '--restrict-file-names=windows',  # use Windows-compatible filenames
+        '--directory-prefix', output_dir,  # output directory
+        '-A', ','.join(sorted(crawler.ACCEPT_EXTENSIONS)),
+        '-U', 'Mozilla',         # user agent
+        '--wait', f'{1 / crawler.HOST_RATE:g}',  # same per-host pace as the async engine
+    ]
+    if scope.max_depth != 0:  # wget reads -l 0 as unlimited; depth 0 is the start page and its requisites
+        command += ['-r', '-l', 'inf' if scope.max_depth is None else str(scope.max_depth)]
+    if scope.no_parent:
+        command.append('--no-parent')  # don't follow links to parent directory
+    if scope.include:
+        command += ['--accept-regex', '|'.join(map(crawler.glob_to_regex, scope.include))]
+    if scope.exclude:
+        command += ['--reject-regex', '|'.join(map(crawler.glob_to_regex, scope.exclude))]
+    if scope.max_bytes is not None:
+        command += ['-Q', str(scope.max_bytes)]  # download quota
+    if scope.same_domain == 'subdomains':
+        host = urlparse(url).hostname or ''
+        command += ['-H', '-D', host[4:] if host.startswith('www.') else host]
+    command.append(url)
+    return command
+
+def run_wget(url, download_id, output_dir, cancel_event, phase, scope):
+    """Mirror the site with a wget subprocess; returns an error message or None"""
+    job_store.update(download_id, {
+        'status': 'downloading',
+        'progress': 10,
+        'message': 'Downloading site with wget...'
+    })
+
+    process = subprocess.Popen(build_wget_command(url, output_dir, scope), stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE, text=True)
+    deadline = time.time() + crawler.CRAWL_TIMEOUT
+    while True:
+        try:
+            _, stderr = process.communicate(timeout=1)
+            break
+        except subprocess.TimeoutExpired:
+            # Poll so a cancel request can kill wget instead of waiting out the timeout
+            if cancel_event.is_set() or time.time() > deadline:
+                process.kill()
+                process.communicate()
+                if cancel_event.is_set():
+                    raise JobCancelled()
+                raise
+    if process.returncode != 0:
+        error_msg = f"wget failed with return code {process.returncode}"
+        if stderr:
+            error_msg += f"\nError: {stderr}"
+        return error_msg
+    # wget reports nothing we can parse cheaply; count what it left on disk
+    for dirpath, _, files in os.walk(output_dir):
+        phase['requests'] += len(files)
+        phase['bytes'] += sum(os.path.getsize(os.path.join(dirpath, name)) for name in files)
+    return None
+
+def crawl_state_dir(download_id):
+    return os.path.join(CRAWL_STATE_DIR, download_id)
+
+def save_crawl_state(download_id, resources):
+    """Keep the per-URL validators of a finished crawl so it can be refreshed later"""
+    path = os.path.join(crawl_state_dir(download_id), 'resources.json')
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(resources, f)
+    os.replace(path + '.tmp', path)
+
+def crawl_checkpoint_path(download_id):
+    return os.path.join(crawl_state_dir(download_id), 'checkpoint.json')
+
+def can_resume(download_id):
+    """Whether an unfinished crawl of download_id left a checkpoint to continue from"""
+    return os.path.exists(crawl_checkpoint_path(download_id))
+
+def load_crawl_state(download_id, output_dir):
+    """The 'previous' crawl a refresh of download_id starts from, or None if it cannot be refreshed"""
+    state_dir = crawl_state_dir(download_id)
+    try:
+        with open(os.path.join(state_dir, 'resources.json'), encoding='utf-8') as f:
+            resources = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return {'output_dir': output_dir, 'raw_dir': os.path.join(state_dir, 'raw'), 'resources': resources}
+
+def run_async_crawl(url, download_id, output_dir, cancel_event, phase, scope, previous=None, resume=None):
+    """Mirror the site with the in-process asyncio crawler; returns an error message or None.
+
+    With previous (see load_crawl_state) unchanged resources are revalidated and reused.
+    The crawl is checkpointed until it finishes; resume is a checkpoint to continue from.
+    """
+    job_store.update(download_id, {
+        'status': 'downloading',
+        'progress': 10,
+        'message': 'Resuming crawl...' if resume else 'Refreshing site...' if previous else 'Crawling site...'
+    })
+
+    last = {'progress': 10, 'time': 0}
+
+    def report(stats, force=False):
+        # Called for every resource; write to the job store a few times a second at most
+        now = time.monotonic()
+        if not force and now - last['time'] < PROGRESS_INTERVAL:
+            return
+        last['time'] = now
+        done = stats['fetched'] + stats['failed']
+        total = max(stats['discovered'], 1)
+        # 10-80% is reserved for the crawl; never move the bar backwards
+        last['progress'] = max(last['progress'], 10 + int(70 * done / total))
+        job_store.update(download_id, {
+            'progress': last['progress'],
+            'message': (f"Fetched {done} of {total} resources ({stats['bytes'] // 1024} KB"
+                        + (f", {stats['not_modified']} unchanged" if previous else '') + ")..."),
+            'resources': stats
+        })
+
+    try:
+        stats, errors, resources = crawler.crawl_site(
+            url, output_dir, on_progress=report, cancel_event=cancel_event,
+            raw_dir=os.path.join(crawl_state_dir(download_id), 'raw'), previous=previous, scope=scope,
+            checkpoint=crawl_checkpoint_path(download_id), resume=resume
+        )
+    except crawler.CrawlCancelled:
+        raise JobCancelled()
+    except crawler.CrawlError as e:
+        return f"Crawl failed: {e}"
+    report(stats, force=True)
+    phase.update({
+        'bytes': stats['bytes'],
+        'requests': stats['fetched'] + stats['failed'] - stats['cached'],
+        'cache_hits': stats['not_modified'] + stats['cached'],
+        'errors': stats['failed']
+    })
+    for error in errors:
+        print(f"Crawl error: {error}")
+    print(f"✅ Crawled {stats['fetched']} resources ({stats['cached']} from cache, "
+          f"{stats['not_modified']} unchanged, {stats['failed']} failed)")
+    if scope.render:
+        print(f"🖥️ Rendered {stats['rendered']} pages ({stats['render_failed']} kept as fetched)")
+    if stats['limits_reached']:
+        print(f"⚠️ Crawl stopped early: {', '.join(stats['limits_reached'])} reached")
+    try:
+        save_crawl_state(download_id, resources)
+        os.unlink(crawl_checkpoint_path(download_id))
+    except OSError as e:
+        print(f"Could not save crawl state: {e}")
+    return None
+
+def download_site_worker(url, download_id, output_dir, engine=None, refresh_of=None, options=None,
+                         batch_id=None, resume=False, cancel_event=None):
+    """Worker function to download site in background; refresh_of re-mirrors an earlier download.
+
+    options are the crawl options of the request (see crawler.CrawlScope.from_options).
+    Downloads of a batch skip the archive: the batch builds one for all of them.
+    With resume the crawl continues from the checkpoint an earlier run of download_id left.
+    """
+    engine = engine or CRAWL_ENGINE
+    scope = crawler.CrawlScope.from_options(options or {})
+    cancel_event = cancel_event or threading.Event()
+    job_metrics = metrics.JobMetrics(
+        registry=metrics_registry,
+        on_change=lambda phases: job_store.update(download_id, {'phases': phases}),
+        expected=(JobCancelled,)
+    )
+
+    def check_cancelled():
+        # Phases are not interruptible on their own, so stop at the next phase boundary
+        if cancel_event.is_set():
+            raise JobCancelled()
 
-def download_site_worker(url, download_id, output_dir):
-    """Worker function to download site in background"""
     try:
         # Update status to starting
-        with download_lock:
-            download_status[download_id] = {
-                'status': 'starting',
-                'progress': 0,
-                'message': 'Initializing download...',
-                'url': url,
-                'output_dir': output_dir
-            }
-        
-        print(f"🔄 Starting wget site mirror of {url}...")
+        job_store.update(download_id, {
+            'status': 'starting',
+            'progress': 0,
+            'message': 'Resuming download...' if resume else 'Initializing download...',
+            'url': url,
+            'output_dir': output_dir,
+            'engine': engine
+        })
         
-        # wget command with same options as shell script
-        wget_cmd = [
-            'wget',
-            '-r',                    # recursive download
-            '-p',                    # download all files needed to display HTML page
-            '-k',                    # convert links to work locally
-            '-e', 'robots=off',      # ignore robots.txt
-            '--html-extension',      # save files with .html extension
-            '--convert-links',       # convert links to work locally
-            '--restrict-file-names=windows',  # use Windows-compatible filenames
-            '--no-parent',           # don't follow links to parent directory
-            '--directory-prefix', output_dir,  # output directory
-            '-A', 'jpeg,jpg,bmp,gif,png,webp,svg,ico,css,js,html,htm,txt,pdf,doc,docx,xls,xlsx,ppt,pptx,mp3,mp4,wav,ogg,webm,zip,tar,gz,bz2,rar,7z,txt,csv,json,xml,yaml,yml,ini,conf,log,sql,sqlite,db,db3,db4,db5,db6,db7,db8,db9,db10,db11,db12,db13,db14,db15,db16,db17,db18,db19,db20',
-            '-U', 'Mozilla',         # user agent
-            # Limit to 1 page
-            '-l', '1',               # limit recursion to 1 level (1 page)
-            url
-        ]
+        print(f"🔄 Starting {engine} site mirror of {url}...")
         
-        # Update status to downloading
-        with download_lock:
-            download_status[download_id].update({
-                'status': 'downloading',
-                'progress': 10,
-                'message': 'Downloading site with wget...'
-            })
-        
-        # Run wget
-        result = subprocess.run(wget_cmd, capture_output=True, text=True, timeout=300)
+        with job_metrics.phase('crawl') as phase:
+            if engine == 'wget':
+                error_msg = run_wget(url, download_id, output_dir, cancel_event, phase, scope)
+            else:
+                previous = None
+                if refresh_of:
+                    previous_dir = (job_store.get(refresh_of) or {}).get('output_dir')
+                    previous = previous_dir and load_crawl_state(refresh_of, previous_dir)
+                    if not previous:
+                        print(f"⚠️ No crawl state for {refresh_of}, doing a full mirror")
+                checkpoint = None
+                if resume:
+                    checkpoint = crawler.load_checkpoint(crawl_checkpoint_path(download_id))
+                    if not checkpoint:
+                        # Whatever is on disk may be linked to shared copies; start from an empty folder
+                        print(f"⚠️ Checkpoint of {download_id} is unreadable, mirroring from scratch")
+                        shutil.rmtree(output_dir, ignore_errors=True)
+                error_msg = run_async_crawl(url, download_id, output_dir, cancel_event, phase, scope, previous,
+                                            checkpoint)
+            if error_msg is not None:
+                phase['errors'] += 1
+        check_cancelled()
         
-        if result.returncode == 0:
+        if error_msg is None:
             # Update status to processing
-            with download_lock:
-                download_status[download_id].update({
-                    'status': 'processing',
-                    'progress': 80,
-                    'message': 'Download complete. Generating site map...'
-                })
+            job_store.update(download_id, {
+                'status': 'processing',
+                'progress': 80,
+                'message': 'Download complete. Generating site map...'
+            })
             
             # Download images with Playwright
+            image_data = []
             try:
-                download_images_with_playwright(url, output_dir)
+                image_data = download_images_with_playwright(url, output_dir, job_metrics)
             except Exception as e:
                 print(f"Image scraping failed: {e}")
+            check_cancelled()
+            
+            # Point root-relative and same-origin links, and captured images, at the local copies
+            try:
+                with job_metrics.phase('rewrite') as phase:
+                    result = rewriter.rewrite_mirror(output_dir, image_url_map(output_dir, url, image_data))
+                    phase['requests'] = result['documents']
+                    phase['errors'] = len(result['errors'])
+                for error in result['errors']:
+                    print(f"Link rewriting error: {error}")
+            except Exception as e:
+                print(f"Link rewriting failed: {e}")
+            check_cancelled()
+            
+            # Swap identical files for links into the shared blob store
+            if blob_store:
+                job_store.update(download_id, {
+                    'progress': 90,
+                    'message': 'Deduplicating files...'
+                })
+                try:
+                    with job_metrics.phase('dedup') as phase:
+                        dedup = blob_store.ingest(download_id, output_dir)
+                        phase['requests'] = dedup['files']
+                        phase['cache_hits'] = dedup['deduplicated']
+                    job_store.update(download_id, {'dedup': dedup})
+                except Exception as e:
+                    print(f"Blob store ingest failed: {e}")
+                check_cancelled()
+            
+            # Index the files once so serving them needs no directory scans
+            try:
+                with job_metrics.phase('manifest') as phase:
+                    blob_manifest = (blob_store and blob_store.manifest(download_id)) or {}
+                    manifest = file_manifests.build(
+                        download_id, output_dir, get_main_website_folder(output_dir, url),
+                        hashes={path: entry['sha256'] for path, entry in blob_manifest.items()}
+                    )
+                    phase['requests'] = len(manifest['files'])
+                    phase['cache_hits'] = len(blob_manifest)
+            except Exception as e:
+                print(f"File manifest failed: {e}")
+            check_cancelled()
 
             # Update status to completed
-            with download_lock:
-                download_status[download_id].update({
-                    'status': 'completed',
-                    'progress': 100,
-                    'message': 'Site mirror complete!'
-                })
-        else:
-            error_msg = f"wget failed with return code {result.returncode}"
-            if result.stderr:
-                error_msg += f"\nError: {result.stderr}"
+            job_store.update(download_id, {
+                'status': 'completed',
+                'progress': 100,
+                'message': 'Site mirror complete!',
+                'disk_bytes': download_disk_bytes(download_id, output_dir)
+            })
             
+            # The mirror is immutable from here on, so build the full archive once up front
+            if not batch_id:
+                try:
+                    with job_metrics.phase('archive') as phase:
+                        archive_cache.build(download_id, 'full', archives.iter_zip(archive_entries(output_dir, 'full', url)))
+                        archive_path = archive_cache.get(download_id, 'full')
+                        phase['bytes'] = os.path.getsize(archive_path) if archive_path else 0
+                except Exception as e:
+                    print(f"Archive prebuild failed: {e}")
+        else:
             # Update status to failed
-            with download_lock:
-                download_status[download_id].update({
-                    'status': 'failed',
-                    'progress': 0,
-                    'message': error_msg
-                })
-                
-    except subprocess.TimeoutExpired:
-        with download_lock:
-            download_status[download_id].update({
+            job_store.update(download_id, {
                 'status': 'failed',
                 'progress': 0,
-                'message': 'Download timed out after 5 minutes'
+                'message': error_msg,
+                'resumable': can_resume(download_id)
             })
+                
+    except JobCancelled:
+        job_store.update(download_id, {
+            'status': 'cancelled',
+            'message': 'Download cancelled',
+            'resumable': can_resume(download_id)
+        })
+    except (subprocess.TimeoutExpired, TimeoutError):
+        resumable = can_resume(download_id)
+        job_store.update(download_id, {
+            'status': 'failed',
+            'progress': 0,
+            'message': (f'Download timed out after {crawler.CRAWL_TIMEOUT} seconds'
+                        + ('; resume it to continue where it stopped' if resumable else '')),
+            'resumable': resumable
+        })
     except Exception as e:
-        with download_lock:
-            download_status[download_id].update({
-                'status': 'failed',
-                'progress': 0,
-                'message': f'Download failed: {str(e)}'
-            })
+        job_store.update(download_id, {
+            'status': 'failed',
+            'progress': 0,
+            'message': f'Download failed: {str(e)}',
+            'resumable': can_resume(download_id)
+        })
 
 # Remove all generate_site_map calls and the /api/sitemap endpoint
 # In download_site_worker and download_in_memory, do not call generate_site_map
@@ -239,69 +703,680 @@ def start_download():
             'message': error_msg
         }), 400
     
+    settings, error = download_settings(data)
+    if error:
+        return error
+    
+    return queue_download(url, *settings)
+
+def download_settings(data):
+    """(engine, priority, crawl options) of a download request, or (None, error response)"""
+    engine = data.get('engine', CRAWL_ENGINE)
+    if engine not in CRAWL_ENGINES:
+        return None, (jsonify({
+            'error': 'Invalid engine',
+            'message': f"engine must be one of: {', '.join(CRAWL_ENGINES)}"
+        }), 400)
+    
     # Check if wget is installed
-    wget_ok, error_msg = check_wget_installed()
-    if not wget_ok:
-        return jsonify({
-            'error': 'System requirement not met',
-            'message': error_msg
-        }), 500
+    if engine == 'wget':
+        wget_ok, error_msg = check_wget_installed()
+        if not wget_ok:
+            return None, (jsonify({
+                'error': 'System requirement not met',
+                'message': error_msg
+            }), 500)
     
+    priority = data.get('priority', 0)
+    if not isinstance(priority, int):
+        return None, (jsonify({
+            'error': 'Invalid priority',
+            'message': 'priority must be an integer (higher runs first)'
+        }), 400)
+    
+    scope, error = crawl_scope(data, default_depth=1)
+    if error:
+        return None, error
+    if scope.render and engine == 'wget':
+        return None, (jsonify({
+            'error': 'Invalid crawl options',
+            'message': 'render needs the async engine'
+        }), 400)
+    return (engine, priority, scope.to_options()), None
+
+def queue_download(url, engine, priority, options, refresh_of=None):
+    """Create a download and queue it for the worker pool; returns the API response"""
+    try:
+        download_id = create_download(url, engine, priority, options, refresh_of)
+    except QueueFull as e:
+        return queue_full_response(e)
+    
+    return jsonify({
+        'download_id': download_id,
+        'message': 'Refresh queued' if refresh_of else 'Download queued',
+        'url': url,
+        'queue_position': job_scheduler.position(download_id),
+        'status_endpoint': f'/api/status/{download_id}',
+        'cancel_endpoint': f'/api/cancel/{download_id}',
+        'files_endpoint': f'/api/files/{download_id}'
+    })
+
+def queue_full_response(error):
+    response = jsonify({
+        'error': 'Too many downloads queued',
+        'message': str(error)
+    })
+    response.headers['Retry-After'] = '30'
+    return response, 429
+
+def create_download(url, engine, priority, options, refresh_of=None, batch_id=None):
+    """Create a download record and submit it to the worker pool; returns its ID or raises QueueFull"""
     # Generate unique download ID and output directory
     download_id = str(uuid.uuid4())
     output_dir = os.path.join(DOWNLOAD_DIR, download_id)
     
-    # Start download in background thread
-    thread = threading.Thread(
-        target=download_site_worker, 
-        args=(url, download_id, output_dir)
-    )
-    thread.daemon = True
-    thread.start()
+    job = {
+        'status': 'queued',
+        'progress': 0,
+        'message': 'Waiting for a free worker...',
+        'url': url,
+        'output_dir': output_dir,
+        'engine': engine,
+        'priority': priority,
+        'options': options,
+        'worker': worker_id()
+    }
+    if refresh_of:
+        job['refresh_of'] = refresh_of
+    if batch_id:
+        job['batch_id'] = batch_id
+    job_store.create(download_id, job)
+    try:
+        job_scheduler.submit(
+            download_id,
+            download_site_worker,
+            args=(url, download_id, output_dir, engine, refresh_of, options, batch_id),
+            priority=priority
+        )
+    except QueueFull:
+        job_store.delete(download_id)
+        raise
+    return download_id
+
+@app.route('/api/refresh/<download_id>', methods=['POST'])
+def refresh_download(download_id):
+    """Re-mirror a completed download, fetching only what changed since"""
+    data = request.get_json(silent=True) or {}
+    status = job_store.get(download_id)
+    if status is None:
+        return jsonify({'error': 'Download not found'}), 404
+    if status['status'] != 'completed':
+        return jsonify({'error': 'Only completed downloads can be refreshed'}), 409
+    if not os.path.exists(os.path.join(crawl_state_dir(download_id), 'resources.json')):
+        return jsonify({
+            'error': 'Download cannot be refreshed',
+            'message': 'No crawl state was recorded (it was mirrored with wget)'
+        }), 409
+    
+    priority = data.get('priority', status.get('priority', 0))
+    if not isinstance(priority, int):
+        return jsonify({
+            'error': 'Invalid priority',
+            'message': 'priority must be an integer (higher runs first)'
+        }), 400
+    # Refresh with the options of the original download (older records have none)
+    options = status.get('options') or crawler.CrawlScope().to_options()
+    return queue_download(status['url'], 'async', priority, options, refresh_of=download_id)
+
+def resume_job(download_id, job):
+    """Queue a failed or cancelled download to continue from its checkpoint in its own folder.
+
+    Returns False if the job changed state meanwhile; raises QueueFull.
+    """
+    if not job_store.update(download_id, {
+        'status': 'queued',
+        'progress': 0,
+        'message': 'Waiting for a free worker...',
+        'worker': worker_id(),
+        'cancel_requested': False,
+        'resumable': False
+    }, expect=('failed', 'cancelled')):
+        return False
+    try:
+        job_scheduler.submit(
+            download_id,
+            download_site_worker,
+            args=(job['url'], download_id, job['output_dir'], 'async', job.get('refresh_of'),
+                  job.get('options'), job.get('batch_id'), True),
+            priority=job.get('priority', 0)
+        )
+    except QueueFull:
+        job_store.update(download_id, {'status': job['status'], 'message': job.get('message'), 'resumable': True})
+        raise
+    return True
+
+@app.route('/api/resume/<download_id>', methods=['POST'])
+def resume_download(download_id):
+    """Continue a failed or cancelled download from its last crawl checkpoint"""
+    status = job_store.get(download_id)
+    if status is None:
+        return jsonify({'error': 'Download not found'}), 404
+    if status.get('batch_id'):
+        return jsonify({'error': 'Downloads of a batch cannot be resumed on their own'}), 409
+    if status['status'] not in ('failed', 'cancelled'):
+        return jsonify({'error': 'Only failed or cancelled downloads can be resumed'}), 409
+    if not can_resume(download_id):
+        return jsonify({
+            'error': 'Download cannot be resumed',
+            'message': 'No crawl checkpoint was recorded (it was mirrored with wget, or its crawl had finished)'
+        }), 409
+    
+    try:
+        if not resume_job(download_id, status):
+            return jsonify({'error': 'Only failed or cancelled downloads can be resumed'}), 409
+    except QueueFull as e:
+        return queue_full_response(e)
     
     return jsonify({
         'download_id': download_id,
-        'message': 'Download started',
-        'url': url,
+        'message': 'Resume queued',
+        'url': status['url'],
+        'queue_position': job_scheduler.position(download_id),
         'status_endpoint': f'/api/status/{download_id}',
+        'cancel_endpoint': f'/api/cancel/{download_id}',
         'files_endpoint': f'/api/files/{download_id}'
     })
 
+@app.route('/api/batch', methods=['POST'])
+def start_batch():
+    """Mirror a list of URLs, or every page of a sitemap, as one download with one combined tree"""
+    data = request.get_json()
+    if not data or ('urls' in data) == ('sitemap' in data):
+        return jsonify({
+            'error': 'URLs or a sitemap are required',
+            'usage': 'Send JSON with {"urls": ["https://example.com/a", ...]} or {"sitemap": "https://example.com/sitemap.xml"}'
+        }), 400
+    
+    urls = []
+    sitemap_url = data.get('sitemap')
+    if sitemap_url is not None:
+        is_valid, error_msg = validate_url(sitemap_url if isinstance(sitemap_url, str) else '')
+        if not is_valid:
+            return jsonify({'error': 'Invalid sitemap URL', 'message': error_msg}), 400
+    else:
+        if not isinstance(data['urls'], list) or not data['urls']:
+            return jsonify({'error': 'Invalid URLs', 'message': 'urls must be a non-empty list'}), 400
+        for url in data['urls']:
+            is_valid, error_msg = validate_url(url if isinstance(url, str) else '')
+            if not is_valid:
+                return jsonify({'error': 'Invalid URL', 'message': f'{url}: {error_msg}'}), 400
+            if url not in urls:
+                urls.append(url)
+        if len(urls) > MAX_BATCH_URLS:
+            return jsonify({
+                'error': 'Too many URLs',
+                'message': f'A batch mirrors at most {MAX_BATCH_URLS} URLs'
+            }), 400
+    
+    settings, error = download_settings(data)
+    if error:
+        return error
+    engine, priority, options = settings
+    
+    batch_id = str(uuid.uuid4())
+    output_dir = os.path.join(DOWNLOAD_DIR, batch_id)
+    job_store.create(batch_id, {
+        'kind': 'batch',
+        'status': 'queued',
+        'progress': 0,
+        'message': 'Reading sitemap...' if sitemap_url else f'Queueing {len(urls)} URLs...',
+        'url': sitemap_url or urls[0],
+        'sitemap': sitemap_url,
+        'output_dir': output_dir,
+        'engine': engine,
+        'priority': priority,
+        'options': options,
+        'items': [{'url': url, 'download_id': None, 'status': 'pending', 'progress': 0} for url in urls],
+        'worker': worker_id()
+    })
+    # The coordinator only queues and watches; the downloads themselves run on the worker pool
+    threading.Thread(target=run_batch, args=(batch_id, output_dir, urls, sitemap_url, engine, priority, options),
+                     name=f'batch-{batch_id[:8]}', daemon=True).start()
+    
+    return jsonify({
+        'download_id': batch_id,
+        'message': 'Batch queued',
+        'urls': len(urls) if not sitemap_url else None,
+        'status_endpoint': f'/api/status/{batch_id}',
+        'cancel_endpoint': f'/api/cancel/{batch_id}',
+        'files_endpoint': f'/api/files/{batch_id}'
+    })
+
+def run_batch(batch_id, output_dir, urls, sitemap_url, engine, priority, options):
+    """Coordinate a batch: keep BATCH_CONCURRENCY of its downloads queued or running, then merge them"""
+    try:
+        if sitemap_url:
+            job_store.update(batch_id, {'status': 'starting'})
+            try:
+                urls = crawler.run_sync(sitemaps.fetch_sitemap_urls(sitemap_url, MAX_BATCH_URLS),
+                                        timeout=crawler.CRAWL_TIMEOUT)
+            except (sitemaps.SitemapError, TimeoutError) as e:
+                job_store.update(batch_id, {'status': 'failed', 'message': f'Sitemap could not be read: {e}'})
+                return
+            if not urls:
+                job_store.update(batch_id, {'status': 'failed', 'message': 'Sitemap lists no URLs'})
+                return
+            print(f"🗺️ Sitemap {sitemap_url} lists {len(urls)} URLs")
+        
+        items = [{'url': url, 'download_id': None, 'status': 'pending', 'progress': 0} for url in urls]
+        pending = list(range(len(items)))
+        running = []
+        last = None
+        job_store.update(batch_id, {'status': 'downloading', 'items': [dict(item) for item in items]})
+        while pending or running:
+            if (job_store.get(batch_id) or {}).get('cancel_requested'):
+                for index in running:
+                    if job_scheduler.cancel(items[index]['download_id']) == 'queued':
+                        job_store.update(items[index]['download_id'], {
+                            'status': 'cancelled',
+                            'message': 'Download cancelled'
+                        })
+                for index in running + pending:
+                    items[index]['status'] = 'cancelled'
+                job_store.update(batch_id, {'status': 'cancelled', 'message': 'Batch cancelled',
+                                            'items': [dict(item) for item in items]})
+                return
+            
+            # Top up the pool; a full queue just delays the rest of the batch
+            while pending and len(running) < BATCH_CONCURRENCY:
+                try:
+                    items[pending[0]]['download_id'] = create_download(
+                        items[pending[0]]['url'], engine, priority, options, batch_id=batch_id)
+                except QueueFull:
+                    break
+                items[pending[0]]['status'] = 'queued'
+                running.append(pending.pop(0))
+            
+            for index in list(running):
+                child = job_store.get(items[index]['download_id']) or {'status': 'failed', 'progress': 0}
+                items[index]['status'] = child['status']
+                items[index]['progress'] = child.get('progress', 0)
+                if child['status'] not in ACTIVE_STATUSES:
+                    running.remove(index)
+                    if child['status'] != 'completed':
+                        items[index]['message'] = child.get('message')
+            
+            counts = {}
+            for item in items:
+                counts[item['status']] = counts.get(item['status'], 0) + 1
+            finished = sum(1 for item in items if item['status'] in TERMINAL_STATUSES)
+            progress = sum(100 if item['status'] in TERMINAL_STATUSES else item['progress']
+                           for item in items)
+            update = {
+                'progress': int(90 * progress / (100 * len(items))),  # the merge takes the last 10%
+                'message': f"Mirrored {finished} of {len(items)} URLs...",
+                'counts': counts,
+                'items': [dict(item) for item in items]
+            }
+            if update != last:
+                job_store.update(batch_id, update)
+                last = update
+            if pending or running:
+                time.sleep(BATCH_POLL_INTERVAL)
+        
+        completed = [item for item in items if item['status'] == 'completed']
+        if not completed:
+            job_store.update(batch_id, {'status': 'failed', 'progress': 0,
+                                        'message': f'None of the {len(items)} URLs could be mirrored'})
+            return
+        finish_batch(batch_id, output_dir, items, completed)
+    except Exception as e:
+        job_store.update(batch_id, {'status': 'failed', 'progress': 0, 'message': f'Batch failed: {e}'})
+
+def finish_batch(batch_id, output_dir, items, completed):
+    """Merge the completed downloads of a batch into one tree, then dedup, index and archive it"""
+    job_metrics = metrics.JobMetrics(
+        registry=metrics_registry,
+        on_change=lambda phases: job_store.update(batch_id, {'phases': phases})
+    )
+    job_store.update(batch_id, {'status': 'processing', 'progress': 90, 'message': 'Merging mirrors...'})
+    hashes, conflicts = merge_batch(output_dir, [item['download_id'] for item in completed])
+    if conflicts:
+        print(f"⚠️ Batch {batch_id}: {len(conflicts)} files differ between its downloads, kept the first")
+    try:
+        write_batch_index(output_dir, items, hashes)
+    except OSError as e:
+        print(f"Batch index failed: {e}")
+    
+    if blob_store:
+        try:
+            with job_metrics.phase('dedup') as phase:
+                dedup = blob_store.ingest(batch_id, output_dir, hashes=hashes)
+                phase['requests'] = dedup['files']
+                phase['cache_hits'] = dedup['deduplicated']
+            job_store.update(batch_id, {'dedup': dedup})
+        except Exception as e:
+            print(f"Blob store ingest failed: {e}")
+    
+    # The tree holds one folder per host, so serve it from the top
+    try:
+        with job_metrics.phase('manifest') as phase:
+            manifest = file_manifests.build(batch_id, output_dir, output_dir, hashes=hashes)
+            phase['requests'] = len(manifest['files'])
+            phase['cache_hits'] = len(hashes)
+    except Exception as e:
+        print(f"File manifest failed: {e}")
+    
+    failed = len(items) - len(completed)
+    job_store.update(batch_id, {
+        'status': 'completed',
+        'progress': 100,
+        'message': f"Mirrored {len(completed)} of {len(items)} URLs" + (f" ({failed} failed)" if failed else ''),
+        'conflicts': len(conflicts),
+        'disk_bytes': download_disk_bytes(batch_id, output_dir)
+    })
+    try:
+        with job_metrics.phase('archive') as phase:
+            archive_cache.build(batch_id, 'full', archives.iter_zip(archive_entries(output_dir, 'full')))
+            archive_path = archive_cache.get(batch_id, 'full')
+            phase['bytes'] = os.path.getsize(archive_path) if archive_path else 0
+    except Exception as e:
+        print(f"Archive prebuild failed: {e}")
+
+def write_batch_index(output_dir, items, hashes):
+    """Write the index.html /api/files/<batch_id> opens: every URL of the batch, linked to its mirrored page"""
+    rows = []
+    for item in items:
+        path = crawler.url_to_local_path(item['url']).replace(os.sep, '/')
+        label = html.escape(item['url'])
+        if path in hashes:
+            rows.append(f'<li><a href="{html.escape(quote(path))}">{label}</a></li>')
+        else:
+            rows.append(f"<li>{label} ({html.escape(item['status'])})</li>")
+    with open(os.path.join(output_dir, 'index.html'), 'w', encoding='utf-8') as f:
+        f.write('<!doctype html>\n<meta charset="utf-8">\n<title>Mirrored batch</title>\n'
+                f'<ul>\n' + '\n'.join(rows) + '\n</ul>\n')
+
+def merge_batch(output_dir, download_ids):
+    """Link the files of completed downloads into output_dir; returns ({path: sha256}, [conflicting paths]).
+
+    Paths start with the host folder, so only downloads of the same host overlap.
+    The first download to have a path wins; image_metadata.json lists are combined.
+    """
+    hashes = {}
+    conflicts = []
+    image_metadata = {}  # path -> entries by src
+    for download_id in download_ids:
+        download_dir = (job_store.get(download_id) or {}).get('output_dir')
+        if not download_dir:
+            continue  # deleted since it finished
+        known = {path: entry['sha256'] for path, entry in ((blob_store and blob_store.manifest(download_id)) or {}).items()}
+        for file_path, path in archives.walk_entries(download_dir):
+            if os.path.basename(path) == 'image_metadata.json':
+                try:
+                    with open(file_path, encoding='utf-8') as f:
+                        for image in json.load(f):
+                            image_metadata.setdefault(path, {}).setdefault(image['src'], image)
+                except (OSError, ValueError, KeyError, TypeError) as e:
+                    print(f"Skipping unreadable {file_path}: {e}")
+                continue
+            sha256 = known.get(path) or file_digest(file_path)
+            if path in hashes:
+                if hashes[path] != sha256:
+                    conflicts.append(path)
+                continue
+            target = os.path.join(output_dir, path)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            link_or_copy(file_path, target)
+            hashes[path] = sha256
+    for path, images in image_metadata.items():
+        write_image_metadata(os.path.join(output_dir, path), list(images.values()))
+    return hashes, conflicts
+
+def with_queue_position(status, download_id):
+    if status['status'] == 'queued':
+        status['queue_position'] = job_scheduler.position(download_id)
+    return status
+
 @app.route('/api/status/<download_id>')
 def get_status(download_id):
     """Get download status"""
-    with download_lock:
-        if download_id not in download_status:
-            return jsonify({'error': 'Download not found'}), 404
-        
-        return jsonify(download_status[download_id])
+    status = job_store.get(download_id)
+    if status is None:
+        return jsonify({'error': 'Download not found'}), 404
+    return jsonify(with_queue_position(status, download_id))
+
+def sse_event(event, data, event_id=None):
+    """One Server-Sent Events message"""
+    message = f"id: {event_id}\n" if event_id is not None else ''
+    return f"{message}event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def event_stream(generate):
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # keep nginx from buffering the stream
+    })
+
+@app.route('/api/status/<download_id>/stream')
+def stream_status(download_id):
+    """Server-Sent Events: a 'status' event each time the download changes, until it finishes"""
+    since = job_store.last_seq()
+    status = job_store.get(download_id)
+    if status is None:
+        return jsonify({'error': 'Download not found'}), 404
+
+    def generate():
+        current = with_queue_position(status, download_id)
+        latest = since
+        yield sse_event('status', current, latest)
+        while current['status'] in ACTIVE_STATUSES:
+            seq = job_store.wait(latest, STREAM_HEARTBEAT)
+            if seq == latest:
+                yield ': keep-alive\n\n'
+                continue
+            changed = job_store.changes(latest, download_id)
+            latest = max([seq] + [job['seq'] for job in changed])
+            if changed:
+                current = {k: v for k, v in changed[-1].items() if k not in ('id', 'seq')}
+            elif current['status'] != 'queued':
+                continue
+            # Other jobs starting moves this one up the queue, so recheck its position too
+            position = current.get('queue_position')
+            current = with_queue_position(current, download_id)
+            if changed or current.get('queue_position') != position:
+                yield sse_event('status', current, latest)
+
+    return event_stream(generate)
+
+@app.route('/api/cancel/<download_id>', methods=['POST'])
+def cancel_download(download_id):
+    """Cancel a queued or running download"""
+    status = job_store.get(download_id)
+    if status is None:
+        return jsonify({'error': 'Download not found'}), 404
+    
+    if status.get('kind') == 'batch':
+        # Whichever process coordinates the batch notices the flag and cancels its downloads
+        if not job_store.update(download_id, {'cancel_requested': True, 'message': 'Cancelling...'},
+                                expect=ACTIVE_STATUSES):
+            return jsonify({'error': 'Batch is not queued or running'}), 409
+        return jsonify({'download_id': download_id, 'message': 'Cancelling batch'})
+    
+    previous = job_scheduler.cancel(download_id)
+    if previous == 'queued':
+        job_store.update(download_id, {
+            'status': 'cancelled',
+            'message': 'Download cancelled'
+        })
+    elif previous == 'running':
+        job_store.update(download_id, {'message': 'Cancelling...'})
+    elif status['status'] in ACTIVE_STATUSES and status.get('worker') != worker_id():
+        # Another server process owns the job; its cancellation watcher stops it
+        if not job_store.update(download_id, {'cancel_requested': True, 'message': 'Cancelling...'},
+                                expect=ACTIVE_STATUSES):
+            return jsonify({'error': 'Download is not queued or running'}), 409
+        previous = 'queued' if status['status'] == 'queued' else 'running'
+    else:
+        return jsonify({'error': 'Download is not queued or running'}), 409
+    return jsonify({'download_id': download_id, 'message': f'Cancelled {previous} download'})
+
+@app.route('/api/downloads/<download_id>', methods=['DELETE'])
+def remove_download(download_id):
+    """Delete a finished download (a batch with its downloads) and free its disk space"""
+    status = job_store.get(download_id)
+    if status is None:
+        return jsonify({'error': 'Download not found'}), 404
+    if status['status'] in ACTIVE_STATUSES:
+        return jsonify({'error': 'Download is still queued or running', 'message': 'Cancel it first'}), 409
+    batch = status.get('batch_id') and job_store.get(status['batch_id'])
+    if batch and batch['status'] in ACTIVE_STATUSES:
+        return jsonify({'error': 'Download is part of a running batch'}), 409
+    
+    deleted = [download_id] if delete_download(download_id) else []
+    if not deleted:
+        return jsonify({'error': 'Download is already being deleted'}), 409
+    for item in status.get('items', []):
+        if item['download_id'] and delete_download(item['download_id']):
+            deleted.append(item['download_id'])
+    if blob_store:
+        # Blobs only these downloads used are unlinked now that their files are gone
+        threading.Thread(target=blob_store.collect_garbage, daemon=True).start()
+    return jsonify({'download_id': download_id, 'deleted': deleted, 'message': 'Download deleted'})
+
+def delete_download(download_id, expect=TERMINAL_STATUSES):
+    """Remove a download's files, crawl state, manifests, archives and record; False if its status is not in expect"""
+    status = job_store.get(download_id)
+    if status is None or not job_store.update(download_id, {
+        'status': 'deleting',
+        'message': 'Deleting...',
+        'deleting_since': time.time()
+    }, expect=expect):
+        return False
+    file_manifests.invalidate(download_id)
+    archive_cache.invalidate(download_id)
+    output_dir = status.get('output_dir')
+    # Never follow a record out of the downloads directory
+    if output_dir and os.path.dirname(os.path.abspath(output_dir)) == os.path.abspath(DOWNLOAD_DIR):
+        shutil.rmtree(output_dir, ignore_errors=True)
+    shutil.rmtree(crawl_state_dir(download_id), ignore_errors=True)
+    if blob_store:
+        blob_store.release(download_id)
+    job_store.delete(download_id)
+    last_touched.pop(download_id, None)
+    print(f"🗑️ Deleted download {download_id}")
+    return True
+
+def touch_download(download_id):
+    """Record that a download was used, for least-recently-used cleanup; written at most once a minute"""
+    now = time.time()
+    if now - last_touched.get(download_id, 0) < ACCESS_TOUCH_INTERVAL:
+        return
+    last_touched[download_id] = now
+    job_store.update(download_id, {'last_access': now}, expect=TERMINAL_STATUSES)
+
+def tree_bytes(root):
+    """Size of the files under root, counting hardlinks to the same file once"""
+    seen = set()
+    total = 0
+    for dirpath, _, files in os.walk(root):
+        for name in files:
+            try:
+                stat = os.lstat(os.path.join(dirpath, name))
+            except OSError:
+                continue
+            if (stat.st_dev, stat.st_ino) not in seen:
+                seen.add((stat.st_dev, stat.st_ino))
+                total += stat.st_size
+    return total
+
+def held_files(download_id, output_dir):
+    """{(device, inode): size} of the files a download holds, in its folder and its crawl state"""
+    files = {}
+    for root in ([output_dir] if output_dir else []) + [crawl_state_dir(download_id)]:
+        for dirpath, _, names in os.walk(root):
+            for name in names:
+                try:
+                    stat = os.lstat(os.path.join(dirpath, name))
+                except OSError:
+                    continue
+                files[(stat.st_dev, stat.st_ino)] = stat.st_size
+    return files
+
+def download_disk_bytes(download_id, output_dir):
+    """Bytes a download takes: from its blob manifest when it has one, else walked once; plus its crawl state"""
+    manifest = blob_store and blob_store.manifest(download_id)
+    if manifest is not None:
+        total = sum(entry['size'] for entry in manifest.values())
+    else:
+        total = tree_bytes(output_dir) if output_dir else 0
+    return total + tree_bytes(crawl_state_dir(download_id))
 
 @app.route('/api/downloads')
 def list_downloads():
-    """List all downloads"""
-    with download_lock:
-        downloads = []
-        for download_id, status in download_status.items():
-            downloads.append({
-                'id': download_id,
-                'url': status.get('url'),
-                'status': status.get('status'),
-                'progress': status.get('progress', 0),
-                'message': status.get('message')
-            })
-        return jsonify(downloads)
+    """List downloads, newest first; paginate with ?limit=&offset= and filter with ?status="""
+    try:
+        limit = min(int(request.args.get('limit', DOWNLOADS_PAGE_SIZE)), 1000)
+        offset = max(int(request.args.get('offset', 0)), 0)
+    except ValueError:
+        return jsonify({'error': 'limit and offset must be integers'}), 400
+    jobs, total = job_store.list(offset=offset, limit=limit, status=request.args.get('status'))
+    response = jsonify([download_summary(status) for status in jobs])
+    response.headers['X-Total-Count'] = str(total)
+    return response
+
+def download_summary(status):
+    """The fields /api/downloads lists for a job"""
+    return {
+        'id': status['id'],
+        'kind': status.get('kind', 'download'),
+        'url': status.get('url'),
+        'status': status.get('status'),
+        'progress': status.get('progress', 0),
+        'message': status.get('message'),
+        'disk_bytes': status.get('disk_bytes'),
+        'resumable': status.get('resumable', False)
+    }
+
+@app.route('/api/downloads/stream')
+def stream_downloads():
+    """Server-Sent Events for every download: a 'snapshot' of the first page, then a 'download' per change
+    and a 'deleted' per removal"""
+    since = job_store.last_seq()
+    jobs, total = job_store.list(limit=DOWNLOADS_PAGE_SIZE)
+
+    def generate():
+        latest = since
+        yield sse_event('snapshot', {'downloads': [download_summary(job) for job in jobs], 'total': total}, latest)
+        while True:
+            seq = job_store.wait(latest, STREAM_HEARTBEAT)
+            if seq == latest:
+                yield ': keep-alive\n\n'
+                continue
+            for job in job_store.changes(latest):
+                latest = max(latest, job['seq'])
+                if job['status'] == 'deleted':
+                    yield sse_event('deleted', {'id': job['id']}, job['seq'])
+                else:
+                    yield sse_event('download', download_summary(job), job['seq'])
+            latest = max(latest, seq)
+
+    return event_stream(generate)
 
 @app.route('/api/files/<download_id>')
 @app.route('/api/files/<download_id>/<path:filename>')
 def serve_files(download_id, filename='index.html'):
     """Serve downloaded files"""
-    with download_lock:
-        if download_id not in download_status:
-            return jsonify({'error': 'Download not found'}), 404
-        
-        status = download_status[download_id]
-        if status['status'] != 'completed':
-            return jsonify({'error': 'Download not completed'}), 400
+    manifest = file_manifests.get(download_id)
+    if manifest is not None:
+        touch_download(download_id)
+        return serve_manifest_file(download_id, manifest, filename)
+    
+    # Mirrors finished before manifests existed (or whose indexing failed)
+    status = job_store.get(download_id)
+    if status is None:
+        return jsonify({'error': 'Download not found'}), 404
+    if status['status'] != 'completed':
+        return jsonify({'error': 'Download not completed'}), 400
     
     output_dir = status.get('output_dir')
     if not output_dir or not os.path.exists(output_dir):
@@ -312,172 +1387,140 @@ def serve_files(download_id, filename='index.html'):
     if not os.path.exists(file_path):
         return jsonify({'error': f'File {filename} not found'}), 404
 
-    return send_from_directory(website_folder, filename)
+    touch_download(download_id)
+    return send_from_directory(os.path.abspath(website_folder), filename)
 
-@app.route('/api/download-zip/<download_id>')
-def download_zip(download_id):
-    """Create and serve a downloadable zip file of the scraped content"""
-    with download_lock:
-        if download_id not in download_status:
-            return jsonify({'error': 'Download not found'}), 404
-        
-        status = download_status[download_id]
-        if status['status'] != 'completed':
-            return jsonify({'error': 'Download not completed'}), 400
+def serve_manifest_file(download_id, manifest, filename):
+    """Serve a file of a completed download from its manifest: no directory scans, strong ETags,
+    304s, Range requests and the smallest precompressed variant the client accepts"""
+    entry = manifest['files'].get(filename)
+    if entry is None:
+        return jsonify({'error': f'File {filename} not found'}), 404
     
-    output_dir = status.get('output_dir')
-    if not output_dir or not os.path.exists(output_dir):
+    path = os.path.join(manifest['output_dir'], manifest['website_folder'], filename)
+    etag = entry['sha256']
+    encoding = next((e for e in filemanifest.ENCODINGS
+                     if e in entry['encodings'] and request.accept_encodings[e] > 0), None)
+    if encoding:
+        path = file_manifests.variant_path(entry['sha256'], encoding)
+        etag = f"{etag}-{encoding}"  # each representation needs its own strong ETag
+    try:
+        response = send_file(path, mimetype=entry['type'], conditional=True, etag=etag,
+                             last_modified=entry['mtime'], max_age=0)
+    except FileNotFoundError:
+        # Deleted by another server process since the manifest was loaded
+        file_manifests.forget(download_id)
         return jsonify({'error': 'Files not found'}), 404
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if entry['encodings']:
+        response.vary.add('Accept-Encoding')
+    return response
+
+# Archive variant -> suffix of the downloaded file name
+ARCHIVE_VARIANTS = {
+    'full': 'scraped-content',
+    'images': 'images',
+    'html': 'html-content'
+}
+
+def archive_entries(output_dir, variant, url=None):
+    """(file_path, arcname) pairs that make up an archive variant"""
+    if variant == 'html':
+        # Add HTML files and site map, exclude images
+        return archives.walk_entries(output_dir, extensions=('.html', '.htm', '.md', '.json'), skip_dirs=('images',))
+    if variant == 'images':
+        return image_archive_entries(output_dir, url)
+    return archives.walk_entries(output_dir)
+
+def image_archive_entries(output_dir, url=None):
+    # download_images_with_playwright writes into the website folder
+    website_folder = get_main_website_folder(output_dir, url)
+    images_dir = os.path.join(website_folder, "images")
     
-    # Create a temporary zip file
-    temp_zip = tempfile.NamedTemporaryFile(delete=False, suffix='.zip')
-    temp_zip.close()
-    
-    try:
-        with zipfile.ZipFile(temp_zip.name, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            # Add all files from the output directory
-            for root, dirs, files in os.walk(output_dir):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    # Calculate relative path for zip
-                    arcname = os.path.relpath(file_path, output_dir)
-                    zipf.write(file_path, arcname)
-        
-        # Get the domain name for the filename
-        domain = urlparse(status['url']).netloc
-        zip_filename = f"{domain}-scraped-content.zip"
-        
-        return send_file(
-            temp_zip.name,
-            as_attachment=True,
-            download_name=zip_filename,
-            mimetype='application/zip'
-        )
+    # Add all image files
+    for file in sorted(os.listdir(images_dir)):
+        file_path = os.path.join(images_dir, file)
+        if os.path.isfile(file_path):
+            yield file_path, f"images/{file}"
     
-    except Exception as e:
-        # Clean up temp file on error
-        if os.path.exists(temp_zip.name):
-            os.unlink(temp_zip.name)
-        return jsonify({'error': f'Failed to create zip: {str(e)}'}), 500
+    # Add image metadata if it exists
+    metadata_path = os.path.join(website_folder, "image_metadata.json")
+    if os.path.exists(metadata_path):
+        yield metadata_path, "image_metadata.json"
 
-@app.route('/api/download-images/<download_id>')
-def download_images_zip(download_id):
-    """Create and serve a downloadable zip file of just the images"""
-    with download_lock:
-        if download_id not in download_status:
-            return jsonify({'error': 'Download not found'}), 404
-        
-        status = download_status[download_id]
-        if status['status'] != 'completed':
-            return jsonify({'error': 'Download not completed'}), 400
+def serve_archive(download_id, variant):
+    """Serve an archive variant from the cache, or stream it while it is cached"""
+    status = job_store.get(download_id)
+    if status is None:
+        return jsonify({'error': 'Download not found'}), 404
+    if status['status'] != 'completed':
+        return jsonify({'error': 'Download not completed'}), 400
     
     output_dir = status.get('output_dir')
     if not output_dir or not os.path.exists(output_dir):
         return jsonify({'error': 'Files not found'}), 404
     
-    images_dir = os.path.join(output_dir, "images")
-    if not os.path.exists(images_dir):
+    if variant == 'images' and not os.path.exists(os.path.join(get_main_website_folder(output_dir, status['url']), "images")):
         return jsonify({'error': 'No images found'}), 404
     
-    # Create a temporary zip file
-    temp_zip = tempfile.NamedTemporaryFile(delete=False, suffix='.zip')
-    temp_zip.close()
+    touch_download(download_id)
+    # Get the domain name for the filename
+    domain = urlparse(status['url']).netloc
+    zip_filename = f"{domain}-{ARCHIVE_VARIANTS[variant]}.zip"
     
-    try:
-        with zipfile.ZipFile(temp_zip.name, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            # Add all image files
-            for file in os.listdir(images_dir):
-                file_path = os.path.join(images_dir, file)
-                if os.path.isfile(file_path):
-                    zipf.write(file_path, f"images/{file}")
-            
-            # Add image metadata if it exists
-            metadata_path = os.path.join(output_dir, "image_metadata.json")
-            if os.path.exists(metadata_path):
-                zipf.write(metadata_path, "image_metadata.json")
-        
-        # Get the domain name for the filename
-        domain = urlparse(status['url']).netloc
-        zip_filename = f"{domain}-images.zip"
-        
+    cached_path = archive_cache.get(download_id, variant)
+    if cached_path:
+        # conditional=True answers If-None-Match with 304 and Range with 206
+        size = os.path.getsize(cached_path)
         return send_file(
-            temp_zip.name,
+            cached_path,
             as_attachment=True,
             download_name=zip_filename,
-            mimetype='application/zip'
+            mimetype='application/zip',
+            conditional=True,
+            etag=f"{download_id}-{variant}-{size}"
         )
     
-    except Exception as e:
-        # Clean up temp file on error
-        if os.path.exists(temp_zip.name):
-            os.unlink(temp_zip.name)
-        return jsonify({'error': f'Failed to create images zip: {str(e)}'}), 500
+    chunks = archive_cache.stream_and_store(download_id, variant, archives.iter_zip(archive_entries(output_dir, variant, status['url'])))
+    return Response(
+        chunks,
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename="{zip_filename}"'}
+    )
+
+@app.route('/api/download-zip/<download_id>')
+def download_zip(download_id):
+    """Serve a downloadable zip file of the scraped content"""
+    return serve_archive(download_id, 'full')
+
+@app.route('/api/download-images/<download_id>')
+def download_images_zip(download_id):
+    """Serve a downloadable zip file of just the images"""
+    return serve_archive(download_id, 'images')
 
 @app.route('/api/download-html/<download_id>')
 def download_html_zip(download_id):
-    """Create and serve a downloadable zip file of just the HTML content"""
-    with download_lock:
-        if download_id not in download_status:
-            return jsonify({'error': 'Download not found'}), 404
-        
-        status = download_status[download_id]
-        if status['status'] != 'completed':
-            return jsonify({'error': 'Download not completed'}), 400
-    
-    output_dir = status.get('output_dir')
-    if not output_dir or not os.path.exists(output_dir):
-        return jsonify({'error': 'Files not found'}), 404
-    
-    # Create a temporary zip file
-    temp_zip = tempfile.NamedTemporaryFile(delete=False, suffix='.zip')
-    temp_zip.close()
-    
-    try:
-        with zipfile.ZipFile(temp_zip.name, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            # Add HTML files and site map, exclude images
-            for root, dirs, files in os.walk(output_dir):
-                # Skip images directory
-                if 'images' in dirs:
-                    dirs.remove('images')
-                
-                for file in files:
-                    if file.endswith(('.html', '.htm', '.md', '.json')):
-                        file_path = os.path.join(root, file)
-                        arcname = os.path.relpath(file_path, output_dir)
-                        zipf.write(file_path, arcname)
-        
-        # Get the domain name for the filename
-        domain = urlparse(status['url']).netloc
-        zip_filename = f"{domain}-html-content.zip"
-        
-        return send_file(
-            temp_zip.name,
-            as_attachment=True,
-            download_name=zip_filename,
-            mimetype='application/zip'
-        )
-    
-    except Exception as e:
-        # Clean up temp file on error
-        if os.path.exists(temp_zip.name):
-            os.unlink(temp_zip.name)
-        return jsonify({'error': f'Failed to create HTML zip: {str(e)}'}), 500
+    """Serve a downloadable zip file of just the HTML content"""
+    return serve_archive(download_id, 'html')
 
 @app.route('/api/images/<download_id>')
 def get_image_metadata(download_id):
     """Get image metadata for a download"""
-    with download_lock:
-        if download_id not in download_status:
-            return jsonify({'error': 'Download not found'}), 404
-        
-        status = download_status[download_id]
-        if status['status'] != 'completed':
-            return jsonify({'error': 'Download not completed'}), 400
+    status = job_store.get(download_id)
+    if status is None:
+        return jsonify({'error': 'Download not found'}), 404
+    # Processing downloads already have the images handled so far
+    if status['status'] not in ('processing', 'completed'):
+        return jsonify({'error': 'Download not completed'}), 400
     
-    metadata_path = os.path.join(status.get('output_dir'), "image_metadata.json")
-    if not os.path.exists(metadata_path):
+    output_dir = status.get('output_dir')
+    metadata_path = output_dir and os.path.isdir(output_dir) and os.path.join(
+        get_main_website_folder(output_dir, status['url']), "image_metadata.json")
+    if not metadata_path or not os.path.exists(metadata_path):
         return jsonify({'error': 'Image metadata not found'}), 404
     
+    touch_download(download_id)
     try:
         with open(metadata_path, 'r', encoding='utf-8') as f:
             metadata = json.load(f)
@@ -489,15 +1532,57 @@ def get_image_metadata(download_id):
 def health_check():
     """Health check endpoint"""
     wget_ok, error_msg = check_wget_installed()
+    healthy = wget_ok or CRAWL_ENGINE != 'wget'
     return jsonify({
-        'status': 'healthy' if wget_ok else 'unhealthy',
+        'status': 'healthy' if healthy else 'unhealthy',
+        'crawl_engine': CRAWL_ENGINE,
+        'scheduler': job_scheduler.stats(),
+        'browser_pool': browser_pool.pool.stats(),
+        'archive_cache': archive_cache.stats(),
+        'storage': dict(janitor_stats, ttl=DOWNLOAD_TTL or None, quota_bytes=DOWNLOAD_QUOTA_BYTES or None),
         'wget_installed': wget_ok,
         'wget_error': error_msg if not wget_ok else None
     })
 
+@app.route('/api/metrics')
+def prometheus_metrics():
+    """Prometheus text metrics: per-phase totals from every server process, plus current gauges"""
+    jobs = {}
+    for status in ACTIVE_STATUSES + TERMINAL_STATUSES:
+        jobs[(('status', status),)] = job_store.list(limit=0, status=status)[1]
+    scheduler_stats = job_scheduler.stats()
+    gauges = [
+        ('sitemirror_jobs', 'Downloads by status', jobs),
+        ('sitemirror_worker_jobs', 'Jobs queued or running on this server process', {
+            (('state', 'queued'),): scheduler_stats['queued'],
+            (('state', 'running'),): scheduler_stats['running']
+        }),
+        ('sitemirror_archive_cache_bytes', 'Size of the archive cache', {(): archive_cache.stats()['bytes']}),
+        ('sitemirror_browser_pages_open', 'Pages open in the browser pool of this server process',
+         {(): browser_pool.pool.stats()['pages_open']})
+    ]
+    if janitor_stats['tracked_bytes'] is not None:
+        gauges.append(('sitemirror_download_bytes', 'Disk held by finished downloads at the last cleanup pass',
+                       {(): janitor_stats['tracked_bytes']}))
+    limiter_stats = crawler.host_limiter.stats()
+    gauges.append(('sitemirror_hosts_rate_limited', 'Origins this server process is pausing or has slowed down', {
+        (('state', 'paused'),): limiter_stats['paused'],
+        (('state', 'slowed'),): limiter_stats['slowed']
+    }))
+    gauges.append(('sitemirror_throttled_responses', '429 and 503 answers seen by this server process',
+                   {(): limiter_stats['throttled_responses']}))
+    if http_cache:
+        cache_stats = http_cache.stats()
+        gauges.append(('sitemirror_http_cache_bytes', 'Size of the shared HTTP cache as indexed by this server process',
+                       {(): cache_stats['bytes']}))
+        gauges.append(('sitemirror_http_cache_lookups', 'HTTP cache lookups on this server process by result', {
+            (('result', result),): cache_stats[result] for result in ('hits', 'misses', 'revalidated')
+        }))
+    return Response(metrics_registry.render(gauges), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/download-in-memory', methods=['POST'])
 def download_in_memory():
-    """Scrape a website, zip the results in memory, and stream to the user (no persistent storage)"""
+    """Scrape a website and stream it to the user as a zip while it is crawled (no persistent storage)"""
     data = request.get_json()
     if not data or 'url' not in data:
         return jsonify({'error': 'URL is required', 'usage': 'Send JSON with {"url": "https://example.com"}'}), 400
@@ -506,96 +1591,338 @@ def download_in_memory():
     is_valid, error_msg = validate_url(url)
     if not is_valid:
         return jsonify({'error': 'Invalid URL', 'message': error_msg}), 400
+    engine = data.get('engine', CRAWL_ENGINE)
+    if engine not in CRAWL_ENGINES:
+        return jsonify({'error': 'Invalid engine', 'message': f"engine must be one of: {', '.join(CRAWL_ENGINES)}"}), 400
     # Check if wget is installed
-    wget_ok, error_msg = check_wget_installed()
-    if not wget_ok:
-        return jsonify({'error': 'System requirement not met', 'message': error_msg}), 500
-    # Use a temporary directory for all scraping
-    with tempfile.TemporaryDirectory() as temp_dir:
-        # Run wget
-        wget_cmd = [
-            'wget',
-            '-r',
-            '-p',
-            '-k',
-            '-e', 'robots=off',
-            '--html-extension',
-            '--convert-links',
-            '--restrict-file-names=windows',
-            '--no-parent',
-            '--directory-prefix', temp_dir,
-            '-U', 'Mozilla',
-            url
-        ]
-        result = subprocess.run(wget_cmd, capture_output=True, text=True, timeout=300)
-        if result.returncode != 0:
-            error_msg = f"wget failed with return code {result.returncode}"
-            if result.stderr:
-                error_msg += f"\nError: {result.stderr}"
-            return jsonify({'error': error_msg}), 500
-        # Playwright image download
+    if engine == 'wget':
+        wget_ok, error_msg = check_wget_installed()
+        if not wget_ok:
+            return jsonify({'error': 'System requirement not met', 'message': error_msg}), 500
+    # The zip is the whole site unless the request limits the depth
+    scope, error = crawl_scope(data, default_depth=None)
+    if error:
+        return error
+    if scope.render and engine == 'wget':
+        return jsonify({'error': 'Invalid crawl options', 'message': 'render needs the async engine'}), 400
+    
+    # Scratch space only holds files that have not been streamed yet; the
+    # response generator removes it when it finishes or the client goes away
+    temp_dir = tempfile.mkdtemp(prefix='mirror-')
+    try:
+        if engine == 'wget':
+            entries = wget_in_memory_entries(url, temp_dir, scope)
+        else:
+            entries = crawl_in_memory_entries(url, temp_dir, scope)
+    except Exception as e:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        return jsonify({'error': str(e)}), 500
+    
+    def generate():
         try:
-            download_images_with_playwright(url, temp_dir)
+            yield from archives.iter_zip(entries)
+        finally:
+            entries.close()
+            shutil.rmtree(temp_dir, ignore_errors=True)
+    
+    domain = urlparse(url).netloc
+    zip_filename = f"{domain}-scraped-content.zip"
+    return Response(
+        generate(),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename="{zip_filename}"'}
+    )
+
+def crawl_in_memory_entries(url, temp_dir, scope):
+    """Start a crawl into temp_dir and return a generator of zip entries as files arrive.
+
+    Finished resources are handed out as soon as they are on disk and deleted
+    once the next one is requested (iter_zip has read them by then). HTML and
+    CSS wait until the crawl has converted their links. Raises if the start
+    page cannot be fetched, so the caller can still answer with an error.
+    """
+    arrived = queue.Queue()
+    cancel_event = threading.Event()
+    _, future = crawler.start_crawl(
+        url, temp_dir, scope=scope, cancel_event=cancel_event,
+        on_file=lambda local_path, is_document: arrived.put((local_path, is_document))
+    )
+    
+    # Wait for the start page so a bad URL fails before any bytes are sent
+    while arrived.empty() and not future.done():
+        time.sleep(0.05)
+    if future.done() and future.exception():
+        raise future.exception()
+    
+    def entries():
+        try:
+            while True:
+                try:
+                    local_path, is_document = arrived.get(timeout=0.25)
+                except queue.Empty:
+                    if future.done():
+                        break
+                    continue
+                if not is_document:
+                    file_path = os.path.join(temp_dir, local_path)
+                    yield file_path, local_path
+                    os.unlink(file_path)
+            try:
+                future.result()
+            except Exception as e:
+                print(f"Crawl stopped early: {e}")
+            
+            # Playwright image download
+            try:
+                download_images_with_playwright(url, temp_dir)
+            except Exception as e:
+                print(f"Image scraping failed: {e}")
+            
+            # Converted HTML/CSS, images and metadata are all that is left on disk
+            yield from archives.walk_entries(temp_dir)
+        finally:
+            # Client went away: stop crawling before the caller removes temp_dir
+            if not future.done():
+                cancel_event.set()
+                try:
+                    future.result(timeout=5)
+                except Exception:
+                    pass
+    
+    return entries()
+
+def wget_in_memory_entries(url, temp_dir, scope):
+    """Mirror with wget and return the zip entries once it finishes"""
+    result = subprocess.run(build_wget_command(url, temp_dir, scope), capture_output=True, text=True, timeout=300)
+    if result.returncode != 0:
+        error_msg = f"wget failed with return code {result.returncode}"
+        if result.stderr:
+            error_msg += f"\nError: {result.stderr}"
+        raise RuntimeError(error_msg)
+    # Playwright image download
+    try:
+        download_images_with_playwright(url, temp_dir)
+    except Exception as e:
+        print(f"Image scraping failed: {e}")
+    return archives.walk_entries(temp_dir)
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def owner_alive(worker):
+    """Whether the server process recorded as worker (see worker_id) still runs; None if it is on another host"""
+    owner_host, _, rest = worker.partition(':')
+    owner_pid, _, owner_instance = rest.partition(':')
+    if owner_host != socket.gethostname() or not owner_pid.isdigit():
+        return None
+    pid = int(owner_pid)
+    if pid == os.getpid():
+        return worker == worker_id()  # our PID, but an earlier server may have had it
+    if not process_alive(pid):
+        return False
+    # The PID may since have been reused; records from before instance IDs cannot tell
+    started = process_start_time(pid)
+    return not owner_instance or started is None or started == owner_instance
+
+def recover_jobs():
+    """Fail jobs whose server process died, resuming those with a crawl checkpoint if AUTO_RESUME is on,
+    and register mirrors on disk that have no job record"""
+    jobs, _ = job_store.list()
+    for job in jobs:
+        if job['status'] not in ACTIVE_STATUSES:
+            continue
+        if owner_alive(job.get('worker', '')) is not False:
+            continue  # still running, or owned by a server we cannot check
+        resumable = can_resume(job['id'])
+        if not job_store.update(job['id'], {
+            'status': 'failed',
+            'progress': 0,
+            'message': 'Interrupted by a server restart',
+            'resumable': resumable
+        }, expect=ACTIVE_STATUSES):
+            continue  # another server process got to it first
+        print(f"⚠️ Download {job['id']} was interrupted by a restart")
+        if AUTO_RESUME and resumable and not job.get('batch_id'):
+            try:
+                if resume_job(job['id'], job_store.get(job['id'])):
+                    print(f"▶️ Resuming download {job['id']} from its checkpoint")
+            except QueueFull:
+                print(f"⚠️ Queue is full, download {job['id']} was not resumed")
+
+    for download_id in os.listdir(DOWNLOAD_DIR):
+        output_dir = os.path.join(DOWNLOAD_DIR, download_id)
+        if download_id.startswith('.') or not os.path.isdir(output_dir) or job_store.get(download_id):
+            continue
+        website_folder = get_main_website_folder(output_dir)
+        if website_folder == output_dir:
+            continue  # nothing was mirrored
+        # Crawl state and blob manifests are only written once a mirror finished
+        finished = (os.path.exists(os.path.join(crawl_state_dir(download_id), 'resources.json'))
+                    or (blob_store and blob_store.manifest(download_id) is not None)
+                    or file_manifests.get(download_id) is not None)
+        checkpoint = None if finished else crawler.load_checkpoint(crawl_checkpoint_path(download_id))
+        job = {
+            'status': 'completed' if finished else 'failed',
+            'progress': 100 if finished else 0,
+            'message': 'Recovered from disk' if finished else 'Incomplete mirror recovered from disk',
+            'url': f"http://{os.path.basename(website_folder)}/",
+            'output_dir': output_dir,
+            'engine': 'async' if os.path.isdir(crawl_state_dir(download_id)) else 'wget',
+            'priority': 0
+        }
+        if checkpoint:
+            # The checkpoint knows what was asked for, so the crawl can be resumed
+            job.update({'url': checkpoint['start_url'], 'options': checkpoint['options'], 'resumable': True})
+        job_store.create(download_id, job)
+        print(f"♻️ Recovered download {download_id} from disk")
+
+def run_janitor():
+    """One cleanup pass: delete downloads unused for DOWNLOAD_TTL, then the least recently used ones
+    while finished downloads hold more than DOWNLOAD_QUOTA_BYTES; returns (downloads deleted, bytes freed)"""
+    jobs, _ = job_store.list()
+    now = time.time()
+    running_batches = {job['id'] for job in jobs if job.get('kind') == 'batch' and job['status'] in ACTIVE_STATUSES}
+    candidates = []
+    deleted = freed = 0
+    # The quota counts what deleting downloads can reclaim: the files finished downloads hold, each
+    # inode once however many downloads share it. The HTTP cache, blobs and variants have limits of their own
+    held = {}  # download_id -> held_files()
+    holders = {}  # (device, inode) -> how many downloads hold it
+    total = 0 if DOWNLOAD_QUOTA_BYTES else None
+    for job in jobs:
+        if job['status'] == 'deleting':
+            # The server process deleting it died half way
+            if now - job.get('deleting_since', 0) > DELETE_RETRY_AFTER and delete_download(job['id'], expect=('deleting',)):
+                deleted += 1
+            continue
+        if job['status'] not in TERMINAL_STATUSES:
+            continue
+        if job.get('disk_bytes') is None:
+            # Failed, cancelled and recovered downloads are measured once, then remembered
+            job['disk_bytes'] = download_disk_bytes(job['id'], job.get('output_dir'))
+            job_store.update(job['id'], {'disk_bytes': job['disk_bytes']})
+        if DOWNLOAD_QUOTA_BYTES:
+            held[job['id']] = held_files(job['id'], job.get('output_dir'))
+            for inode, size in held[job['id']].items():
+                holders[inode] = holders.get(inode, 0) + 1
+                if holders[inode] == 1:
+                    total += size
+        if job.get('batch_id') not in running_batches:
+            candidates.append(job)
+    
+    candidates.sort(key=lambda job: job.get('last_access') or job['created'])
+    for job in candidates:
+        expired = DOWNLOAD_TTL and now - (job.get('last_access') or job['created']) > DOWNLOAD_TTL
+        if not expired and not (DOWNLOAD_QUOTA_BYTES and total > DOWNLOAD_QUOTA_BYTES):
+            continue
+        files = held.get(job['id'], {})
+        size = sum(file_size for inode, file_size in files.items() if holders[inode] == 1)
+        if not expired and not size:
+            continue  # everything it holds is shared with downloads that stay
+        if delete_download(job['id']):
+            deleted += 1
+            freed += size
+            for inode in files:
+                holders[inode] -= 1
+            if total is not None:
+                total -= size
+    if deleted and blob_store:
+        blob_store.collect_garbage()
+    # Variants outlive the downloads they were built for, and every restart leaves a metrics file
+    freed += file_manifests.collect_garbage()[1]
+    metrics_registry.absorb(metrics_worker_dead)
+    
+    # Scratch dirs of in-memory downloads are removed when the stream ends, unless the process died
+    temp_root = tempfile.gettempdir()
+    for name in os.listdir(temp_root):
+        path = os.path.join(temp_root, name)
+        try:
+            if name.startswith('mirror-') and os.path.isdir(path) and now - os.path.getmtime(path) > TEMP_MAX_AGE:
+                shutil.rmtree(path, ignore_errors=True)
+        except OSError:
+            pass
+    
+    janitor_stats.update({
+        'runs': janitor_stats['runs'] + 1,
+        'deleted': janitor_stats['deleted'] + deleted,
+        'bytes_freed': janitor_stats['bytes_freed'] + freed,
+        'tracked_bytes': total,
+        'last_run': now
+    })
+    if deleted:
+        print(f"🧹 Janitor deleted {deleted} downloads ({freed // (1024 * 1024)} MB)")
+    return deleted, freed
+
+def metrics_worker_dead(worker):
+    """Whether the server process that wrote a metrics file (named like metrics_registry's) has exited"""
+    parts = worker.rsplit('-', 2)
+    if len(parts) == 3 and parts[1].isdigit():
+        return owner_alive(':'.join(parts)) is False
+    return owner_alive(':'.join(worker.rsplit('-', 1))) is False  # host-pid, from before instance IDs
+
+def janitor():
+    """Run cleanup passes every JANITOR_INTERVAL seconds"""
+    while True:
+        try:
+            run_janitor()
         except Exception as e:
-            print(f"Image scraping failed: {e}")
-        # Generate site map
-        # site_map_path = os.path.join(temp_dir, "site_map.md")
-        # generate_site_map(temp_dir, site_map_path)
-        # Zip the temp_dir in memory
-        zip_buffer = io.BytesIO()
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            for root, dirs, files in os.walk(temp_dir):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    arcname = os.path.relpath(file_path, temp_dir)
-                    zipf.write(file_path, arcname)
-        zip_buffer.seek(0)
-        domain = urlparse(url).netloc
-        zip_filename = f"{domain}-scraped-content.zip"
-        return send_file(
-            zip_buffer,
-            as_attachment=True,
-            download_name=zip_filename,
-            mimetype='application/zip'
-        )
+            print(f"Janitor error: {e}")
+        time.sleep(JANITOR_INTERVAL)
 
-def fix_image_references(website_folder):
-    html_files = glob.glob(os.path.join(website_folder, "*.htm*"))
-    patterns = [
-        # (attribute, folder)
-        ('src="/images/', 'src="images/'),
-        ("src='/images/", "src='images/"),
-        ('href="/images/', 'href="images/'),
-        ("href='/images/", "href='images/"),
-        ('url("/images/', 'url("images/'),
-        ("url('/images/", "url('images/"),
-        ('src="/styles/', 'src="styles/'),
-        ("src='/styles/", "src='styles/"),
-        ('href="/styles/', 'href="styles/'),
-        ("href='/styles/", "href='styles/"),
-        ('url("/styles/', 'url("styles/'),
-        ("url('/styles/", "url('styles/"),
-        ('src="/themes/', 'src="themes/'),
-        ("src='/themes/", "src='themes/"),
-        ('href="/themes/', 'href="themes/'),
-        ("href='/themes/", "href='themes/"),
-        ('url("/themes/', 'url("themes/'),
-        ("url('/themes/", "url('themes/"),
-        # Generic: any reference to /assets/
-        ('src="/assets/', 'src="assets/'),
-        ("src='/assets/", "src='assets/"),
-        ('href="/assets/', 'href="assets/'),
-        ("href='/assets/", "href='assets/"),
-        ('url("/assets/', 'url("assets/'),
-        ("url('/assets/", "url('assets/"),
-    ]
-    for html_file in html_files:
-        with open(html_file, "r", encoding="utf-8") as f:
-            content = f.read()
-        for old, new in patterns:
-            content = content.replace(old, new)
-        with open(html_file, "w", encoding="utf-8") as f:
-            f.write(content)
+def watch_cancellations():
+    """Stop this process's jobs when a cancel for them arrived on another server process"""
+    while True:
+        time.sleep(CANCEL_POLL_INTERVAL)
+        try:
+            for download_id in job_scheduler.job_ids():
+                job = job_store.get(download_id)
+                if job and job.get('cancel_requested') and job_scheduler.cancel(download_id) == 'queued':
+                    job_store.update(download_id, {
+                        'status': 'cancelled',
+                        'message': 'Download cancelled'
+                    })
+        except Exception as e:
+            print(f"Cancellation watcher error: {e}")
+
+background_lock = threading.Lock()
+background_started = False
+
+def start_background():
+    """Recover interrupted jobs and start the cancellation watcher, blob collection and janitor, once.
+
+    Only the server entry points call this (asgi.py at startup, `python app.py`, create_app()),
+    never an import: rewriter and image pool workers import the main module again.
+    """
+    global background_started
+    with background_lock:
+        if background_started:
+            return
+        background_started = True
+    try:
+        recover_jobs()
+    except Exception as e:
+        print(f"Job recovery failed: {e}")
+    if JOB_STORE != 'memory':
+        threading.Thread(target=watch_cancellations, daemon=True).start()
+
+    if blob_store:
+        # Reclaim blobs left unreferenced by downloads removed while we were down
+        threading.Thread(target=blob_store.collect_garbage, daemon=True).start()
+    threading.Thread(target=janitor, daemon=True).start()
+
+def create_app():
+    """The WSGI app with its background work started, for `gunicorn 'app:create_app()'`"""
+    start_background()
+    return app
 
 if __name__ == '__main__':
+    # The reloader serves from a child process it starts with WERKZEUG_RUN_MAIN set
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background()
     app.run(debug=True, host='0.0.0.0', port=5001) 
\ No newline at end of file
@@ -0,0 +1,223 @@
+"""
+Site Mirror Tool - streaming ZIP archives
+Builds ZIP files chunk by chunk so responses start immediately, and caches finished archives on disk
+"""
+
+import io
+import os
+import threading
+import time
+import zipfile
+from collections import OrderedDict
+
+CHUNK_SIZE = 64 * 1024
+PART_MAX_AGE = 3600  # seconds without a write before a partial archive counts as abandoned
+
+# Formats that are already compressed; deflating them again only burns CPU
+STORED_EXTENSIONS = {
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.ico', '.mp3', '.mp4', '.ogg', '.wav', '.webm',
+    '.zip', '.gz', '.tgz', '.bz2', '.xz', '.7z', '.rar', '.woff', '.woff2', '.pdf', '.docx',
+    '.xlsx', '.pptx'
+}
+
+
+class _ChunkSink(io.RawIOBase):
+    """Unseekable file object that collects what zipfile writes until it is drained"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def compress_type_for(path):
+    """ZIP_STORED for already-compressed formats, ZIP_DEFLATED for everything else"""
+    if os.path.splitext(path)[1].lower() in STORED_EXTENSIONS:
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+def iter_zip(entries):
+    """Yield a ZIP archive of (file_path, arcname) entries as it is written.
+
+    Memory use is bounded by CHUNK_SIZE no matter how large the files are.
+    """
+    sink = _ChunkSink()
+    # An unseekable sink makes zipfile write data descriptors instead of seeking back
+    with zipfile.ZipFile(sink, 'w') as zipf:
+        for file_path, arcname in entries:
+            try:
+                info = zipfile.ZipInfo.from_file(file_path, arcname)
+            except OSError:
+                continue  # removed while we were walking
+            info.compress_type = compress_type_for(file_path)
+            with open(file_path, 'rb') as src, zipf.open(info, 'w', force_zip64=info.file_size > 2 ** 31) as dest:
+                while True:
+                    chunk = src.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    dest.write(chunk)
+                    data = sink.drain()
+                    if data:
+                        yield data
+            data = sink.drain()
+            if data:
+                yield data
+    # Central directory
+    yield sink.drain()
+
+
+def walk_entries(root, extensions=None, skip_dirs=()):
+    """(file_path, arcname) pairs for files under root, optionally filtered by extension"""
+    for dirpath, dirs, files in os.walk(root):
+        dirs[:] = sorted(d for d in dirs if d not in skip_dirs)
+        for name in sorted(files):
+            if extensions and not name.lower().endswith(extensions):
+                continue
+            file_path = os.path.join(dirpath, name)
+            yield file_path, os.path.relpath(file_path, root)
+
+
+class ArchiveCache:
+    """Finished archives on disk, keyed by (download_id, variant), with size-bounded LRU eviction.
+
+    Mirrors are immutable once completed, and iter_zip output is deterministic for the
+    same files, so a cached archive can be served with a stable ETag and Range support.
+    Server processes share the directory: an archive another process built is found on
+    disk, and each process writes its builds to its own .part file.
+    """
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = os.path.abspath(cache_dir)  # send_file resolves relative paths against the app
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # file name -> size, least recently used first
+        self._total = 0
+        self._building = set()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        """Index archives left by a previous run, oldest access first"""
+        found = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.endswith('.part'):
+                # Another process may be writing it; only a build that stopped long ago is removed
+                try:
+                    if os.stat(path).st_mtime < time.time() - PART_MAX_AGE:
+                        os.unlink(path)
+                except OSError:
+                    pass
+            elif name.endswith('.zip'):
+                stat = os.stat(path)
+                found.append((stat.st_atime, name, stat.st_size))
+        for _, name, size in sorted(found):
+            self._entries[name] = size
+            self._total += size
+
+    def _name(self, download_id, variant):
+        return f"{download_id}-{variant}.zip"
+
+    def get(self, download_id, variant):
+        """Path of the cached archive, or None; marks it as recently used"""
+        name = self._name(download_id, variant)
+        path = os.path.join(self.cache_dir, name)
+        with self._lock:
+            if name not in self._entries:
+                try:
+                    size = os.path.getsize(path)
+                except OSError:
+                    return None
+                # Built by another server process
+                self._entries[name] = size
+                self._total += size
+                self._evict()
+                return path
+            if not os.path.exists(path):
+                self._total -= self._entries.pop(name)
+                return None
+            self._entries.move_to_end(name)
+        return path
+
+    def stream_and_store(self, download_id, variant, chunks):
+        """Pass archive chunks through to the caller while writing them into the cache.
+
+        If another request is already building this archive the chunks are only
+        passed through. A client that disconnects early leaves nothing behind.
+        """
+        name = self._name(download_id, variant)
+        path = os.path.join(self.cache_dir, name)
+        with self._lock:
+            building = name in self._building
+            self._building.add(name)
+        if building:
+            yield from chunks
+            return
+        part_path = f"{path}.{os.getpid()}.part"
+        try:
+            size = 0
+            with open(part_path, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    size += len(chunk)
+                    yield chunk
+            os.replace(part_path, path)
+            self._add(name, size)
+        finally:
+            with self._lock:
+                self._building.discard(name)
+            if os.path.exists(part_path):
+                os.unlink(part_path)
+
+    def build(self, download_id, variant, chunks):
+        """Build an archive into the cache ahead of the first request"""
+        for _ in self.stream_and_store(download_id, variant, chunks):
+            pass
+
+    def invalidate(self, download_id):
+        """Drop every cached variant of a download, including ones other server processes built"""
+        prefix = f"{download_id}-"
+        with self._lock:
+            for name in [n for n in self._entries if n.startswith(prefix)]:
+                self._remove(name)
+            for name in os.listdir(self.cache_dir):
+                if name.startswith(prefix) and name.endswith('.zip'):
+                    try:
+                        os.unlink(os.path.join(self.cache_dir, name))
+                    except OSError:
+                        pass
+
+    def _add(self, name, size):
+        with self._lock:
+            if name in self._entries:
+                self._total -= self._entries.pop(name)
+            self._entries[name] = size
+            self._total += size
+            self._evict()
+
+    def _evict(self):
+        # Least recently used archives first, but never the one just added
+        while self._total > self.max_bytes and len(self._entries) > 1:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, name):
+        self._total -= self._entries.pop(name)
+        try:
+            os.unlink(os.path.join(self.cache_dir, name))
+        except OSError:
+            pass
+
+    def stats(self):
+        with self._lock:
+            return {'archives': len(self._entries), 'bytes': self._total, 'max_bytes': self.max_bytes}
@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+"""
+Site Mirror Tool - ASGI entry point
+Serves status, event streams, mirrored files and cached archives on the event loop; every other route runs the Flask app
+"""
+
+import asyncio
+import email.utils
+import json
+import os
+import re
+from urllib.parse import urlparse
+
+from a2wsgi import WSGIMiddleware
+
+import app as api
+import filemanifest
+from jobstore import ACTIVE_STATUSES
+
+WSGI_THREADS = int(os.environ.get('WSGI_THREADS', 16))  # threads for the routes still served by Flask
+FILE_CHUNK_SIZE = 256 * 1024  # bytes read from disk per send
+WATCH_INTERVAL = 1  # seconds the change watcher blocks in the job store at a time
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+QUALITY_RE = re.compile(r';\s*q\s*=\s*([0-9.]+)')
+
+flask_app = WSGIMiddleware(api.app, workers=WSGI_THREADS)
+
+
+class Request:
+    def __init__(self, scope):
+        self.method = scope['method']
+        self.headers = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope['headers']}
+
+
+class Response:
+    """Status, headers and a body given as bytes or as an async iterator of chunks"""
+
+    def __init__(self, status, headers=(), body=b'', chunks=None):
+        self.status = status
+        self.headers = list(headers)
+        self.body = body
+        self.chunks = chunks
+
+    async def __call__(self, request, receive, send):
+        headers = self.headers
+        if 'origin' in request.headers:
+            headers.append(('Access-Control-Allow-Origin', '*'))  # what flask_cors answers for every origin
+        if self.chunks is None and self.status != 304:
+            headers.append(('Content-Length', str(len(self.body))))
+        await send({
+            'type': 'http.response.start',
+            'status': self.status,
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+        })
+        if request.method == 'HEAD' or self.chunks is None:
+            await send({'type': 'http.response.body', 'body': b'' if request.method == 'HEAD' else self.body})
+            return
+        # Servers drop writes to a closed connection silently, so listen for the disconnect
+        disconnected = asyncio.ensure_future(_disconnect(receive))
+        try:
+            async for chunk in self.chunks:
+                if disconnected.done():
+                    return
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            disconnected.cancel()
+            await self.chunks.aclose()
+
+
+async def _disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+def json_response(data, status=200):
+    return Response(status, [('Content-Type', 'application/json')], json.dumps(data).encode('utf-8'))
+
+
+def _etag_matches(header, etag):
+    """If-None-Match comparison (weak, as RFC 9110 asks for GET)"""
+    if header.strip() == '*':
+        return True
+    return any(tag.strip().removeprefix('W/') == f'"{etag}"' for tag in header.split(','))
+
+
+def _byte_range(header, size):
+    """(start, end) of a single-range Range header, None to send everything, or False if unsatisfiable"""
+    match = RANGE_RE.match(header.replace(' ', ''))
+    if not match or match.group(1) == match.group(2) == '':
+        return None  # malformed or several ranges: a full response is always allowed
+    if match.group(1) == '':
+        length = int(match.group(2))
+        return (max(0, size - length), size - 1) if length else False
+    start = int(match.group(1))
+    end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+    return (start, end) if start <= end and start < size else False
+
+
+async def _read_file(path, start, length):
+    f = await asyncio.to_thread(open, path, 'rb')
+    try:
+        await asyncio.to_thread(f.seek, start)
+        while length > 0:
+            chunk = await asyncio.to_thread(f.read, min(FILE_CHUNK_SIZE, length))
+            if not chunk:
+                return
+            length -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+
+async def file_response(request, path, content_type, etag, mtime, headers=()):
+    """A file with ETag, Last-Modified, 304s and single Range requests, read off the event loop.
+
+    Raises FileNotFoundError if path is gone.
+    """
+    size = (await asyncio.to_thread(os.stat, path)).st_size
+    headers = list(headers) + [
+        ('ETag', f'"{etag}"'),
+        ('Last-Modified', email.utils.formatdate(mtime, usegmt=True)),
+        ('Cache-Control', 'no-cache'),
+        ('Accept-Ranges', 'bytes')
+    ]
+    if_none_match = request.headers.get('if-none-match')
+    if_modified_since = request.headers.get('if-modified-since')
+    not_modified = False
+    if if_none_match is not None:
+        not_modified = _etag_matches(if_none_match, etag)
+    elif if_modified_since:
+        try:
+            not_modified = int(mtime) <= email.utils.parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            pass
+    if not_modified:
+        return Response(304, headers)
+
+    byte_range = None
+    if 'range' in request.headers and request.headers.get('if-range', f'"{etag}"') == f'"{etag}"':
+        byte_range = _byte_range(request.headers['range'], size)
+    if byte_range is False:
+        return Response(416, headers + [('Content-Range', f'bytes */{size}')])
+    start, end = byte_range or (0, size - 1)
+    headers += [('Content-Type', content_type), ('Content-Length', str(end - start + 1))]
+    if byte_range:
+        headers.append(('Content-Range', f'bytes {start}-{end}/{size}'))
+    return Response(206 if byte_range else 200, headers, chunks=_read_file(path, start, end - start + 1))
+
+
+def accepted_quality(header, coding):
+    """Quality the client gave a content coding in Accept-Encoding (0 if not acceptable)"""
+    qualities = {}
+    for part in header.split(','):
+        name = part.split(';')[0].strip().lower()
+        match = QUALITY_RE.search(part)
+        try:
+            qualities[name] = float(match.group(1)) if match else 1.0
+        except ValueError:
+            qualities[name] = 0.0
+    return qualities.get(coding, qualities.get('*', 0.0))
+
+
+async def status(request, download_id):
+    """GET /api/status/<id>"""
+    job = await asyncio.to_thread(api.job_store.get, download_id)
+    if job is None:
+        return json_response({'error': 'Download not found'}, 404)
+    return json_response(api.with_queue_position(job, download_id))
+
+
+async def files(request, download_id, filename=None):
+    """GET /api/files/<id>/<path> from the download's manifest; mirrors without one go to Flask"""
+    def load():
+        manifest = api.file_manifests.get(download_id)
+        if manifest is not None:
+            api.touch_download(download_id)
+        return manifest
+
+    manifest = await asyncio.to_thread(load)
+    if manifest is None:
+        return None
+    filename = filename or 'index.html'
+    entry = manifest['files'].get(filename)
+    if entry is None:
+        return json_response({'error': f'File {filename} not found'}, 404)
+
+    path = os.path.join(manifest['output_dir'], manifest['website_folder'], filename)
+    etag = entry['sha256']
+    accept_encoding = request.headers.get('accept-encoding', '')
+    encoding = next((e for e in filemanifest.ENCODINGS
+                     if e in entry['encodings'] and accepted_quality(accept_encoding, e) > 0), None)
+    headers = []
+    if encoding:
+        path = api.file_manifests.variant_path(entry['sha256'], encoding)
+        etag = f"{etag}-{encoding}"  # each representation needs its own strong ETag
+        headers.append(('Content-Encoding', encoding))
+    if entry['encodings']:
+        headers.append(('Vary', 'Accept-Encoding'))
+    try:
+        return await file_response(request, path, entry['type'], etag, entry['mtime'], headers)
+    except FileNotFoundError:
+        # Deleted by another server process since the manifest was loaded
+        api.file_manifests.forget(download_id)
+        return json_response({'error': 'Files not found'}, 404)
+
+
+async def archive(request, kind, download_id):
+    """GET /api/download-{zip,images,html}/<id> when the archive is cached; building one goes to Flask"""
+    variant = {'zip': 'full', 'images': 'images', 'html': 'html'}[kind]
+
+    def load():
+        job = api.job_store.get(download_id)
+        cached_path = job and job['status'] == 'completed' and api.archive_cache.get(download_id, variant)
+        if cached_path:
+            api.touch_download(download_id)
+        return job, cached_path
+
+    job, cached_path = await asyncio.to_thread(load)
+    if not cached_path:
+        return None
+    zip_filename = f"{urlparse(job['url']).netloc}-{api.ARCHIVE_VARIANTS[variant]}.zip"
+    try:
+        stat = await asyncio.to_thread(os.stat, cached_path)
+        return await file_response(
+            request, cached_path, 'application/zip', f"{download_id}-{variant}-{stat.st_size}",
+            stat.st_mtime, [('Content-Disposition', f'attachment; filename="{zip_filename}"')]
+        )
+    except FileNotFoundError:
+        return None  # evicted meanwhile; Flask rebuilds it
+
+
+class ChangeWatcher:
+    """One thread waits on the job store for the whole process and wakes every event stream on the loop"""
+
+    def __init__(self):
+        self.seq = None
+        self._changed = None
+        self._ready = None
+        self._task = None
+
+    async def wait(self, since, timeout):
+        """Wait until a job changed after since, or timeout; returns the latest sequence number"""
+        if self._task is None:
+            # Start before the first await, so streams opening together share one watcher
+            self._changed = asyncio.Condition()
+            self._ready = asyncio.Event()
+            self._task = asyncio.ensure_future(self._watch())
+        await self._ready.wait()
+        async with self._changed:
+            try:
+                await asyncio.wait_for(self._changed.wait_for(lambda: self.seq > since), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.seq
+
+    async def _watch(self):
+        while True:
+            try:
+                if self.seq is None:
+                    seq = await asyncio.to_thread(api.job_store.last_seq)
+                else:
+                    # Short waits so the thread is free soon after shutdown
+                    seq = await asyncio.to_thread(api.job_store.wait, self.seq, WATCH_INTERVAL)
+            except Exception as e:
+                print(f"Change watcher error: {e}")
+                await asyncio.sleep(1)
+                continue
+            if seq != self.seq:
+                async with self._changed:
+                    self.seq = seq
+                    self._changed.notify_all()
+                self._ready.set()
+
+
+watcher = ChangeWatcher()
+
+
+def event_stream(chunks):
+    return Response(200, [
+        ('Content-Type', 'text/event-stream; charset=utf-8'),
+        ('Cache-Control', 'no-cache'),
+        ('X-Accel-Buffering', 'no')  # keep nginx from buffering the stream
+    ], chunks=chunks)
+
+
+async def stream_status(request, download_id):
+    """GET /api/status/<id>/stream: the same events as the Flask route, without holding a thread"""
+    since = await asyncio.to_thread(api.job_store.last_seq)
+    job = await asyncio.to_thread(api.job_store.get, download_id)
+    if job is None:
+        return json_response({'error': 'Download not found'}, 404)
+
+    async def generate():
+        current = api.with_queue_position(job, download_id)
+        latest = since
+        yield api.sse_event('status', current, latest).encode('utf-8')
+        while current['status'] in ACTIVE_STATUSES:
+            seq = await watcher.wait(latest, api.STREAM_HEARTBEAT)
+            if seq == latest:
+                yield b': keep-alive\n\n'
+                continue
+            changed = await asyncio.to_thread(api.job_store.changes, latest, download_id)
+            latest = max([seq] + [change['seq'] for change in changed])
+            if changed:
+                current = {k: v for k, v in changed[-1].items() if k not in ('id', 'seq')}
+            elif current['status'] != 'queued':
+                continue
+            # Other jobs starting moves this one up the queue, so recheck its position too
+            position = current.get('queue_position')
+            current = api.with_queue_position(current, download_id)
+            if changed or current.get('queue_position') != position:
+                yield api.sse_event('status', current, latest).encode('utf-8')
+
+    return event_stream(generate())
+
+
+async def stream_downloads(request):
+    """GET /api/downloads/stream: the same events as the Flask route, without holding a thread"""
+    since = await asyncio.to_thread(api.job_store.last_seq)
+    jobs, total = await asyncio.to_thread(api.job_store.list, limit=api.DOWNLOADS_PAGE_SIZE)
+
+    async def generate():
+        latest = since
+        yield api.sse_event('snapshot', {'downloads': [api.download_summary(job) for job in jobs],
+                                         'total': total}, latest).encode('utf-8')
+        while True:
+            seq = await watcher.wait(latest, api.STREAM_HEARTBEAT)
+            if seq == latest:
+                yield b': keep-alive\n\n'
+                continue
+            for job in await asyncio.to_thread(api.job_store.changes, latest):
+                latest = max(latest, job['seq'])
+                if job['status'] == 'deleted':
+                    yield api.sse_event('deleted', {'id': job['id']}, job['seq']).encode('utf-8')
+                else:
+                    yield api.sse_event('download', api.download_summary(job), job['seq']).encode('utf-8')
+            latest = max(latest, seq)
+
+    return event_stream(generate())
+
+
+# GET routes served here; a handler returning None hands the request to Flask
+ROUTES = [
+    (re.compile(r'^/api/status/([^/]+)$'), status),
+    (re.compile(r'^/api/status/([^/]+)/stream$'), stream_status),
+    (re.compile(r'^/api/downloads/stream$'), stream_downloads),
+    (re.compile(r'^/api/files/([^/]+)(?:/(.+))?$'), files),
+    (re.compile(r'^/api/download-(zip|images|html)/([^/]+)$'), archive),
+]
+
+
+async def lifespan(receive, send):
+    """Start the API's background work once the server is up, in every uvicorn worker process"""
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await asyncio.to_thread(api.start_background)
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    """ASGI application: the hot read paths natively, everything else through Flask on WSGI_THREADS threads"""
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] == 'http' and scope['method'] in ('GET', 'HEAD'):
+        for pattern, handler in ROUTES:
+            match = pattern.match(scope['path'])
+            if match:
+                request = Request(scope)
+                response = await handler(request, *match.groups())
+                if response is not None:
+                    await response(request, receive, send)
+                    return
+                break
+    await flask_app(scope, receive, send)
+
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(application, host='0.0.0.0', port=int(os.environ.get('PORT', 5001)))
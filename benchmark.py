@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+"""
+Site Mirror Tool - offline benchmark
+Serves a synthetic site locally, drives the mirror API against it and reports throughput,
+p50/p99 latency, peak RSS and disk bytes written
+"""
+
+import argparse
+import concurrent.futures
+import hashlib
+import http.server
+import json
+import os
+import random
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+ENDPOINTS = ('download', 'in-memory', 'zip', 'images', 'html', 'files')
+ARCHIVES = {'zip': 'download-zip', 'images': 'download-images', 'html': 'download-html'}
+SERVED_FILES = ('index.html', 'style.css', 'img/bg.png')  # on every mirror, whatever its depth
+TERMINAL_STATUSES = ('completed', 'failed', 'cancelled')
+
+
+class SyntheticSite:
+    """Deterministic site held in memory: pages in a link tree, images, a stylesheet and lazy images.
+
+    Page i links to pages i*fanout+1 .. i*fanout+fanout, so `fanout` controls how deep
+    the link graph gets (1 gives a single chain as deep as the page count).
+    """
+
+    def __init__(self, pages=50, images=100, image_kb=32, fanout=3, lazy=0.5, seed=1):
+        rng = random.Random(seed)
+        self.files = {}  # path -> (content type, body)
+        self.files['/style.css'] = ('text/css', b'body { background: url("/img/bg.png") }\n'
+                                    b'@import url("/print.css");\n')
+        self.files['/print.css'] = ('text/css', b'@media print { body { color: black } }\n')
+        self.files['/img/bg.png'] = ('image/png', self._image(rng, image_kb))
+        for n in range(images):
+            self.files[f'/img/{n}.png'] = ('image/png', self._image(rng, image_kb))
+        per_page = -(-images // max(pages, 1))
+        for i in range(pages):
+            links = ''.join(f'<a href="/page/{c}.html">page {c}</a>\n'
+                            for c in range(i * fanout + 1, min(i * fanout + fanout, pages - 1) + 1))
+            tags = []
+            for n in range(i * per_page, min((i + 1) * per_page, images)):
+                if rng.random() < lazy:
+                    # Lazy images only load once a script or the browser decides to
+                    tags.append(f'<img loading="lazy" data-src="/img/{n}.png" src="/img/{n}.png" alt="lazy {n}">')
+                else:
+                    tags.append(f'<img src="/img/{n}.png" alt="image {n}" width="64" height="64">')
+            body = (f'<!DOCTYPE html><html><head><title>Page {i}</title>'
+                    f'<link rel="stylesheet" href="/style.css"></head><body>\n<h1>Page {i}</h1>\n'
+                    f'{links}{"".join(tags)}\n<p>{"lorem ipsum " * 200}</p>\n'
+                    '<script>document.querySelectorAll("img[data-src]").forEach(i => i.src = i.dataset.src)</script>'
+                    '</body></html>')
+            self.files[f'/page/{i}.html'] = ('text/html', body.encode())
+        self.files['/'] = self.files['/page/0.html']
+        self.etags = {path: '"' + hashlib.md5(body).hexdigest() + '"' for path, (_, body) in self.files.items()}
+
+    @staticmethod
+    def _image(rng, size_kb):
+        # A PNG signature is enough for anything that sniffs the type; the rest is noise
+        return b'\x89PNG\r\n\x1a\n' + rng.randbytes(max(size_kb * 1024 - 8, 0))
+
+    def total_bytes(self):
+        return sum(len(body) for path, (_, body) in self.files.items() if path != '/')
+
+    def serve(self):
+        """Start serving on a free localhost port in a daemon thread; returns the server"""
+        site = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                path = self.path.split('?')[0]
+                if path not in site.files:
+                    self.send_error(404)
+                    return
+                content_type, body = site.files[path]
+                etag = site.etags[path]
+                if self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('ETag', etag)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_api(workdir, port, env):
+    """Run the API under uvicorn, as production does, in a child process with workdir as its cwd
+    so everything it writes lands there"""
+    command = [sys.executable, '-m', 'uvicorn', 'asgi:application', '--host', '127.0.0.1', '--port', str(port)]
+    process = subprocess.Popen(command, cwd=workdir,
+                               env=dict(os.environ, PYTHONPATH=REPO_DIR, **env),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    api = f'http://127.0.0.1:{port}'
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(f'{api}/api/health', timeout=1).read()
+            return process, api
+        except OSError:
+            if process.poll() is not None:
+                raise RuntimeError('API server exited during startup')
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError('API server did not start')
+
+
+def post_json(url, body):
+    request = urllib.request.Request(url, data=json.dumps(body).encode(),
+                                     headers={'Content-Type': 'application/json'})
+    return urllib.request.urlopen(request, timeout=600)
+
+
+def wait_for_download(api, download_id):
+    """Follow the status event stream until the download finishes; returns its final status"""
+    status = {}
+    with urllib.request.urlopen(f'{api}/api/status/{download_id}/stream', timeout=600) as stream:
+        for line in stream:
+            if line.startswith(b'data: '):
+                status = json.loads(line[6:])
+                if status.get('status') in TERMINAL_STATUSES:
+                    break
+    return status
+
+
+def run_download(api, site_url, extra):
+    """Mirror through /api/download and wait for it; returns (download id, bytes, first byte, ok)"""
+    with post_json(f'{api}/api/download', dict(extra, url=site_url)) as response:
+        download_id = json.loads(response.read())['download_id']
+    status = wait_for_download(api, download_id)
+    size = status.get('phases', {}).get('crawl', {}).get('bytes') or 0
+    return download_id, size, None, status.get('status') == 'completed'
+
+
+def drain(response, start):
+    """Read a response to the end; returns (bytes, seconds to the first byte)"""
+    size, first_byte = 0, None
+    while True:
+        chunk = response.read(64 * 1024)
+        if not chunk:
+            return size, first_byte
+        if first_byte is None:
+            first_byte = time.perf_counter() - start
+        size += len(chunk)
+
+
+def run_in_memory(api, site_url, extra):
+    start = time.perf_counter()
+    with post_json(f'{api}/api/download-in-memory', dict(extra, url=site_url)) as response:
+        size, first_byte = drain(response, start)
+    return None, size, first_byte, size > 0
+
+
+def run_archive(api, kind, download_id):
+    start = time.perf_counter()
+    with urllib.request.urlopen(f'{api}/api/{ARCHIVES[kind]}/{download_id}', timeout=600) as response:
+        size, first_byte = drain(response, start)
+    return download_id, size, first_byte, size > 0
+
+
+def run_file(api, download_id, filename):
+    """Fetch one mirrored file the way a browser would, precompressed where the server has a variant"""
+    start = time.perf_counter()
+    request = urllib.request.Request(f'{api}/api/files/{download_id}/{filename}',
+                                     headers={'Accept-Encoding': 'br, gzip'})
+    with urllib.request.urlopen(request, timeout=600) as response:
+        size, first_byte = drain(response, start)
+    return download_id, size, first_byte, size > 0
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def measure(name, runs, concurrency, call):
+    """Run call(i) `runs` times on `concurrency` threads; returns a result dict"""
+    latencies, first_bytes, ids = [], [], []
+    total_bytes = failures = 0
+
+    def timed(i):
+        start = time.perf_counter()
+        try:
+            result = call(i)
+        except (OSError, ValueError) as e:
+            print(f"   ⚠️ {name} #{i} failed: {e}")
+            return None, time.perf_counter() - start
+        return result, time.perf_counter() - start
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(concurrency) as pool:
+        for result, elapsed in pool.map(timed, range(runs)):
+            if result is None or not result[3]:
+                failures += 1
+                continue
+            download_id, size, first_byte, _ = result
+            latencies.append(elapsed)
+            total_bytes += size
+            if first_byte is not None:
+                first_bytes.append(first_byte)
+            if download_id:
+                ids.append(download_id)
+    wall = time.perf_counter() - start
+    return {
+        'endpoint': name,
+        'runs': runs,
+        'failures': failures,
+        'concurrency': concurrency,
+        'wall_seconds': round(wall, 3),
+        'throughput_per_second': round(len(latencies) / wall, 3) if wall else None,
+        'megabytes_per_second': round(total_bytes / wall / 1024 ** 2, 3) if wall else None,
+        'p50_seconds': percentile(latencies, 0.5),
+        'p99_seconds': percentile(latencies, 0.99),
+        'p50_first_byte_seconds': percentile(first_bytes, 0.5),
+        'download_ids': ids
+    }
+
+
+def process_peak_rss(pid):
+    """Peak resident set size of a process in bytes (Linux), or None"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def process_bytes_written(pid):
+    """Bytes a process caused to be written to storage (Linux), or None"""
+    try:
+        with open(f'/proc/{pid}/io') as f:
+            for line in f:
+                if line.startswith('write_bytes:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def directory_bytes(path):
+    total = 0
+    for dirpath, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(dirpath, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the mirror pipeline against a local synthetic site')
+    parser.add_argument('--pages', type=int, default=50, help='pages in the synthetic site')
+    parser.add_argument('--images', type=int, default=100, help='images spread over the pages')
+    parser.add_argument('--image-kb', type=int, default=32, help='size of each image in KB')
+    parser.add_argument('--fanout', type=int, default=3, help='links per page (1 = one deep chain)')
+    parser.add_argument('--lazy', type=float, default=0.5, help='fraction of images that are lazy-loaded')
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS), help=f"comma separated: {', '.join(ENDPOINTS)}")
+    parser.add_argument('--runs', type=int, default=8, help='requests per endpoint')
+    parser.add_argument('--concurrency', type=int, default=4, help='requests in flight at once')
+    parser.add_argument('--engine', choices=('async', 'wget'), default='async')
+    parser.add_argument('--extra', default='{}', help='JSON merged into every POST body')
+    parser.add_argument('--api', help='benchmark an already running API instead of starting one '
+                                      '(RSS and disk figures are then not available)')
+    parser.add_argument('--json', dest='json_path', help='also write the results to this file')
+    parser.add_argument('--keep', action='store_true', help="keep the API's working directory")
+    args = parser.parse_args()
+
+    endpoints = [e.strip() for e in args.endpoints.split(',') if e.strip()]
+    unknown = set(endpoints) - set(ENDPOINTS)
+    if unknown:
+        parser.error(f"unknown endpoints: {', '.join(sorted(unknown))}")
+    extra = dict(json.loads(args.extra), engine=args.engine)
+
+    site = SyntheticSite(args.pages, args.images, args.image_kb, args.fanout, args.lazy)
+    site_server = site.serve()
+    site_url = f'http://127.0.0.1:{site_server.server_address[1]}/'
+    print(f"🌐 Synthetic site at {site_url}: {args.pages} pages, {args.images} images, "
+          f"{site.total_bytes() / 1024 ** 2:.1f} MB")
+
+    workdir = process = None
+    api = args.api
+    if not api:
+        workdir = tempfile.mkdtemp(prefix='mirror-bench-')
+        process, api = start_api(workdir, free_port(), {'MAX_QUEUE_DEPTH': str(max(args.runs, 100))})
+        print(f"🚀 API server pid {process.pid} in {workdir}")
+
+    results = []
+    try:
+        downloads = []
+        if 'download' in endpoints or set(endpoints) & (set(ARCHIVES) | {'files'}):
+            result = measure('download', args.runs, args.concurrency,
+                             lambda i: run_download(api, site_url, extra))
+            downloads = result.pop('download_ids')
+            if 'download' in endpoints:
+                results.append(result)
+        if 'in-memory' in endpoints:
+            result = measure('in-memory', args.runs, args.concurrency,
+                             lambda i: run_in_memory(api, site_url, extra))
+            result.pop('download_ids')
+            results.append(result)
+        for kind in ARCHIVES:
+            if kind in endpoints and downloads:
+                # The first request per download builds or reads the cached archive, later ones hit the cache
+                result = measure(kind, args.runs, args.concurrency,
+                                 lambda i: run_archive(api, kind, downloads[i % len(downloads)]))
+                result.pop('download_ids')
+                results.append(result)
+        if 'files' in endpoints and downloads:
+            result = measure('files', args.runs, args.concurrency,
+                             lambda i: run_file(api, downloads[i % len(downloads)],
+                                                SERVED_FILES[i % len(SERVED_FILES)]))
+            result.pop('download_ids')
+            results.append(result)
+
+        server = {'peak_rss_bytes': None, 'disk_bytes_written': None, 'disk_bytes_on_disk': None}
+        if process:
+            server['peak_rss_bytes'] = process_peak_rss(process.pid)
+            server['disk_bytes_written'] = process_bytes_written(process.pid)
+    finally:
+        if process:
+            process.terminate()
+            process.wait(timeout=30)
+        site_server.shutdown()
+    if process:
+        if server['peak_rss_bytes'] is None:
+            # ru_maxrss is KB on Linux and bytes on macOS
+            maxrss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+            server['peak_rss_bytes'] = maxrss if sys.platform == 'darwin' else maxrss * 1024
+        server['disk_bytes_on_disk'] = directory_bytes(workdir)
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print()
+    print(f"{'endpoint':<10} {'runs':>5} {'fail':>5} {'req/s':>8} {'MB/s':>8} {'p50 s':>8} {'p99 s':>8} {'ttfb s':>8}")
+    for r in results:
+        cells = [r['throughput_per_second'], r['megabytes_per_second'], r['p50_seconds'],
+                 r['p99_seconds'], r['p50_first_byte_seconds']]
+        print(f"{r['endpoint']:<10} {r['runs']:>5} {r['failures']:>5} "
+              + ' '.join(f"{c:>8.3f}" if c is not None else f"{'-':>8}" for c in cells))
+    mb = lambda value: f"{value / 1024 ** 2:.1f} MB" if value is not None else 'n/a'
+    print(f"\nServer peak RSS: {mb(server['peak_rss_bytes'])}, disk written: {mb(server['disk_bytes_written'])}, "
+          f"left on disk: {mb(server['disk_bytes_on_disk'])}")
+
+    if args.json_path:
+        report = {'site': {'pages': args.pages, 'images': args.images, 'image_kb': args.image_kb,
+                           'fanout': args.fanout, 'lazy': args.lazy, 'bytes': site.total_bytes()},
+                  'results': results, 'server': server}
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    return 1 if any(r['failures'] for r in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
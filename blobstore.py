@@ -0,0 +1,126 @@
+"""
+Site Mirror Tool - content-addressed blob store
+Deduplicates mirrored files across downloads by hardlinking them to one blob per SHA-256
+"""
+
+import hashlib
+import json
+import os
+import threading
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_digest(path):
+    """SHA-256 hex digest of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class BlobStore:
+    """Blobs live at <root>/<sha[:2]>/<sha[2:]>, and every download file is a hardlink to one.
+
+    The filesystem link count is the reference count: a blob with st_nlink == 1 is
+    no longer used by any download and collect_garbage() removes it. Blobs are
+    read-only, so anything that rewrites a mirrored file must write a new file and
+    rename it over the old one instead of editing in place.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.manifest_dir = os.path.join(root, 'manifests')
+        self._gc_lock = threading.RLock()
+        os.makedirs(self.manifest_dir, exist_ok=True)
+
+    def blob_path(self, digest):
+        return os.path.join(self.root, digest[:2], digest[2:])
+
+    def ingest(self, download_id, output_dir, hashes=None):
+        """Move a finished download's files into the store and write its manifest; returns stats.
+
+        hashes ({relative path: sha256}) saves rehashing files whose content is already known.
+        """
+        hashes = hashes or {}
+        manifest = {}
+        stats = {'files': 0, 'deduplicated': 0, 'bytes_saved': 0}
+        for dirpath, _, files in os.walk(output_dir):
+            for name in files:
+                path = os.path.join(dirpath, name)
+                digest = hashes.get(os.path.relpath(path, output_dir)) or file_digest(path)
+                size = os.path.getsize(path)
+                if self._link(path, digest):
+                    stats['deduplicated'] += 1
+                    stats['bytes_saved'] += size
+                stats['files'] += 1
+                manifest[os.path.relpath(path, output_dir)] = {'sha256': digest, 'size': size}
+        manifest_path = os.path.join(self.manifest_dir, f'{download_id}.json')
+        with open(manifest_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+        os.replace(manifest_path + '.tmp', manifest_path)
+        return stats
+
+    def _link(self, path, digest):
+        """Make path a hardlink to the blob for digest; returns True if the blob already existed"""
+        blob = self.blob_path(digest)
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        with self._gc_lock:  # keep collect_garbage from deleting a blob we are about to link
+            try:
+                if os.path.samefile(blob, path):
+                    return True  # already ingested
+                link_path = path + '.blob'
+                os.link(blob, link_path)
+                os.replace(link_path, path)
+                return True
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"Blob store: cannot link {path}: {e}")
+                return False
+            # First copy of this content: the file itself becomes the blob
+            try:
+                os.link(path, blob)
+                os.chmod(blob, 0o444)
+            except FileExistsError:
+                # Another job stored the same content between our checks
+                return self._link(path, digest)
+            except OSError as e:
+                print(f"Blob store: cannot store {path}: {e}")
+            return False
+
+    def manifest(self, download_id):
+        """{relative path: {'sha256', 'size'}} for an ingested download, or None"""
+        try:
+            with open(os.path.join(self.manifest_dir, f'{download_id}.json'), encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def release(self, download_id):
+        """Forget a download's manifest (delete its files first, then collect garbage)"""
+        try:
+            os.unlink(os.path.join(self.manifest_dir, f'{download_id}.json'))
+        except FileNotFoundError:
+            pass
+
+    def collect_garbage(self):
+        """Delete blobs no download links to any more; returns (blobs removed, bytes freed)"""
+        removed = freed = 0
+        with self._gc_lock:
+            for prefix in os.listdir(self.root):
+                prefix_dir = os.path.join(self.root, prefix)
+                if prefix == 'manifests' or not os.path.isdir(prefix_dir):
+                    continue
+                for name in os.listdir(prefix_dir):
+                    blob = os.path.join(prefix_dir, name)
+                    try:
+                        stat = os.stat(blob)
+                        if stat.st_nlink <= 1:
+                            os.unlink(blob)
+                            removed += 1
+                            freed += stat.st_size
+                    except FileNotFoundError:
+                        continue  # removed by another server process's collection meanwhile
+        return removed, freed
@@ -0,0 +1,145 @@
+"""
+Site Mirror Tool - persistent Chromium browser pool
+Long-lived browsers on the shared crawler event loop; jobs borrow a page instead of launching Chromium
+"""
+
+import asyncio
+import atexit
+import os
+from contextlib import asynccontextmanager
+
+from playwright.async_api import async_playwright
+
+import crawler
+
+# Configuration
+BROWSER_POOL_SIZE = int(os.environ.get('BROWSER_POOL_SIZE', 2))  # Chromium processes kept alive
+BROWSER_MAX_PAGES = int(os.environ.get('BROWSER_MAX_PAGES', 100))  # pages served before a browser is recycled
+BROWSER_MAX_CONCURRENCY = int(os.environ.get('BROWSER_MAX_CONCURRENCY', 4))  # pages open at once across the pool
+BROWSER_IDLE_CONTEXTS = 2  # reusable contexts kept per browser
+
+
+class BrowserPool:
+    """Pool of Chromium processes with reusable contexts, health checks and recycling.
+
+    All methods run on the shared crawler loop (see crawler.run_sync).
+    """
+
+    def __init__(self, size=BROWSER_POOL_SIZE, max_pages=BROWSER_MAX_PAGES,
+                 max_concurrency=BROWSER_MAX_CONCURRENCY):
+        self.size = size
+        self.max_pages = max_pages
+        self.max_concurrency = max_concurrency
+        self._playwright = None
+        self._browsers = []  # {'browser', 'pages', 'in_use', 'contexts'}
+        self._semaphore = None
+        self._lock = None
+
+    @asynccontextmanager
+    async def page(self):
+        """Borrow a fresh page in a pooled context; it is closed and the context returned on exit"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._lock = asyncio.Lock()
+        async with self._semaphore:
+            entry, context = await self._checkout()
+            try:
+                yield await context.new_page()
+            finally:
+                await self._checkin(entry, context)
+
+    async def _checkout(self):
+        async with self._lock:
+            if self._playwright is None:
+                self._playwright = await async_playwright().start()
+            await self._health_check()
+            candidates = [e for e in self._browsers if e['pages'] < self.max_pages]
+            # Worn-out browsers still serving pages count against the size until they are retired
+            if len(self._browsers) < self.size and (not candidates or min(e['in_use'] for e in candidates) > 0):
+                candidates.append(await self._launch())
+            if not candidates:
+                # Every browser is worn out and busy: one serves a page past its limit instead
+                candidates = self._browsers
+            entry = min(candidates, key=lambda e: e['in_use'])
+            entry['in_use'] += 1
+            entry['pages'] += 1
+            if entry['contexts']:
+                return entry, entry['contexts'].pop()
+            try:
+                return entry, await entry['browser'].new_context()
+            except Exception:
+                entry['in_use'] -= 1
+                raise
+
+    async def _checkin(self, entry, context):
+        entry['in_use'] -= 1
+        reusable = (entry['browser'].is_connected() and entry['pages'] < self.max_pages
+                    and len(entry['contexts']) < BROWSER_IDLE_CONTEXTS)
+        try:
+            if reusable:
+                # Clear state so the next job does not see this one's session
+                for page in context.pages:
+                    await page.close()
+                await context.clear_cookies()
+                entry['contexts'].append(context)
+            else:
+                await context.close()
+        except Exception as e:
+            print(f"Browser context cleanup failed: {e}")
+        if entry['pages'] >= self.max_pages and entry['in_use'] == 0:
+            await self._retire(entry)
+
+    async def _health_check(self):
+        """Drop browsers that crashed, and worn-out ones nobody is using"""
+        for entry in list(self._browsers):
+            if not entry['browser'].is_connected():
+                print("⚠️ Pooled browser disconnected, replacing it")
+                await self._retire(entry)
+            elif entry['pages'] >= self.max_pages and entry['in_use'] == 0:
+                await self._retire(entry)
+
+    async def _launch(self):
+        browser = await self._playwright.chromium.launch()
+        entry = {'browser': browser, 'pages': 0, 'in_use': 0, 'contexts': []}
+        self._browsers.append(entry)
+        return entry
+
+    async def _retire(self, entry):
+        if entry in self._browsers:
+            self._browsers.remove(entry)
+        try:
+            await entry['browser'].close()
+        except Exception:
+            pass
+
+    async def close(self):
+        """Close every browser and stop Playwright"""
+        for entry in list(self._browsers):
+            await self._retire(entry)
+        if self._playwright is not None:
+            await self._playwright.stop()
+            self._playwright = None
+
+    def stats(self):
+        """Snapshot of pool usage for health reporting"""
+        browsers = list(self._browsers)
+        return {
+            'browsers': len(browsers),
+            'pages_open': sum(e['in_use'] for e in browsers),
+            'max_browsers': self.size,
+            'max_concurrency': self.max_concurrency,
+            'recycle_after_pages': self.max_pages
+        }
+
+
+pool = BrowserPool()
+
+
+@atexit.register
+def shutdown():
+    """Close pooled browsers before the crawler loop goes away"""
+    if pool._browsers:
+        try:
+            crawler.run_sync(pool.close(), timeout=10)
+        except Exception:
+            pass
@@ -0,0 +1,1058 @@
+"""
+Site Mirror Tool - async crawler engine
+Mirrors a site in-process with asyncio + aiohttp instead of shelling out to wget
+"""
+
+import asyncio
+import atexit
+import concurrent.futures
+import functools
+import hashlib
+import html
+import json
+import mimetypes
+import os
+import re
+import shutil
+import tempfile
+import threading
+from contextlib import asynccontextmanager
+from urllib.parse import urljoin, urlparse, urldefrag, unquote, quote
+
+import aiohttp
+
+from httpcache import link_or_copy
+from ratelimit import THROTTLE_STATUSES, HostLimiter
+
+# Configuration
+CRAWL_CONCURRENCY = int(os.environ.get('CRAWL_CONCURRENCY', 16))  # fetch tasks per crawl
+CRAWL_PER_HOST = int(os.environ.get('CRAWL_PER_HOST', 6))  # open connections per host, shared by all crawls
+CRAWL_POOL_SIZE = int(os.environ.get('CRAWL_POOL_SIZE', 100))  # keep-alive connections across all hosts
+CRAWL_TIMEOUT = int(os.environ.get('CRAWL_TIMEOUT', 300))  # seconds per crawl, or per slice of a resumed one
+CHECKPOINT_INTERVAL = float(os.environ.get('CHECKPOINT_INTERVAL', 10))  # seconds between crawl checkpoints
+REQUEST_TIMEOUT = 30
+USER_AGENT = 'Mozilla'
+FETCH_CONCURRENCY = int(os.environ.get('FETCH_CONCURRENCY', 16))  # concurrent downloads per fetch_many call
+FETCH_RETRIES = 3
+RETRY_BACKOFF = 0.5  # seconds before the first retry, doubled on each attempt
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+HOST_RATE = float(os.environ.get('HOST_RATE', 10))  # requests per second per origin, across all jobs
+HOST_BURST = int(os.environ.get('HOST_BURST', 10))  # requests an idle origin may get at once
+HOST_CONCURRENCY = int(os.environ.get('HOST_CONCURRENCY', CRAWL_PER_HOST))  # requests in flight per origin
+
+# Same accept list wget was given with -A (extension-less URLs are always fetched)
+ACCEPT_EXTENSIONS = set((
+    'jpeg,jpg,bmp,gif,png,webp,svg,ico,css,js,html,htm,txt,pdf,doc,docx,xls,xlsx,ppt,pptx,'
+    'mp3,mp4,wav,ogg,webm,zip,tar,gz,bz2,rar,7z,csv,json,xml,yaml,yml,ini,conf,log,sql,sqlite,db'
+).split(','))
+
+# Server-side page extensions that are followed as pages even though -A never listed them
+PAGE_EXTENSIONS = {'php', 'asp', 'aspx', 'jsp', 'cgi', 'shtml', 'xhtml'}
+
+HTML_TYPES = ('text/html', 'application/xhtml+xml')
+CSS_TYPES = ('text/css',)
+
+# (tag, attribute) pairs that reference other resources. 'page' links are followed
+# up to the depth limit, 'requisite' links are always fetched (like wget -p).
+LINK_ATTRIBUTES = {
+    ('a', 'href'): 'page',
+    ('area', 'href'): 'page',
+    ('frame', 'src'): 'page',
+    ('iframe', 'src'): 'page',
+    ('img', 'src'): 'requisite',
+    ('img', 'srcset'): 'requisite',
+    ('source', 'src'): 'requisite',
+    ('source', 'srcset'): 'requisite',
+    ('script', 'src'): 'requisite',
+    ('embed', 'src'): 'requisite',
+    ('audio', 'src'): 'requisite',
+    ('video', 'src'): 'requisite',
+    ('video', 'poster'): 'requisite',
+    ('input', 'src'): 'requisite',
+    ('object', 'data'): 'requisite',
+    ('body', 'background'): 'requisite',
+    ('table', 'background'): 'requisite',
+    ('td', 'background'): 'requisite',
+    ('link', 'href'): 'page',  # upgraded to requisite for the rel values below
+}
+REQUISITE_RELS = {'stylesheet', 'icon', 'shortcut', 'apple-touch-icon', 'preload', 'manifest', 'mask-icon'}
+
+TAG_RE = re.compile(r'<([a-zA-Z][a-zA-Z0-9]*)((?:\s(?:[^>"\']|"[^"]*"|\'[^\']*\')*)?)>', re.S)
+ATTR_RE = re.compile(
+    r'(\s)(href|src|srcset|poster|data|background)(\s*=\s*)(?:"([^"]*)"|\'([^\']*)\'|([^\s>"\']+))',
+    re.I
+)
+REL_RE = re.compile(r'\srel\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s>"\']+))', re.I)
+STYLE_BLOCK_RE = re.compile(r'(<style\b[^>]*>)(.*?)(</style>)', re.S | re.I)
+CSS_URL_RE = re.compile(r'url\(\s*(["\']?)([^"\')]*)\1\s*\)|@import\s+(["\'])([^"\']*)\3', re.I)
+UNSAFE_CHARS_RE = re.compile(r'[\\|:*?"<>\x00-\x1f\x7f]')
+SKIP_SCHEMES = ('#', 'data:', 'javascript:', 'mailto:', 'tel:', 'about:', 'blob:')
+
+
+class CrawlError(Exception):
+    """Raised when the start URL itself cannot be mirrored"""
+
+
+class CrawlCancelled(Exception):
+    """Raised when a crawl stops because its cancel event was set"""
+
+
+# Process-wide event loop and connection pool, shared by every crawl. Worker
+# threads hand coroutines to the loop with run_sync() and block on the result.
+_loop = None
+_loop_lock = threading.Lock()
+_session = None
+_http_cache = None
+_renderer = None
+host_limiter = HostLimiter(HOST_RATE, HOST_BURST, HOST_CONCURRENCY)
+
+
+def get_loop():
+    """Return the shared event loop, starting its thread on first use"""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=_loop.run_forever, name='crawler-loop')
+            thread.daemon = True
+            thread.start()
+        return _loop
+
+
+def run_sync(coro, timeout=None):
+    """Run a coroutine on the shared loop from a worker thread and wait for its result"""
+    future = asyncio.run_coroutine_threadsafe(coro, get_loop())
+    try:
+        return future.result(timeout)
+    except concurrent.futures.TimeoutError:
+        future.cancel()
+        raise TimeoutError(f'Crawl timed out after {timeout} seconds')
+
+
+async def get_session():
+    """Return the shared aiohttp session (keep-alive pool with a per-host connection cap)"""
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=CRAWL_POOL_SIZE,
+            limit_per_host=CRAWL_PER_HOST,
+            keepalive_timeout=30,
+            ttl_dns_cache=300
+        )
+        _session = aiohttp.ClientSession(
+            connector=connector,
+            headers={'User-Agent': USER_AGENT},
+            timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+        )
+    return _session
+
+
+@asynccontextmanager
+async def polite_get(url, headers=None, retries=FETCH_RETRIES):
+    """GET on the shared session through the per-host limiter.
+
+    429 and 503 answers slow the host down and are retried (up to `retries` times)
+    once the limiter lets the host be asked again; the last answer is yielded as is.
+    """
+    session = await get_session()
+    for attempt in range(retries + 1):
+        async with host_limiter.slot(url):
+            resp = await session.get(url, headers=headers)
+            try:
+                host_limiter.feedback(url, resp.status, resp.headers)
+                if resp.status in THROTTLE_STATUSES and attempt < retries:
+                    continue
+                yield resp
+                return
+            finally:
+                resp.release()
+
+
+def set_http_cache(cache):
+    """Share an httpcache.HTTPCache between every crawl and image fetch of this process (None to disable)"""
+    global _http_cache
+    _http_cache = cache
+
+
+def set_renderer(render):
+    """Coroutine function render(url, body) -> HTML used by crawls in render mode (see renderer.render_html)"""
+    global _renderer
+    _renderer = render
+
+
+async def _close_session():
+    if _session is not None and not _session.closed:
+        await _session.close()
+
+
+@atexit.register
+def shutdown():
+    """Close pooled connections when the process exits"""
+    if _loop is not None and _loop.is_running():
+        try:
+            run_sync(_close_session(), timeout=5)
+        except Exception:
+            pass
+
+
+def _safe_name(name):
+    """Escape characters Windows does not allow in file names (--restrict-file-names=windows)"""
+    name = UNSAFE_CHARS_RE.sub(lambda m: '%%%02X' % ord(m.group(0)), name)
+    return name[:200]
+
+
+def url_to_local_path(url, content_type=None):
+    """Map a URL to a path relative to the output directory, using wget's layout"""
+    parsed = urlparse(url)
+    host = (parsed.hostname or 'unknown').lower()
+    if parsed.port:
+        host += f'+{parsed.port}'
+    path = unquote(parsed.path) or '/'
+    if path.endswith('/'):
+        path += 'index.html'
+    parts = [_safe_name(p) for p in path.split('/') if p and p not in ('.', '..')]
+    if not parts:
+        parts = ['index.html']
+    if parsed.query:
+        parts[-1] += '@' + _safe_name(parsed.query)
+    # --adjust-extension: make sure HTML and CSS files open locally
+    if content_type in HTML_TYPES and not re.search(r'\.html?$', parts[-1], re.I):
+        parts[-1] += '.html'
+    elif content_type in CSS_TYPES and not parts[-1].lower().endswith('.css'):
+        parts[-1] += '.css'
+    return os.path.join(host, *parts)
+
+
+def _relative_href(target_path, source_path):
+    """Relative URL from one mirrored file to another"""
+    rel = os.path.relpath(target_path, os.path.dirname(source_path) or '.')
+    return quote(rel.replace(os.sep, '/'), safe="/@=&+,;~!$'()*")
+
+
+def _split_srcset(value):
+    """Split a srcset attribute into (url, descriptor) pairs"""
+    candidates = []
+    for candidate in value.split(','):
+        candidate = candidate.strip()
+        if candidate:
+            url, _, descriptor = candidate.partition(' ')
+            candidates.append((url, descriptor.strip()))
+    return candidates
+
+
+def _attr_kind(tag, attr, attrs_text):
+    """Classify a tag attribute as a page link, a requisite, or None"""
+    kind = LINK_ATTRIBUTES.get((tag, attr))
+    if tag == 'link' and kind:
+        match = REL_RE.search(attrs_text)
+        rel = (match and next(g for g in match.groups() if g is not None) or '').lower().split()
+        if REQUISITE_RELS.intersection(rel):
+            kind = 'requisite'
+    return kind
+
+
+def scan_html(text, replace=None):
+    """Find resource links in HTML, optionally rewriting them in the same pass.
+
+    Returns (links, new_text): links is a list of (raw_value, kind), and
+    replace(raw_value, kind) returns the new value or None to keep it.
+    """
+    links = []
+
+    def handle_value(value, kind, is_srcset):
+        if is_srcset:
+            parts = []
+            for url, descriptor in _split_srcset(value):
+                links.append((url, kind))
+                new = replace(url, kind) if replace else None
+                parts.append(f'{new or url} {descriptor}'.strip())
+            return ', '.join(parts) if replace else value
+        links.append((value, kind))
+        new = replace(value, kind) if replace else None
+        return new if new is not None else value
+
+    def handle_attr(match, tag, attrs_text):
+        attr = match.group(2).lower()
+        kind = _attr_kind(tag, attr, attrs_text)
+        if not kind:
+            return match.group(0)
+        if match.group(4) is not None:
+            value, quote_char = match.group(4), '"'
+        elif match.group(5) is not None:
+            value, quote_char = match.group(5), "'"
+        else:
+            value, quote_char = match.group(6), '"'
+        new = handle_value(value, kind, attr == 'srcset')
+        if not replace:
+            return match.group(0)
+        return f'{match.group(1)}{match.group(2)}{match.group(3)}{quote_char}{new}{quote_char}'
+
+    def handle_tag(match):
+        tag = match.group(1).lower()
+        attrs_text = match.group(2) or ''
+        new_attrs = ATTR_RE.sub(lambda m: handle_attr(m, tag, attrs_text), attrs_text)
+        new_attrs = scan_css(new_attrs, replace, links)[1] if 'url(' in new_attrs else new_attrs
+        return f'<{match.group(1)}{new_attrs}>'
+
+    def handle_style(match):
+        return match.group(1) + scan_css(match.group(2), replace, links)[1] + match.group(3)
+
+    new_text = TAG_RE.sub(handle_tag, text)
+    new_text = STYLE_BLOCK_RE.sub(handle_style, new_text)
+    return links, new_text
+
+
+def scan_css(text, replace=None, links=None):
+    """Find url() and @import references in CSS, optionally rewriting them"""
+    if links is None:
+        links = []
+
+    def handle(match):
+        if match.group(2) is not None:
+            value = match.group(2)
+        else:
+            value = match.group(4)
+        links.append((value, 'requisite'))
+        new = replace(value, 'requisite') if replace else None
+        if new is None:
+            return match.group(0)
+        if match.group(2) is not None:
+            return f'url({match.group(1)}{new}{match.group(1)})'
+        return f'@import {match.group(3)}{new}{match.group(3)}'
+
+    new_text = CSS_URL_RE.sub(handle, text) if replace else text
+    if not replace:
+        for match in CSS_URL_RE.finditer(text):
+            handle(match)
+    return links, new_text
+
+
+SAME_DOMAIN_RULES = ('host', 'subdomains')
+
+
+def glob_to_regex(pattern):
+    """Regex for a URL glob ('*' any run of characters, '?' one), valid in Python and POSIX ERE"""
+    parts = []
+    for char in pattern:
+        if char == '*':
+            parts.append('.*')
+        elif char == '?':
+            parts.append('.')
+        elif char.isalnum() or char in '/:-_~%=&@,;':
+            parts.append(char)
+        else:
+            parts.append('\\' + char)
+    return '^' + ''.join(parts) + '$'
+
+
+class CrawlScope:
+    """Per-crawl limits and filters, compiled once and checked before a URL is queued.
+
+    include and exclude are URL globs ('*' matches anything). include only limits
+    pages, so the images and stylesheets of included pages still come along.
+    mime_types ('image/*', 'application/pdf') filters every other resource; HTML and
+    CSS are always fetched because that is where links are found. max_pages and
+    max_bytes are hard budgets: once reached, nothing more is queued. render saves
+    every HTML page as the DOM a browser built from it, and follows its links.
+    """
+
+    def __init__(self, max_depth=1, max_pages=None, max_bytes=None, include=(), exclude=(),
+                 mime_types=(), same_domain='host', no_parent=True, render=False):
+        self.max_depth = max_depth  # None follows page links without a depth limit
+        self.max_pages = max_pages
+        self.max_bytes = max_bytes
+        self.include = tuple(include)
+        self.exclude = tuple(exclude)
+        self.mime_types = tuple(t.lower() for t in mime_types)
+        self.same_domain = same_domain
+        self.no_parent = no_parent
+        self.render = render
+        self._include_re = re.compile('|'.join(map(glob_to_regex, self.include))) if self.include else None
+        self._exclude_re = re.compile('|'.join(map(glob_to_regex, self.exclude))) if self.exclude else None
+        self._mime_exact = {t for t in self.mime_types if not t.endswith('/*')}
+        self._mime_prefixes = tuple(t[:-1] for t in self.mime_types if t.endswith('/*'))
+
+    @classmethod
+    def from_options(cls, options, default_depth=1):
+        """Scope from the crawl options of a request body; raises ValueError on bad values"""
+        def limit(name, default=None, minimum=1):
+            value = options.get(name, default)
+            if value is not None and (not isinstance(value, int) or isinstance(value, bool) or value < minimum):
+                raise ValueError(f'{name} must be an integer >= {minimum}, or null for no limit')
+            return value
+
+        def patterns(name):
+            value = options.get(name) or []
+            if isinstance(value, str):
+                value = [value]
+            if not isinstance(value, list) or not all(isinstance(v, str) and v for v in value):
+                raise ValueError(f'{name} must be a pattern or a list of patterns')
+            return value
+
+        same_domain = options.get('same_domain', 'host')
+        if same_domain not in SAME_DOMAIN_RULES:
+            raise ValueError(f"same_domain must be one of: {', '.join(SAME_DOMAIN_RULES)}")
+        no_parent = options.get('no_parent', True)
+        if not isinstance(no_parent, bool):
+            raise ValueError('no_parent must be true or false')
+        render = options.get('render', False)
+        if not isinstance(render, bool):
+            raise ValueError('render must be true or false')
+        mime_types = patterns('mime_types')
+        if not all('/' in t for t in mime_types):
+            raise ValueError("mime_types must look like 'image/png' or 'image/*'")
+        return cls(max_depth=limit('depth', default_depth, minimum=0), max_pages=limit('max_pages'),
+                   max_bytes=limit('max_bytes'), include=patterns('include'), exclude=patterns('exclude'),
+                   mime_types=mime_types, same_domain=same_domain, no_parent=no_parent, render=render)
+
+    def to_options(self):
+        """The options this scope was built from, as accepted by from_options"""
+        return {
+            'depth': self.max_depth,
+            'max_pages': self.max_pages,
+            'max_bytes': self.max_bytes,
+            'include': list(self.include),
+            'exclude': list(self.exclude),
+            'mime_types': list(self.mime_types),
+            'same_domain': self.same_domain,
+            'no_parent': self.no_parent,
+            'render': self.render
+        }
+
+    def allows_url(self, url, kind):
+        """Pattern and type filters for a URL about to be queued"""
+        if self._exclude_re and self._exclude_re.match(url):
+            return False
+        if kind == 'page' and self._include_re and not self._include_re.match(url):
+            return False
+        if self.mime_types:
+            guessed = mimetypes.guess_type(urlparse(url).path)[0]
+            if guessed and not self.allows_type(guessed):
+                return False
+        return True
+
+    def allows_type(self, content_type):
+        """Whether a resource of this Content-Type is kept (HTML and CSS always are)"""
+        if not self.mime_types or content_type in HTML_TYPES or content_type in CSS_TYPES:
+            return True
+        return content_type in self._mime_exact or content_type.startswith(self._mime_prefixes)
+
+    def allows_host(self, hostname, hosts):
+        """Whether hostname is in scope, given the hosts of the start URL and its redirects"""
+        if hostname in hosts:
+            return True
+        if self.same_domain == 'subdomains' and hostname:
+            for host in hosts:
+                domain = host[4:] if host.startswith('www.') else host
+                if hostname.endswith('.' + domain):
+                    return True
+        return False
+
+
+class SiteCrawler:
+    """Mirror one site: frontier queue, concurrent fetchers, link extraction and conversion"""
+
+    def __init__(self, start_url, output_dir, max_depth=1, concurrency=CRAWL_CONCURRENCY,
+                 on_progress=None, cancel_event=None, on_file=None, raw_dir=None, previous=None, scope=None,
+                 checkpoint=None, resume=None):
+        self.start_url = urldefrag(start_url)[0]
+        self.output_dir = output_dir
+        self.scope = scope or CrawlScope(max_depth=max_depth)
+        self.concurrency = concurrency
+        self.on_progress = on_progress
+        self.cancel_event = cancel_event  # threading.Event set from another thread
+        self.on_file = on_file  # called with (local path, is_document) once a file is on disk
+        self.raw_dir = raw_dir  # unconverted HTML/CSS bodies by SHA-256, for later refreshes
+        # Earlier crawl to refresh: {'output_dir', 'raw_dir', 'resources'}; unchanged URLs are reused
+        self.previous = previous or {}
+        # Path the crawl state is saved to every CHECKPOINT_INTERVAL and when the crawl stops early (needs
+        # raw_dir); resume is such a state (see load_checkpoint) to continue from
+        self.checkpoint = checkpoint
+        self.resume = resume
+        self.stage = 'crawl'  # 'convert' once the frontier is done and links are being converted
+        parsed = urlparse(self.start_url)
+        self.hosts = {parsed.hostname}
+        # --no-parent: pages must live under the start URL's directory
+        self.root_path = parsed.path[:parsed.path.rfind('/') + 1] or '/'
+        self.queue = None
+        self.seen = set()
+        self.pending = {}  # url -> (url, depth, kind) queued or being fetched, the frontier of a checkpoint
+        self.saved = {}  # url -> relative local path
+        self.written = set()  # local paths already on disk
+        self.documents = []  # (local path, final url, is_html) to convert after the crawl
+        self.resources = {}  # url -> validators and local path, the 'resources' of a later refresh
+        self.errors = []
+        self.pages = 0  # page URLs queued, for max_pages
+        self.stats = {'discovered': 0, 'fetched': 0, 'failed': 0, 'bytes': 0, 'not_modified': 0,
+                      'cached': 0, 'skipped': 0, 'rendered': 0, 'render_failed': 0, 'limits_reached': []}
+
+    async def run(self):
+        """Crawl until the frontier is empty, then convert links; returns the stats"""
+        self.queue = asyncio.Queue()
+        if self.raw_dir:
+            os.makedirs(self.raw_dir, exist_ok=True)
+        if self.resume:
+            self._restore(self.resume)
+        else:
+            self.enqueue(self.start_url, 0, 'page')
+        checkpointer = asyncio.create_task(self._checkpoint_loop()) if self.checkpoint else None
+        try:
+            if self.start_url not in self.saved:
+                # Fetch the start page first so redirects (http -> https, www.) widen the host scope
+                url, depth, kind = self.queue.get_nowait()
+                await self._until_done(asyncio.create_task(self._process(url, depth, kind)))
+                self.queue.task_done()
+                if self.start_url not in self.saved:
+                    raise CrawlError(self.errors[0] if self.errors else f'Failed to fetch {self.start_url}')
+
+            workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+            try:
+                await self._until_done(asyncio.create_task(self.queue.join()))
+            finally:
+                for worker in workers:
+                    worker.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+            if self.stage == 'convert':
+                await self._reload_documents()
+            else:
+                self.stage = 'convert'
+                if self.checkpoint:
+                    self.save_checkpoint()
+            self.convert_links()
+        except BaseException:
+            # Timed out, cancelled or failed: keep what is on disk for a resume
+            if self.checkpoint:
+                self.save_checkpoint()
+            raise
+        finally:
+            if checkpointer:
+                checkpointer.cancel()
+        return dict(self.stats)
+
+    def _restore(self, state):
+        """Continue from a checkpoint: what it stored counts as fetched, its frontier is queued again"""
+        if state.get('start_url') != self.start_url or self.start_url not in state['resources']:
+            self.enqueue(self.start_url, 0, 'page')  # stopped before the start page was stored
+            return
+        self.stage = state['stage']
+        self.hosts.update(state['hosts'])
+        self.seen.update(state['seen'])
+        self.pages = state['pages']
+        self.stats.update(state['stats'])
+        self.errors.extend(state['errors'])
+        for url, resource in state['resources'].items():
+            self.resources[url] = resource
+            self.saved[url] = self.saved[resource['final_url']] = resource['path']
+            self.written.add(resource['path'])
+            if resource.get('document'):
+                self.documents.append((resource['path'], resource['final_url'], resource['document'] in HTML_TYPES))
+        for url, depth, kind in state['frontier']:
+            self.pending[url] = (url, depth, kind)
+            self.queue.put_nowait((url, depth, kind))
+
+    async def _reload_documents(self):
+        """Write every document again from its unconverted body, as link conversion stopped half way"""
+        self.documents = []
+        for resource in list(self.resources.values()):
+            if resource.get('document'):
+                with open(os.path.join(self.raw_dir, resource['sha256']), 'rb') as f:
+                    body = f.read()
+                await self._save_document(0, resource['path'], resource['final_url'],
+                                          resource['document'] in HTML_TYPES, body, resource['sha256'])
+                self.stats['bytes'] -= len(body)  # nothing was downloaded
+
+    def save_checkpoint(self):
+        """Write the crawl state to self.checkpoint: options, frontier, seen URLs and the resources on disk"""
+        state = {
+            'start_url': self.start_url,
+            'options': self.scope.to_options(),
+            'stage': self.stage,
+            'hosts': list(self.hosts),
+            'seen': list(self.seen),
+            'pages': self.pages,
+            'stats': self.stats,
+            'errors': self.errors,
+            'resources': self.resources,
+            'frontier': list(self.pending.values())
+        }
+        try:
+            with open(self.checkpoint + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(state, f)
+            os.replace(self.checkpoint + '.tmp', self.checkpoint)
+        except OSError as e:
+            self.errors.append(f'checkpoint not saved: {e}')
+
+    async def _checkpoint_loop(self):
+        while True:
+            await asyncio.sleep(CHECKPOINT_INTERVAL)
+            self.save_checkpoint()
+
+    def cancelled(self):
+        return self.cancel_event is not None and self.cancel_event.is_set()
+
+    async def _until_done(self, task):
+        """Await a task, waking up regularly so a cancel request aborts in-flight fetches promptly"""
+        try:
+            while not task.done():
+                await asyncio.wait([task], timeout=0.25)
+                if self.cancelled():
+                    raise CrawlCancelled('Crawl cancelled')
+            return task.result()
+        finally:
+            if not task.done():
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+
+    def enqueue(self, url, depth, kind):
+        """Add a URL to the frontier if it is in scope and not seen yet"""
+        url = urldefrag(url)[0]
+        if url in self.seen:
+            return
+        parsed = urlparse(url)
+        scope = self.scope
+        if parsed.scheme not in ('http', 'https') or not scope.allows_host(parsed.hostname, self.hosts):
+            return
+        if kind == 'page':
+            if scope.max_depth is not None and depth > scope.max_depth:
+                return
+            if scope.no_parent and not parsed.path.startswith(self.root_path):
+                return
+        extension = os.path.splitext(parsed.path)[1].lstrip('.').lower()
+        if extension and extension not in ACCEPT_EXTENSIONS:
+            if kind != 'page' or extension not in PAGE_EXTENSIONS:
+                return
+        if url != self.start_url and not scope.allows_url(url, kind):
+            return
+        if self._over_budget():
+            return
+        if kind == 'page' and scope.max_pages is not None:
+            if self.pages >= scope.max_pages:
+                self._limit_reached('max_pages')
+                return
+            self.pages += 1
+        self.seen.add(url)
+        self.pending[url] = (url, depth, kind)
+        self.stats['discovered'] += 1
+        self.queue.put_nowait((url, depth, kind))
+
+    async def _worker(self):
+        while True:
+            url, depth, kind = await self.queue.get()
+            try:
+                await self._process(url, depth, kind)
+            finally:
+                self.queue.task_done()
+
+    def _limit_reached(self, name):
+        if name not in self.stats['limits_reached']:
+            self.stats['limits_reached'].append(name)
+
+    def _over_budget(self):
+        if self.scope.max_bytes is not None and self.stats['bytes'] >= self.scope.max_bytes:
+            self._limit_reached('max_bytes')
+            return True
+        return False
+
+    async def _process(self, url, depth, kind):
+        if self._over_budget():
+            self.stats['skipped'] += 1  # queued before the budget ran out
+            self.pending.pop(url, None)
+            return
+        try:
+            await self._fetch(url, depth, kind)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.stats['failed'] += 1
+            self.errors.append(f'{url}: {e}')
+        self.pending.pop(url, None)
+        if self.on_progress:
+            self.on_progress(dict(self.stats))
+
+    async def _fetch(self, url, depth, kind):
+        previous = self.previous.get('resources', {}).get(url)
+        # A refresh asks the origin about everything it mirrored before, however fresh the cache thinks it is
+        cached = _http_cache.lookup(url) if _http_cache and not previous else None
+        if cached and cached['fresh']:
+            try:
+                await self._save_cached(url, depth, cached)
+                return
+            except OSError:
+                cached = None  # evicted since the lookup
+        headers = {}
+        if previous and previous.get('etag'):
+            headers['If-None-Match'] = previous['etag']
+        if previous and previous.get('last_modified'):
+            headers['If-Modified-Since'] = previous['last_modified']
+        if headers:
+            # Ask where we ended up last time so a redirect does not drop the validators
+            async with polite_get(previous['final_url'], headers=headers) as resp:
+                changed = resp.status != 304
+                if changed:
+                    finish = await self._save_response(url, depth, resp)
+            if changed:
+                if finish:
+                    await finish()
+                return
+            try:
+                await self._reuse(url, depth, previous)
+                return
+            except OSError as e:
+                # The earlier copy is gone; fall back to a full fetch
+                self.errors.append(f'{url}: cannot reuse unchanged copy: {e}')
+        if cached:
+            # Stale but revalidatable: a 304 lets us keep the cached body
+            async with polite_get(url, headers=_http_cache.validators(cached)) as resp:
+                changed = resp.status != 304
+                if changed:
+                    finish = await self._save_response(url, depth, resp)
+                else:
+                    _http_cache.refresh(url, resp.headers)
+            if changed:
+                if finish:
+                    await finish()
+                return
+            try:
+                await self._save_cached(url, depth, cached)
+                return
+            except OSError:
+                pass
+        async with polite_get(url) as resp:
+            finish = await self._save_response(url, depth, resp)
+        if finish:
+            await finish()
+
+    def _claim(self, url, final_url, local_path):
+        """Record where url is saved; returns the full path to write, or None if already written"""
+        if url == self.start_url:
+            self.hosts.add(urlparse(final_url).hostname)
+        self.saved[url] = local_path
+        self.saved[final_url] = local_path
+        self.seen.add(final_url)
+        if local_path in self.written:
+            return None  # another URL (usually a redirect) already produced this file
+        self.written.add(local_path)
+        full_path = os.path.join(self.output_dir, local_path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        if self.resume and os.path.lexists(full_path):
+            # Left by the interrupted run, maybe half written or a hardlink to a shared copy
+            os.unlink(full_path)
+        return full_path
+
+    async def _save_response(self, url, depth, resp):
+        """Save a response; returns None, or for HTML/CSS a coroutine function that saves the body read here.
+
+        Await it once the response is released: rendering a page fetches its scripts
+        through the per-host limiter, whose slot the response still holds.
+        """
+        if resp.status != 200:
+            self.stats['failed'] += 1
+            self.errors.append(f'{url}: HTTP {resp.status}')
+            return
+        final_url = urldefrag(str(resp.url))[0]
+        content_type = resp.headers.get('Content-Type', '').split(';')[0].strip().lower()
+        if not self.scope.allows_type(content_type):
+            self.stats['skipped'] += 1  # the body is never read
+            return
+        local_path = url_to_local_path(final_url, content_type)
+        full_path = self._claim(url, final_url, local_path)
+        if full_path is None:
+            return
+        if content_type in HTML_TYPES or content_type in CSS_TYPES:
+            body = await resp.read()
+            return functools.partial(self._save_fetched_document, url, depth, local_path, final_url,
+                                     content_type, body, resp.headers.copy())
+        # Stream everything else straight to disk
+        digest = hashlib.sha256()
+        truncated = False
+        with open(full_path, 'wb') as f:
+            async for chunk in resp.content.iter_chunked(64 * 1024):
+                f.write(chunk)
+                digest.update(chunk)
+                self.stats['bytes'] += len(chunk)
+                if self._over_budget():
+                    truncated = not resp.content.at_eof()
+                    break
+        if truncated:
+            # Drop the partial file rather than keep a truncated copy
+            os.unlink(full_path)
+            self.written.discard(local_path)
+            self.saved.pop(url, None)
+            self.saved.pop(final_url, None)
+            self.stats['skipped'] += 1
+            return None
+        self._record(url, final_url, local_path, resp.headers, digest.hexdigest(), None, source=full_path)
+        return None
+
+    async def _save_fetched_document(self, url, depth, local_path, final_url, content_type, body, headers):
+        digest = hashlib.sha256(body).hexdigest()
+        await self._save_document(depth, local_path, final_url, content_type in HTML_TYPES, body, digest)
+        self._record(url, final_url, local_path, headers, digest, content_type, body=body)
+
+    def _record(self, url, final_url, local_path, headers, sha256, document, body=None, source=None):
+        """Count a fetched resource, keep its validators for refreshes and share it through the HTTP cache"""
+        self.resources[url] = {
+            'final_url': final_url,
+            'path': local_path,
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'sha256': sha256,
+            'document': document
+        }
+        self.stats['fetched'] += 1
+        if _http_cache:
+            try:
+                _http_cache.store(url, final_url, headers, sha256=sha256,
+                                  **({'body': body} if document else {'source': source}))
+            except OSError as e:
+                self.errors.append(f'{url}: not cached: {e}')
+        if self.on_file:
+            self.on_file(local_path, bool(document))
+
+    async def _save_cached(self, url, depth, entry):
+        """Take a resource from the shared HTTP cache instead of the network"""
+        final_url = entry['final_url']
+        content_type = entry['content_type']
+        if not self.scope.allows_type(content_type):
+            self.stats['skipped'] += 1
+            return
+        local_path = url_to_local_path(final_url, content_type)
+        full_path = self._claim(url, final_url, local_path)
+        if full_path is None:
+            return
+        is_document = content_type in HTML_TYPES or content_type in CSS_TYPES
+        try:
+            if is_document:
+                with open(entry['path'], 'rb') as f:
+                    body = f.read()
+                digest = entry['sha256'] or hashlib.sha256(body).hexdigest()
+                await self._save_document(depth, local_path, final_url, content_type in HTML_TYPES, body, digest)
+                self.stats['bytes'] -= len(body)  # nothing was downloaded
+            else:
+                link_or_copy(entry['path'], full_path)
+        except OSError:
+            self.written.discard(local_path)
+            raise
+        self.resources[url] = {
+            'final_url': final_url,
+            'path': local_path,
+            'etag': entry['etag'],
+            'last_modified': entry['last_modified'],
+            'sha256': entry['sha256'],
+            'document': content_type if is_document else None
+        }
+        self.stats['fetched'] += 1
+        self.stats['cached'] += 1
+        if self.on_file:
+            self.on_file(local_path, is_document)
+
+    async def _save_document(self, depth, local_path, final_url, is_html, body, digest):
+        """Write an HTML/CSS body (rendered, in render mode), keep the unconverted original and queue its links"""
+        self.stats['bytes'] += len(body)
+        if self.raw_dir:
+            # convert_links rewrites the mirrored copy, so refreshes re-parse this one instead
+            raw_path = os.path.join(self.raw_dir, digest)
+            if not os.path.exists(raw_path):
+                with open(raw_path + '.tmp', 'wb') as f:
+                    f.write(body)
+                os.replace(raw_path + '.tmp', raw_path)
+        if is_html and self.scope.render:
+            body = await self._render(final_url, body) or body
+        with open(os.path.join(self.output_dir, local_path), 'wb') as f:
+            f.write(body)
+        # surrogateescape round-trips any charset byte-for-byte through the rewriter
+        text = body.decode('utf-8', errors='surrogateescape')
+        links = scan_html(text)[0] if is_html else scan_css(text)[0]
+        for value, link_kind in links:
+            resolved = self._resolve(value, final_url, is_html)
+            if resolved:
+                self.enqueue(resolved, depth + 1 if link_kind == 'page' else depth, link_kind)
+        self.documents.append((local_path, final_url, is_html))
+
+    async def _render(self, url, body):
+        """The page's DOM after its scripts ran, as UTF-8, or None to keep the fetched HTML"""
+        try:
+            if _renderer is None:
+                raise CrawlError('no renderer configured')
+            html = await _renderer(url, body)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.stats['render_failed'] += 1
+            self.errors.append(f'{url}: render failed, kept the fetched HTML: {e}')
+            return None
+        self.stats['rendered'] += 1
+        return html.encode('utf-8', errors='surrogateescape')
+
+    async def _reuse(self, url, depth, previous):
+        """Take an unchanged (304) resource from the earlier download instead of fetching it"""
+        local_path = previous['path']
+        full_path = self._claim(url, previous['final_url'], local_path)
+        if full_path is None:
+            return
+        try:
+            if previous.get('document'):
+                # Documents are rebuilt from the original body: their links are converted again
+                with open(os.path.join(self.previous['raw_dir'], previous['sha256']), 'rb') as f:
+                    body = f.read()
+                await self._save_document(depth, local_path, previous['final_url'],
+                                          previous['document'] in HTML_TYPES, body, previous['sha256'])
+                self.stats['bytes'] -= len(body)  # nothing was downloaded
+            else:
+                # Mirrored files are read-only blobs, so a hardlink shares them safely
+                source = os.path.join(self.previous['output_dir'], local_path)
+                try:
+                    os.link(source, full_path)
+                except OSError:
+                    shutil.copyfile(source, full_path)
+        except OSError:
+            self.written.discard(local_path)
+            raise
+        self.resources[url] = previous
+        self.stats['fetched'] += 1
+        self.stats['not_modified'] += 1
+        if self.on_file:
+            self.on_file(local_path, bool(previous.get('document')))
+
+    def _resolve(self, value, base_url, is_html):
+        """Turn a raw link value into an absolute URL without fragment, or None"""
+        value = value.strip()
+        if is_html:
+            value = html.unescape(value)
+        if not value or value.lower().startswith(SKIP_SCHEMES):
+            return None
+        absolute = urljoin(base_url, value)
+        if urlparse(absolute).scheme not in ('http', 'https'):
+            return None
+        return absolute
+
+    def convert_links(self):
+        """Rewrite links in saved HTML/CSS to point at local copies (wget -k / --convert-links)"""
+        for local_path, base_url, is_html in self.documents:
+            full_path = os.path.join(self.output_dir, local_path)
+
+            def replace(value, kind, local_path=local_path, base_url=base_url, is_html=is_html):
+                absolute = self._resolve(value, base_url, is_html)
+                if not absolute:
+                    return None
+                url, fragment = urldefrag(absolute)
+                target = self.saved.get(url)
+                if target:
+                    new = _relative_href(target, local_path)
+                    if fragment:
+                        new += '#' + fragment
+                else:
+                    # Not mirrored: point at the live site like wget does
+                    new = absolute
+                return new.replace('&', '&amp;') if is_html else new
+
+            try:
+                with open(full_path, 'rb') as f:
+                    text = f.read().decode('utf-8', errors='surrogateescape')
+                new_text = scan_html(text, replace)[1] if is_html else scan_css(text, replace)[1]
+                # Write a new file rather than truncating: the old one may be a shared blob
+                with open(full_path + '.tmp', 'wb') as f:
+                    f.write(new_text.encode('utf-8', errors='surrogateescape'))
+                os.replace(full_path + '.tmp', full_path)
+            except OSError as e:
+                self.errors.append(f'{local_path}: link conversion failed: {e}')
+
+
+async def fetch_to_file(url, path):
+    """Stream a URL to disk on the shared pool, retrying transient failures.
+
+    Returns (bytes written, True if the body came from the shared HTTP cache).
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    cached = _http_cache.lookup(url) if _http_cache else None
+    if cached and cached['fresh']:
+        try:
+            return link_or_copy(cached['path'], path), True
+        except OSError:
+            cached = None
+    headers = _http_cache.validators(cached) if cached else {}
+    for attempt in range(FETCH_RETRIES + 1):
+        try:
+            # This loop retries, so the limiter only paces the host
+            async with polite_get(url, headers=headers, retries=0) as resp:
+                if resp.status == 304 and cached:
+                    _http_cache.refresh(url, resp.headers)
+                    try:
+                        return link_or_copy(cached['path'], path), True
+                    except OSError:
+                        headers = {}  # evicted meanwhile; fetch it again
+                        continue
+                resp.raise_for_status()
+                # Write to a temp file and rename so concurrent writers never interleave
+                fd, part_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.part')
+                size = 0
+                try:
+                    with os.fdopen(fd, 'wb') as f:
+                        async for chunk in resp.content.iter_chunked(64 * 1024):
+                            f.write(chunk)
+                            size += len(chunk)
+                    os.replace(part_path, path)
+                except BaseException:
+                    os.unlink(part_path)
+                    raise
+                if _http_cache:
+                    try:
+                        _http_cache.store(url, str(resp.url), resp.headers, source=path)
+                    except OSError as e:
+                        print(f"Could not cache {url}: {e}")
+                return size, False
+        except aiohttp.ClientResponseError as e:
+            if e.status not in RETRY_STATUSES or attempt == FETCH_RETRIES:
+                raise
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            if attempt == FETCH_RETRIES:
+                raise
+        await asyncio.sleep(RETRY_BACKOFF * 2 ** attempt)
+
+
+async def fetch_many(requests, concurrency=FETCH_CONCURRENCY):
+    """Fetch (url, path) pairs concurrently; returns (bytes, error, cached) per pair, in order"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch_one(url, path):
+        async with semaphore:
+            try:
+                size, cached = await fetch_to_file(url, path)
+                return size, None, cached
+            except Exception as e:
+                return None, str(e) or e.__class__.__name__, False
+
+    return await asyncio.gather(*(fetch_one(url, path) for url, path in requests))
+
+
+def load_checkpoint(path):
+    """Crawl state saved by SiteCrawler.save_checkpoint, to pass as resume; None if there is none"""
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def start_crawl(url, output_dir, max_depth=1, on_progress=None, cancel_event=None, on_file=None,
+                timeout=CRAWL_TIMEOUT, raw_dir=None, previous=None, scope=None, checkpoint=None, resume=None):
+    """Start a crawl on the shared loop without waiting; returns (crawler, concurrent future of stats).
+
+    max_depth=None follows page links without a depth limit; a CrawlScope, if given,
+    replaces max_depth. See SiteCrawler for raw_dir and previous, which make the
+    crawl refreshable and a refresh, and for checkpoint and resume, which make it resumable.
+    """
+    crawler = SiteCrawler(url, output_dir, max_depth=max_depth, on_progress=on_progress,
+                          cancel_event=cancel_event, on_file=on_file, raw_dir=raw_dir, previous=previous,
+                          scope=scope, checkpoint=checkpoint, resume=resume)
+    future = asyncio.run_coroutine_threadsafe(asyncio.wait_for(crawler.run(), timeout), get_loop())
+    return crawler, future
+
+
+def crawl_site(url, output_dir, max_depth=1, on_progress=None, cancel_event=None, timeout=CRAWL_TIMEOUT,
+               raw_dir=None, previous=None, scope=None, checkpoint=None, resume=None):
+    """Mirror a site into output_dir from a worker thread; returns (stats, errors, resources)"""
+    crawler, future = start_crawl(url, output_dir, max_depth=max_depth, on_progress=on_progress,
+                                  cancel_event=cancel_event, timeout=timeout, raw_dir=raw_dir,
+                                  previous=previous, scope=scope, checkpoint=checkpoint, resume=resume)
+    return future.result(), crawler.errors, crawler.resources
@@ -0,0 +1,174 @@
+"""
+Site Mirror Tool - served file manifests
+Indexes a finished mirror once (size, mtime, MIME type, hash, precompressed variants) so serving it needs no directory scans
+"""
+
+import gzip
+import json
+import mimetypes
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from blobstore import file_digest
+
+try:
+    import brotli
+except ImportError:  # brotli variants are optional
+    brotli = None
+
+PRECOMPRESS_MIN_BYTES = 1024  # smaller files are not worth a variant
+PRECOMPRESS_MIN_SAVING = 0.1  # keep a variant only if it is at least 10% smaller
+VARIANT_GC_GRACE = 3600  # seconds a variant no manifest lists is kept, for manifests still being built
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'application/xml',
+                      'application/xhtml+xml', 'image/svg+xml', 'application/manifest+json')
+ENCODINGS = ('br', 'gzip')  # in order of preference
+ENCODING_SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+
+def _compress(encoding, data):
+    if encoding == 'br':
+        return brotli.compress(data)
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+class FileManifests:
+    """One JSON manifest per completed download in manifest_dir, with the last few loaded kept in memory.
+
+    A manifest maps every file of the website folder (relative path, forward slashes)
+    to its size, mtime, MIME type, SHA-256 and available precompressed encodings.
+    Variants live in variants_dir under their content hash, so identical files of
+    different downloads share them.
+    """
+
+    def __init__(self, manifest_dir, variants_dir, max_loaded=64, precompress=True):
+        self.manifest_dir = manifest_dir
+        self.variants_dir = os.path.abspath(variants_dir)  # send_file resolves relative paths against the app
+        self.max_loaded = max_loaded
+        self.precompress = precompress
+        self._lock = threading.Lock()
+        self._loaded = OrderedDict()  # download_id -> manifest, least recently used first
+        os.makedirs(manifest_dir, exist_ok=True)
+        os.makedirs(variants_dir, exist_ok=True)
+
+    def _path(self, download_id):
+        return os.path.join(self.manifest_dir, f'{download_id}.json')
+
+    def variant_path(self, sha256, encoding):
+        return os.path.join(self.variants_dir, sha256[:2], sha256[2:] + ENCODING_SUFFIXES[encoding])
+
+    def build(self, download_id, output_dir, website_folder, hashes=None):
+        """Index website_folder and write the manifest; hashes ({path relative to output_dir: sha256}) saves rehashing"""
+        hashes = hashes or {}
+        files = {}
+        for dirpath, _, names in os.walk(website_folder):
+            for name in names:
+                path = os.path.join(dirpath, name)
+                stat = os.stat(path)
+                content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+                sha256 = hashes.get(os.path.relpath(path, output_dir)) or file_digest(path)
+                files[os.path.relpath(path, website_folder).replace(os.sep, '/')] = {
+                    'size': stat.st_size,
+                    'mtime': stat.st_mtime,
+                    'type': content_type,
+                    'sha256': sha256,
+                    'encodings': self._precompress(path, content_type, stat.st_size, sha256)
+                }
+        manifest = {
+            'output_dir': os.path.abspath(output_dir),
+            'website_folder': os.path.relpath(website_folder, output_dir),
+            'files': files
+        }
+        with open(self._path(download_id) + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+        os.replace(self._path(download_id) + '.tmp', self._path(download_id))
+        self.forget(download_id)
+        return manifest
+
+    def _precompress(self, path, content_type, size, sha256):
+        """{encoding: size} of the variants worth serving for this file, writing missing ones"""
+        if not self.precompress or size < PRECOMPRESS_MIN_BYTES or not content_type.startswith(COMPRESSIBLE_TYPES):
+            return {}
+        encodings = {}
+        data = None
+        for encoding in ENCODINGS:
+            if encoding == 'br' and brotli is None:
+                continue
+            variant = self.variant_path(sha256, encoding)
+            try:
+                os.utime(variant)  # reused: keeps collect_garbage off it until the manifest is written
+            except FileNotFoundError:
+                if data is None:
+                    with open(path, 'rb') as f:
+                        data = f.read()
+                os.makedirs(os.path.dirname(variant), exist_ok=True)
+                with open(variant + '.tmp', 'wb') as f:
+                    f.write(_compress(encoding, data))
+                os.replace(variant + '.tmp', variant)
+            variant_size = os.path.getsize(variant)
+            if variant_size <= size * (1 - PRECOMPRESS_MIN_SAVING):
+                encodings[encoding] = variant_size
+        return encodings
+
+    def get(self, download_id):
+        """Manifest of a download, or None if it has none (not finished, or mirrored before manifests)"""
+        with self._lock:
+            manifest = self._loaded.get(download_id)
+            if manifest is not None:
+                self._loaded.move_to_end(download_id)
+                return manifest
+        try:
+            with open(self._path(download_id), encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        with self._lock:
+            self._loaded[download_id] = manifest
+            while len(self._loaded) > self.max_loaded:
+                self._loaded.popitem(last=False)
+        return manifest
+
+    def collect_garbage(self, grace=VARIANT_GC_GRACE):
+        """Delete variants whose hash no manifest lists any more; returns (variants removed, bytes freed)"""
+        started = time.time()
+        used = set()
+        for name in os.listdir(self.manifest_dir):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.manifest_dir, name), encoding='utf-8') as f:
+                    used.update(entry['sha256'] for entry in json.load(f)['files'].values())
+            except (OSError, ValueError, KeyError):
+                continue
+        removed = freed = 0
+        for prefix in os.listdir(self.variants_dir):
+            prefix_dir = os.path.join(self.variants_dir, prefix)
+            if not os.path.isdir(prefix_dir):
+                continue
+            for name in os.listdir(prefix_dir):
+                if prefix + name.split('.', 1)[0] in used:
+                    continue
+                variant = os.path.join(prefix_dir, name)
+                try:
+                    stat = os.stat(variant)
+                    if started - stat.st_mtime > grace:
+                        os.unlink(variant)
+                        removed += 1
+                        freed += stat.st_size
+                except FileNotFoundError:
+                    continue  # removed by another server process's collection meanwhile
+        return removed, freed
+
+    def forget(self, download_id):
+        """Drop a loaded manifest so the next get() reads it from disk again"""
+        with self._lock:
+            self._loaded.pop(download_id, None)
+
+    def invalidate(self, download_id):
+        """Forget a download's manifest, in memory and on disk"""
+        self.forget(download_id)
+        try:
+            os.unlink(self._path(download_id))
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,236 @@
+"""
+Site Mirror Tool - shared HTTP cache
+Keeps fetched responses on disk so repeated and concurrent jobs reuse them instead of asking the origin again
+"""
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+
+MAX_AGE_RE = re.compile(r'(?:^|,)\s*(s-maxage|max-age)\s*=\s*"?(\d+)', re.I)
+MAX_ENTRY_FRACTION = 8  # responses larger than max_bytes / 8 are not cached
+RESCAN_INTERVAL = 60  # seconds between re-reading the index from disk, to count other processes' entries
+
+
+def freshness(headers, default_ttl):
+    """Seconds a response may be reused without asking the origin, or None if it must not be stored"""
+    cache_control = headers.get('Cache-Control', '').lower()
+    directives = {directive.split('=')[0].strip() for directive in cache_control.split(',')}
+    if 'no-store' in directives or 'private' in directives or '*' in headers.get('Vary', ''):
+        return None  # private: the cache is shared by every job
+    if 'no-cache' in directives:
+        return 0  # stored, but revalidated before every use
+    ages = {name.lower(): int(seconds) for name, seconds in MAX_AGE_RE.findall(cache_control)}
+    if 's-maxage' in ages:
+        return ages['s-maxage']
+    if 'max-age' in ages:
+        return ages['max-age']
+    expires = headers.get('Expires')
+    if expires:
+        try:
+            expires = parsedate_to_datetime(expires).timestamp()
+        except (TypeError, ValueError):
+            return 0  # an invalid Expires means already expired
+        try:
+            # Measured from the origin's Date, so a skewed clock there does not shift the lifetime
+            now = parsedate_to_datetime(headers.get('Date')).timestamp()
+        except (TypeError, ValueError):
+            now = time.time()
+        return max(0, expires - now)
+    return default_ttl  # the response says nothing: use the configured TTL
+
+
+def link_or_copy(source, path):
+    """Put a copy of source at path (a hardlink when possible); returns its size"""
+    part_path = path + '.cache'
+    try:
+        os.link(source, part_path)
+    except FileExistsError:
+        os.unlink(part_path)
+        os.link(source, part_path)
+    except OSError:
+        shutil.copyfile(source, part_path)
+    os.replace(part_path, path)
+    return os.path.getsize(path)
+
+
+class HTTPCache:
+    """200 responses on disk at <cache_dir>/<key[:2]>/<key>, indexed in memory with LRU eviction.
+
+    Every server process keeps its own index of the shared directory. Entries another process
+    stored are picked up on lookup, and each process re-reads the whole directory every
+    RESCAN_INTERVAL seconds when it stores, so max_bytes bounds the directory, not one
+    process's share of it. Uses touch the metadata file, which orders the LRU across processes.
+
+    Entries follow Cache-Control (no-store, private, no-cache, max-age, s-maxage) and Expires,
+    and live default_ttl seconds when the response says nothing. Stale entries with an
+    ETag or Last-Modified are revalidated with a conditional request instead of being
+    fetched again. Bodies are read-only and handed out as hardlinks, so anything that
+    changes a mirrored file must replace it rather than write into it.
+    """
+
+    def __init__(self, cache_dir, max_bytes, default_ttl):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> metadata, least recently used first
+        self._total = 0
+        self._counts = {'hits': 0, 'misses': 0, 'revalidated': 0}
+        self._scanned = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._rescan()
+
+    def _rescan(self):
+        """Rebuild the index from the entries on disk, written by any server process, least recently used first"""
+        self._scanned = time.monotonic()
+        found = []
+        for prefix in os.listdir(self.cache_dir):
+            prefix_dir = os.path.join(self.cache_dir, prefix)
+            if not os.path.isdir(prefix_dir):
+                continue
+            for name in os.listdir(prefix_dir):
+                if not name.endswith('.json'):
+                    continue
+                key = name[:-5]
+                entry = self._read_entry(key)
+                try:
+                    used = os.stat(self._path(key) + '.json').st_mtime
+                except OSError:
+                    continue
+                if entry is not None:
+                    found.append((used, key, entry))
+        entries = OrderedDict((key, entry) for _, key, entry in sorted(found, key=lambda item: item[0]))
+        with self._lock:
+            self._entries = entries
+            self._total = sum(entry['size'] for entry in entries.values())
+
+    def _read_entry(self, key):
+        """An entry's metadata from disk, or None if it or its body is gone"""
+        try:
+            with open(self._path(key) + '.json', encoding='utf-8') as f:
+                entry = json.load(f)
+            os.stat(self._path(key))
+        except (OSError, ValueError):
+            return None
+        return entry
+
+    def _key(self, url):
+        return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def lookup(self, url):
+        """Cached entry for url with 'path' and 'fresh', or None; marks it as recently used"""
+        key = self._key(url)
+        path = self._path(key)
+        stored = None if key in self._entries else self._read_entry(key)  # by another server process
+        with self._lock:
+            if stored is not None and key not in self._entries:
+                self._entries[key] = stored
+                self._total += stored['size']
+            entry = self._entries.get(key)
+            if entry is not None and not os.path.exists(path):
+                # Evicted by another server process
+                self._total -= self._entries.pop(key)['size']
+                entry = None
+            if entry is None:
+                self._counts['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            fresh = time.time() < entry['expires']
+            self._counts['hits' if fresh else 'misses'] += 1
+            entry = dict(entry, path=path, fresh=fresh)
+        try:
+            os.utime(path + '.json')  # tells the other processes' eviction it was used
+        except OSError:
+            pass
+        return entry
+
+    def validators(self, entry):
+        """Conditional request headers that revalidate a stale entry"""
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def store(self, url, final_url, headers, source=None, body=None, sha256=None):
+        """Cache a 200 response whose body is in the file source or in body; returns True if stored"""
+        ttl = freshness(headers, self.default_ttl)
+        size = len(body) if body is not None else os.path.getsize(source)
+        if ttl is None or size > self.max_bytes // MAX_ENTRY_FRACTION:
+            return False
+        key = self._key(url)
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if body is not None:
+            with open(path + '.part', 'wb') as f:
+                f.write(body)
+            os.replace(path + '.part', path)
+        else:
+            link_or_copy(source, path)
+        entry = {
+            'url': url,
+            'final_url': final_url,
+            'content_type': headers.get('Content-Type', '').split(';')[0].strip().lower(),
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'sha256': sha256,
+            'size': size,
+            'expires': time.time() + ttl
+        }
+        self._write_entry(key, entry)
+        if time.monotonic() - self._scanned > RESCAN_INTERVAL:
+            self._rescan()
+        with self._lock:
+            if key in self._entries:
+                self._total -= self._entries.pop(key)['size']
+            self._entries[key] = entry
+            self._total += size
+            # Evict least recently used entries, but never the one just stored
+            while self._total > self.max_bytes and len(self._entries) > 1:
+                self._remove(next(iter(self._entries)))
+        return True
+
+    def refresh(self, url, headers):
+        """Extend a stale entry after the origin answered 304 Not Modified"""
+        key = self._key(url)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            self._counts['revalidated'] += 1
+            ttl = freshness(headers, self.default_ttl)
+            entry['expires'] = time.time() + (ttl or 0)
+            for field, header in (('etag', 'ETag'), ('last_modified', 'Last-Modified')):
+                if headers.get(header):
+                    entry[field] = headers[header]
+            entry = dict(entry)
+        self._write_entry(key, entry)
+
+    def _write_entry(self, key, entry):
+        meta_path = self._path(key) + '.json'
+        with open(meta_path + '.part', 'w', encoding='utf-8') as f:
+            json.dump(entry, f)
+        os.replace(meta_path + '.part', meta_path)
+
+    def _remove(self, key):
+        self._total -= self._entries.pop(key)['size']
+        for path in (self._path(key), self._path(key) + '.json'):
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counts, entries=len(self._entries), bytes=self._total, max_bytes=self.max_bytes)
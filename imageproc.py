@@ -0,0 +1,262 @@
+"""
+Site Mirror Tool - image post-processing
+Reads real image dimensions from file headers, dedups images by content and makes thumbnails in a process pool
+"""
+
+import atexit
+import concurrent.futures
+import hashlib
+import multiprocessing
+import os
+import re
+import shutil
+import struct
+import threading
+import urllib.parse
+from urllib.parse import urlparse
+
+try:
+    from PIL import Image
+except ImportError:  # thumbnails are optional
+    Image = None
+
+IMAGE_PROCESSES = int(os.environ.get('IMAGE_PROCESSES', os.cpu_count() or 1))  # post-processing pool size
+POOL_START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'  # never fork the threaded server
+IMAGE_INLINE_COUNT = 16  # fewer images are processed in-process; a pool costs more
+THUMBNAIL_SIZE = int(os.environ.get('THUMBNAIL_SIZE', 256))  # longest side of a thumbnail, in pixels
+THUMBNAIL_FORMATS = ('JPEG', 'PNG', 'GIF', 'WEBP')  # kept as is; anything else becomes PNG
+HASH_CHUNK_SIZE = 1024 * 1024
+SVG_HEAD_BYTES = 4096
+INCOMING_DIR = '.incoming'  # under the images folder, where downloads wait to be named
+
+SVG_TAG_RE = re.compile(rb'<svg\b[^>]*>', re.I | re.S)
+SVG_ATTR_RE = re.compile(rb'\s(width|height|viewBox)\s*=\s*["\']([^"\']*)["\']', re.I)
+SVG_LENGTH_RE = re.compile(rb'^\s*([\d.]+)\s*(px)?\s*$')
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def image_filename(full_url):
+    """File name an image URL is saved under, before collisions are resolved"""
+    return os.path.basename(urllib.parse.unquote(urlparse(full_url).path)) or "image"
+
+
+def staged_name(full_url):
+    """Name an image is downloaded under inside INCOMING_DIR: unique per URL"""
+    ext = os.path.splitext(image_filename(full_url))[1].lower()
+    return hashlib.sha1(full_url.encode('utf-8')).hexdigest()[:16] + (ext if len(ext) <= 6 else '')
+
+
+def _read_jpeg(f):
+    """(width, height) from the first start-of-frame marker, skipping other segments unread"""
+    f.seek(2)
+    while True:
+        marker = f.read(2)
+        while marker[:1] == b'\xff' and marker[1:2] == b'\xff':
+            marker = marker[1:] + f.read(1)  # fill bytes
+        if len(marker) < 2 or marker[0] != 0xff:
+            return None
+        code = marker[1]
+        if code in (0xd8, 0x01) or 0xd0 <= code <= 0xd7:
+            continue  # markers without a length
+        length_bytes = f.read(2)
+        if len(length_bytes) < 2:
+            return None
+        length = struct.unpack('>H', length_bytes)[0]
+        if 0xc0 <= code <= 0xcf and code not in (0xc4, 0xc8, 0xcc):
+            data = f.read(5)
+            if len(data) < 5:
+                return None
+            height, width = struct.unpack('>HH', data[1:5])
+            return width, height
+        f.seek(length - 2, os.SEEK_CUR)
+
+
+def _svg_size(head):
+    tag = SVG_TAG_RE.search(head)
+    if not tag:
+        return None
+    attrs = {name.lower(): value for name, value in SVG_ATTR_RE.findall(tag.group(0))}
+    width, height = (SVG_LENGTH_RE.match(attrs.get(key, b'')) for key in (b'width', b'height'))
+    if width and height:
+        return round(float(width.group(1))), round(float(height.group(1)))
+    view_box = attrs.get(b'viewbox', b'').replace(b',', b' ').split()
+    if len(view_box) == 4:
+        try:
+            return round(float(view_box[2])), round(float(view_box[3]))
+        except ValueError:
+            pass
+    return None
+
+
+def probe_image(path):
+    """(format, width, height) read from the file header without decoding the image.
+
+    Covers PNG, GIF, JPEG, WebP, BMP, ICO and SVG; unknown formats give (None, None, None)
+    and known ones with an unreadable size give (format, None, None).
+    """
+    with open(path, 'rb') as f:
+        head = f.read(32)
+        size = None
+        if head.startswith(b'\x89PNG\r\n\x1a\n') and head[12:16] == b'IHDR':
+            return ('png',) + struct.unpack('>II', head[16:24])
+        if head[:6] in (b'GIF87a', b'GIF89a'):
+            return ('gif',) + struct.unpack('<HH', head[6:10])
+        if head.startswith(b'\xff\xd8'):
+            size = _read_jpeg(f)
+            return ('jpeg',) + (size or (None, None))
+        if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+            chunk = head[12:16]
+            if chunk == b'VP8 ' and len(head) >= 30:
+                width, height = struct.unpack('<HH', head[26:30])
+                size = (width & 0x3fff, height & 0x3fff)
+            elif chunk == b'VP8L' and len(head) >= 25:
+                bits = struct.unpack('<I', head[21:25])[0]
+                size = (1 + (bits & 0x3fff), 1 + ((bits >> 14) & 0x3fff))
+            elif chunk == b'VP8X' and len(head) >= 30:
+                size = (1 + int.from_bytes(head[24:27], 'little'), 1 + int.from_bytes(head[27:30], 'little'))
+            return ('webp',) + (size or (None, None))
+        if head.startswith(b'BM') and len(head) >= 26:
+            width, height = struct.unpack('<ii', head[18:26])
+            return 'bmp', width, abs(height)
+        if head[:4] == b'\x00\x00\x01\x00' and len(head) >= 8:
+            return 'ico', head[6] or 256, head[7] or 256
+        f.seek(0)
+        text = f.read(SVG_HEAD_BYTES)
+        if b'<svg' in text.lower():
+            return ('svg',) + (_svg_size(text) or (None, None))
+    return None, None, None
+
+
+def _make_thumbnail(path, size):
+    """Staged thumbnail next to path, or None (no Pillow, or a format it cannot read)"""
+    if Image is None:
+        return None
+    try:
+        with Image.open(path) as img:
+            image_format = img.format if img.format in THUMBNAIL_FORMATS else 'PNG'
+            img.thumbnail((size, size))
+            if image_format == 'JPEG' and img.mode not in ('RGB', 'L'):
+                img = img.convert('RGB')
+            thumbnail_path = path + '.thumb'
+            img.save(thumbnail_path, format=image_format)
+            return thumbnail_path
+    except Exception:
+        return None
+
+
+def process_image(path, thumbnail_size=None):
+    """Pool task: content hash, size, format and dimensions of one downloaded image"""
+    try:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                digest.update(chunk)
+        try:
+            image_format, width, height = probe_image(path)
+        except struct.error:
+            image_format, width, height = None, None, None  # truncated header
+        return {
+            'sha256': digest.hexdigest(),
+            'bytes': os.path.getsize(path),
+            'format': image_format,
+            'width': width,
+            'height': height,
+            'thumbnail': _make_thumbnail(path, thumbnail_size) if thumbnail_size else None,
+            'error': None
+        }
+    except OSError as e:
+        return {'sha256': None, 'bytes': None, 'format': None, 'width': None, 'height': None,
+                'thumbnail': None, 'error': str(e)}
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=IMAGE_PROCESSES, mp_context=multiprocessing.get_context(POOL_START_METHOD))
+        return _pool
+
+
+def process_images(images_dir, downloads, thumbnails=False, processes=IMAGE_PROCESSES):
+    """Name, dedup and measure downloaded images; yields (url, info) in the order of downloads.
+
+    downloads is [(url, staged path)] of files in INCOMING_DIR. Each is hashed and
+    probed (in a process pool when there are many), then moved to a collision-free
+    name in images_dir: its own file name, or name-<hash>.ext when other URLs share
+    that name or a different file already has it. Identical images are kept once and the copies point at the first.
+    info has 'filename', 'sha256', 'bytes', 'format', 'width', 'height', 'thumbnail'
+    (relative to images_dir, or None), 'duplicate_of' and 'error'.
+    """
+    names = [image_filename(url) for url, _ in downloads]
+    shared = _shared(names)
+    size = THUMBNAIL_SIZE if thumbnails and Image is not None else None
+    paths = [path for _, path in downloads]
+    if processes <= 1 or len(paths) < IMAGE_INLINE_COUNT:
+        results = (process_image(path, size) for path in paths)
+    else:
+        # map keeps the input order, so names and duplicates do not depend on timing
+        results = _get_pool().map(process_image, paths, [size] * len(paths),
+                                  chunksize=max(1, len(paths) // (processes * 4)))
+    kept = {}  # sha256 -> (url, filename, thumbnail)
+    for (url, path), name, info in zip(downloads, names, results):
+        info = dict(info, filename=name, duplicate_of=None)
+        if info['error']:
+            yield url, info
+            continue
+        if info['sha256'] in kept:
+            info['duplicate_of'], info['filename'], info['thumbnail'] = kept[info['sha256']]
+            os.unlink(path)
+            _discard(path + '.thumb')
+            yield url, info
+            continue
+        if name in shared or _taken(os.path.join(images_dir, name), info['sha256']):
+            stem, ext = os.path.splitext(name)
+            info['filename'] = f"{stem}-{info['sha256'][:8]}{ext}"
+        os.replace(path, os.path.join(images_dir, info['filename']))
+        if info['thumbnail']:
+            thumbnail = os.path.join('thumbnails', info['filename'])
+            os.makedirs(os.path.join(images_dir, 'thumbnails'), exist_ok=True)
+            os.replace(info['thumbnail'], os.path.join(images_dir, thumbnail))
+            info['thumbnail'] = thumbnail.replace(os.sep, '/')
+        kept[info['sha256']] = (url, info['filename'], info['thumbnail'])
+        yield url, info
+
+
+def _taken(path, sha256):
+    """Whether path holds different content, such as a mirrored file of the same name"""
+    if not os.path.exists(path):
+        return False
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest() != sha256
+
+
+def _shared(names):
+    """Names given to more than one URL"""
+    seen, shared = set(), set()
+    for name in names:
+        (shared if name in seen else seen).add(name)
+    return shared
+
+
+def _discard(path):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def clear_incoming(images_dir):
+    """Remove what is left of the staging folder (failed or duplicate downloads)"""
+    shutil.rmtree(os.path.join(images_dir, INCOMING_DIR), ignore_errors=True)
+
+
+@atexit.register
+def shutdown():
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
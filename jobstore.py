@@ -0,0 +1,259 @@
+"""
+Site Mirror Tool - durable job state
+Download status records in SQLite (shared by every server process) or in memory
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Jobs in these states are owned by a live worker process
+ACTIVE_STATUSES = ('queued', 'starting', 'downloading', 'processing')
+TERMINAL_STATUSES = ('completed', 'failed', 'cancelled')
+CHANGE_POLL_INTERVAL = 1  # seconds between checks for changes written by other processes
+TOMBSTONE_TTL = 3600  # seconds a deletion stays in the change feed
+
+
+class _ChangeFeed:
+    """Every write gives the job a new, store-wide sequence number; wait() blocks for the next one.
+
+    Deleting a job is a write too: changes() reports it as {'id', 'seq', 'status': 'deleted'}
+    for TOMBSTONE_TTL seconds.
+    """
+
+    def __init__(self):
+        self._changed = threading.Condition()
+
+    def _notify(self):
+        with self._changed:
+            self._changed.notify_all()
+
+    def wait(self, since, timeout):
+        """Block until some job changed after sequence number since, or timeout; returns the latest"""
+        deadline = time.monotonic() + timeout
+        with self._changed:
+            while True:
+                seq = self.last_seq()
+                remaining = deadline - time.monotonic()
+                if seq > since or remaining <= 0:
+                    return seq
+                # Writes from this process wake us at once, other processes are polled
+                self._changed.wait(min(remaining, CHANGE_POLL_INTERVAL))
+
+
+class MemoryJobStore(_ChangeFeed):
+    """Job records in a dict: fast, but private to one process and lost on restart"""
+
+    def __init__(self):
+        super().__init__()
+        self._jobs = {}
+        self._seqs = {}  # job_id -> sequence number of its last write
+        self._deleted = {}  # job_id -> (sequence number, time) of its deletion
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def _touch(self, job_id):
+        self._seq += 1
+        self._seqs[job_id] = self._seq
+
+    def create(self, job_id, fields):
+        """Add a job; returns False if one with this ID already exists"""
+        with self._lock:
+            if job_id in self._jobs:
+                return False
+            self._jobs[job_id] = dict(fields, created=time.time())
+            self._deleted.pop(job_id, None)
+            self._touch(job_id)
+        self._notify()
+        return True
+
+    def get(self, job_id):
+        """Copy of a job's record, or None"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def update(self, job_id, fields, expect=None):
+        """Merge fields into a job; with expect, only if its status is one of those. Returns success."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or (expect and job.get('status') not in expect):
+                return False
+            job.update(fields)
+            self._touch(job_id)
+        self._notify()
+        return True
+
+    def delete(self, job_id):
+        """Remove a job; returns False if there was none"""
+        now = time.time()
+        with self._lock:
+            if self._jobs.pop(job_id, None) is None:
+                return False
+            self._seqs.pop(job_id)
+            self._seq += 1
+            self._deleted[job_id] = (self._seq, now)
+            self._deleted = {i: entry for i, entry in self._deleted.items() if now - entry[1] < TOMBSTONE_TTL}
+        self._notify()
+        return True
+
+    def list(self, offset=0, limit=None, status=None):
+        """(jobs, total) newest first, each job with its 'id'"""
+        with self._lock:
+            jobs = [dict(job, id=job_id) for job_id, job in self._jobs.items()
+                    if status is None or job.get('status') == status]
+        jobs.sort(key=lambda job: job['created'], reverse=True)
+        end = None if limit is None else offset + limit
+        return jobs[offset:end], len(jobs)
+
+    def last_seq(self):
+        with self._lock:
+            return self._seq
+
+    def changes(self, since, job_id=None):
+        """Jobs written after sequence number since, oldest change first, each with 'id' and 'seq'"""
+        with self._lock:
+            jobs = [dict(self._jobs[i], id=i, seq=seq) for i, seq in self._seqs.items()
+                    if seq > since and (job_id is None or i == job_id)]
+            jobs += [{'id': i, 'seq': seq, 'status': 'deleted'} for i, (seq, _) in self._deleted.items()
+                     if seq > since and (job_id is None or i == job_id)]
+        return sorted(jobs, key=lambda job: job['seq'])
+
+
+class SQLiteJobStore(_ChangeFeed):
+    """Job records in a SQLite database in WAL mode, so several processes can share them.
+
+    The status and creation time are real columns for indexed listing; the rest of the
+    record is a JSON document. Updates read and write in one IMMEDIATE transaction,
+    which makes them atomic across processes. Sequence numbers come from a one-row
+    counter, so deleting the latest written job never hands its number out again.
+    """
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with self._connect() as db:
+            db.execute('''CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                created REAL NOT NULL,
+                data TEXT NOT NULL
+            )''')
+            db.execute('CREATE INDEX IF NOT EXISTS jobs_created ON jobs (created)')
+            db.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created)')
+            columns = [row[1] for row in db.execute('PRAGMA table_info(jobs)')]
+            if 'seq' not in columns:
+                db.execute('ALTER TABLE jobs ADD COLUMN seq INTEGER NOT NULL DEFAULT 0')
+            db.execute('CREATE INDEX IF NOT EXISTS jobs_seq ON jobs (seq)')
+            db.execute('CREATE TABLE IF NOT EXISTS job_seq (id INTEGER PRIMARY KEY CHECK (id = 0), seq INTEGER NOT NULL)')
+            db.execute('INSERT OR IGNORE INTO job_seq (id, seq) VALUES (0, (SELECT COALESCE(MAX(seq), 0) FROM jobs))')
+            db.execute('CREATE TABLE IF NOT EXISTS deleted_jobs (id TEXT PRIMARY KEY, seq INTEGER NOT NULL, deleted REAL NOT NULL)')
+
+    def _connect(self):
+        """This thread's connection (sqlite3 connections cannot be shared between threads)"""
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+        return _Transaction(db)
+
+    @staticmethod
+    def _next_seq(db):
+        # Only called inside an IMMEDIATE transaction, which serializes writers
+        db.execute('UPDATE job_seq SET seq = seq + 1')
+        return db.execute('SELECT seq FROM job_seq').fetchone()[0]
+
+    def create(self, job_id, fields):
+        """Add a job; returns False if one with this ID already exists"""
+        fields = dict(fields, created=time.time())
+        with self._connect() as db:
+            if db.execute('SELECT 1 FROM jobs WHERE id = ?', (job_id,)).fetchone():
+                return False
+            db.execute('DELETE FROM deleted_jobs WHERE id = ?', (job_id,))
+            db.execute('INSERT INTO jobs (id, status, created, data, seq) VALUES (?, ?, ?, ?, ?)',
+                       (job_id, fields.get('status', ''), fields['created'], json.dumps(fields),
+                        self._next_seq(db)))
+        self._notify()
+        return True
+
+    def get(self, job_id):
+        """Copy of a job's record, or None"""
+        row = self._connect().db.execute('SELECT data FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def update(self, job_id, fields, expect=None):
+        """Merge fields into a job; with expect, only if its status is one of those. Returns success."""
+        with self._connect() as db:
+            row = db.execute('SELECT data FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            if row is None:
+                return False
+            job = json.loads(row[0])
+            if expect and job.get('status') not in expect:
+                return False
+            job.update(fields)
+            db.execute('UPDATE jobs SET status = ?, data = ?, seq = ? WHERE id = ?',
+                       (job.get('status', ''), json.dumps(job), self._next_seq(db), job_id))
+        self._notify()
+        return True
+
+    def delete(self, job_id):
+        """Remove a job; returns False if there was none"""
+        now = time.time()
+        with self._connect() as db:
+            if db.execute('DELETE FROM jobs WHERE id = ?', (job_id,)).rowcount == 0:
+                return False
+            db.execute('INSERT OR REPLACE INTO deleted_jobs (id, seq, deleted) VALUES (?, ?, ?)',
+                       (job_id, self._next_seq(db), now))
+            db.execute('DELETE FROM deleted_jobs WHERE deleted < ?', (now - TOMBSTONE_TTL,))
+        self._notify()
+        return True
+
+    def list(self, offset=0, limit=None, status=None):
+        """(jobs, total) newest first, each job with its 'id'"""
+        where, params = ('WHERE status = ?', (status,)) if status else ('', ())
+        db = self._connect().db
+        total = db.execute(f'SELECT COUNT(*) FROM jobs {where}', params).fetchone()[0]
+        rows = db.execute(f'SELECT id, data FROM jobs {where} ORDER BY created DESC LIMIT ? OFFSET ?',
+                          params + (-1 if limit is None else limit, offset)).fetchall()
+        return [dict(json.loads(data), id=job_id) for job_id, data in rows], total
+
+    def last_seq(self):
+        return self._connect().db.execute('SELECT seq FROM job_seq').fetchone()[0]
+
+    def changes(self, since, job_id=None):
+        """Jobs written after sequence number since, oldest change first, each with 'id' and 'seq'"""
+        where, params = ('AND id = ?', (since, job_id)) if job_id else ('', (since,))
+        rows = self._connect().db.execute(f'SELECT id, data, seq FROM jobs WHERE seq > ? {where} UNION ALL '
+                                          f'SELECT id, NULL, seq FROM deleted_jobs WHERE seq > ? {where} ORDER BY seq',
+                                          params * 2).fetchall()
+        return [dict(json.loads(data), id=i, seq=seq) if data is not None else {'id': i, 'seq': seq, 'status': 'deleted'}
+                for i, data, seq in rows]
+
+
+class _Transaction:
+    """Context manager running a block in BEGIN IMMEDIATE ... COMMIT"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.db.execute('BEGIN IMMEDIATE')
+        return self.db
+
+    def __exit__(self, exc_type, exc, tb):
+        self.db.execute('ROLLBACK' if exc_type else 'COMMIT')
+
+
+def open_job_store(backend, path):
+    """Job store for a JOB_STORE setting: 'sqlite' or 'memory'"""
+    if backend == 'memory':
+        return MemoryJobStore()
+    if backend == 'sqlite':
+        return SQLiteJobStore(path)
+    raise ValueError(f"Unknown job store backend: {backend}")
@@ -0,0 +1,175 @@
+"""
+Site Mirror Tool - job instrumentation
+Per-phase timing and counters for each download, aggregated into Prometheus metrics
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+PHASES = ('crawl', 'render', 'image_fetch', 'image_process', 'rewrite', 'dedup', 'manifest', 'archive')
+COUNTERS = ('bytes', 'requests', 'cache_hits', 'errors')
+DURATION_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+class JobMetrics:
+    """Wall time and counters for each phase of one job.
+
+    Inside `with job_metrics.phase('crawl') as phase:` the caller adds to phase['bytes'],
+    phase['requests'], phase['cache_hits'] and phase['errors']. An exception leaving
+    the block counts as an error unless it is one of `expected` (e.g. cancellation).
+    """
+
+    def __init__(self, registry=None, on_change=None, expected=()):
+        self.registry = registry
+        self.on_change = on_change  # called with the phases dict when a phase starts or ends
+        self.expected = expected
+        self.phases = {}
+
+    @contextmanager
+    def phase(self, name):
+        record = {'seconds': None}
+        record.update((counter, 0) for counter in COUNTERS)
+        self.phases[name] = record
+        self._changed()
+        start = time.monotonic()
+        try:
+            yield record
+        except Exception as e:
+            if not isinstance(e, self.expected):
+                record['errors'] += 1
+            raise
+        finally:
+            record['seconds'] = round(time.monotonic() - start, 3)
+            if self.registry:
+                self.registry.observe(name, record)
+            self._changed()
+
+    def _changed(self):
+        if self.on_change:
+            try:
+                self.on_change(self.phases)
+            except Exception as e:
+                print(f"Could not record job metrics: {e}")
+
+
+class MetricsRegistry:
+    """Phase totals for this process, saved to <metrics_dir>/<worker>.json after every phase.
+
+    Every server process writes its own file and render() adds them all up, so a
+    scrape sees the totals of the whole deployment whichever process answers it.
+    """
+
+    def __init__(self, metrics_dir, worker):
+        self.metrics_dir = metrics_dir
+        self.path = os.path.join(metrics_dir, f'{worker}.json')
+        self._lock = threading.Lock()
+        self._phases = {}
+        os.makedirs(metrics_dir, exist_ok=True)
+
+    def observe(self, phase, record):
+        with self._lock:
+            totals = self._phases.setdefault(phase, _empty_totals())
+            totals['count'] += 1
+            totals['seconds'] += record['seconds']
+            for index, bound in enumerate(DURATION_BUCKETS):
+                if record['seconds'] <= bound:
+                    totals['buckets'][index] += 1
+                    break
+            for counter in COUNTERS:
+                totals[counter] += record[counter]
+            self._save()
+
+    def _save(self):
+        data = json.dumps(self._phases)
+        try:
+            with open(self.path + '.tmp', 'w', encoding='utf-8') as f:
+                f.write(data)
+            os.replace(self.path + '.tmp', self.path)
+        except OSError as e:
+            print(f"Could not save metrics: {e}")
+
+    def totals(self):
+        """Phase totals summed over every process's file"""
+        merged = {}
+        for name in os.listdir(self.metrics_dir):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.metrics_dir, name), encoding='utf-8') as f:
+                    _merge(merged, json.load(f))
+            except (OSError, ValueError):
+                continue
+        return merged
+
+    def absorb(self, is_dead):
+        """Fold the files of workers for which is_dead(worker) is true into this process's totals and
+        delete them, so the directory does not grow with every restart; returns how many were folded"""
+        own = os.path.basename(self.path)
+        folded = 0
+        for name in os.listdir(self.metrics_dir):
+            if not name.endswith('.json') or name == own or not is_dead(name[:-len('.json')]):
+                continue
+            claimed = self.path + f'.{name}.absorbing'
+            try:
+                os.rename(os.path.join(self.metrics_dir, name), claimed)  # only one process gets to fold it
+            except FileNotFoundError:
+                continue
+            try:
+                with open(claimed, encoding='utf-8') as f:
+                    phases = json.load(f)
+            except (OSError, ValueError):
+                phases = {}
+            with self._lock:
+                _merge(self._phases, phases)
+                self._save()
+            os.unlink(claimed)
+            folded += 1
+        return folded
+
+    def render(self, gauges=()):
+        """Prometheus text exposition of the phase totals plus (name, help, {labels: value}) gauges"""
+        totals = self.totals()
+        phases = [p for p in PHASES if p in totals] + sorted(p for p in totals if p not in PHASES)
+        lines = [
+            '# HELP sitemirror_phase_duration_seconds Wall time of each job phase',
+            '# TYPE sitemirror_phase_duration_seconds histogram'
+        ]
+        for phase in phases:
+            cumulative = 0
+            for bound, count in zip(DURATION_BUCKETS, totals[phase]['buckets']):
+                cumulative += count
+                lines.append(f'sitemirror_phase_duration_seconds_bucket{{phase="{phase}",le="{bound}"}} {cumulative}')
+            lines.append(f'sitemirror_phase_duration_seconds_bucket{{phase="{phase}",le="+Inf"}} {totals[phase]["count"]}')
+            lines.append(f'sitemirror_phase_duration_seconds_sum{{phase="{phase}"}} {round(totals[phase]["seconds"], 3)}')
+            lines.append(f'sitemirror_phase_duration_seconds_count{{phase="{phase}"}} {totals[phase]["count"]}')
+        for counter in COUNTERS:
+            lines.append(f'# HELP sitemirror_phase_{counter}_total {counter.replace("_", " ").capitalize()} by job phase')
+            lines.append(f'# TYPE sitemirror_phase_{counter}_total counter')
+            for phase in phases:
+                lines.append(f'sitemirror_phase_{counter}_total{{phase="{phase}"}} {totals[phase][counter]}')
+        for name, help_text, values in gauges:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} gauge')
+            for labels, value in values.items():
+                label_text = ','.join(f'{k}="{v}"' for k, v in labels)
+                lines.append(f'{name}{{{label_text}}} {value}' if label_text else f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def _merge(into, phases):
+    for phase, totals in phases.items():
+        merged = into.setdefault(phase, _empty_totals())
+        for key, value in totals.items():
+            if key == 'buckets':
+                merged[key] = [a + b for a, b in zip(merged[key], value)]
+            else:
+                merged[key] += value
+
+
+def _empty_totals():
+    totals = {'count': 0, 'seconds': 0.0, 'buckets': [0] * len(DURATION_BUCKETS)}
+    totals.update((counter, 0) for counter in COUNTERS)
+    return totals
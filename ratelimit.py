@@ -0,0 +1,127 @@
+"""
+Site Mirror Tool - per-host politeness
+Token-bucket rate limit and concurrency cap per origin, shared by every fetch on the crawler loop
+"""
+
+import asyncio
+import threading
+import time
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+THROTTLE_STATUSES = {429, 503}
+FIRST_BACKOFF = 1  # seconds a host is paused after its first throttling answer without Retry-After
+MAX_BACKOFF = 60  # longest pause, whatever Retry-After asks for
+MIN_RATE = 0.2  # requests per second a throttled host is slowed down to at most
+RECOVERY_STEP = 0.1  # fraction of the configured rate regained per successful response
+MAX_IDLE_HOSTS = 1024  # idle hosts remembered before their state is dropped
+
+
+def retry_after(headers):
+    """Seconds asked for by a Retry-After header (delay or HTTP date), or None"""
+    value = headers.get('Retry-After', '').strip()
+    if not value:
+        return None
+    if value.isdigit():
+        return int(value)
+    try:
+        return max(0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class _Host:
+    def __init__(self, rate, burst, concurrency):
+        self.rate = rate
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0
+        self.backoff = FIRST_BACKOFF
+        self.active = 0
+        self.semaphore = asyncio.Semaphore(concurrency)
+
+
+class HostLimiter:
+    """Per-host token bucket (rate requests/s, burst) plus at most `concurrency` requests in flight.
+
+    A 429 or 503 halves the host's rate and pauses it for Retry-After seconds (or an
+    exponential backoff when there is none); each successful response then wins back
+    part of the configured rate. Must be used from a single event loop.
+    """
+
+    def __init__(self, rate, burst, concurrency):
+        self.rate = rate
+        self.burst = burst
+        self.concurrency = concurrency
+        self._hosts = {}
+        self._lock = threading.Lock()  # stats() is read from other threads
+        self._throttled = 0
+
+    def _host(self, url):
+        key = urlparse(url).netloc.lower()
+        with self._lock:
+            state = self._hosts.get(key)
+            if state is None:
+                if len(self._hosts) >= MAX_IDLE_HOSTS:
+                    self._prune()
+                state = self._hosts[key] = _Host(self.rate, self.burst, self.concurrency)
+            return state
+
+    def _prune(self):
+        now = time.monotonic()
+        for key, state in list(self._hosts.items()):
+            if state.active == 0 and state.blocked_until <= now and state.rate >= self.rate:
+                del self._hosts[key]
+
+    @asynccontextmanager
+    async def slot(self, url):
+        """Wait for a concurrency slot and a token for url's host, and hold the slot for the block"""
+        state = self._host(url)
+        state.active += 1
+        try:
+            async with state.semaphore:
+                await self._take_token(state)
+                yield
+        finally:
+            state.active -= 1
+
+    async def _take_token(self, state):
+        while True:
+            now = time.monotonic()
+            if now < state.blocked_until:
+                await asyncio.sleep(state.blocked_until - now)
+                continue
+            state.tokens = min(self.burst, state.tokens + (now - state.updated) * state.rate)
+            state.updated = now
+            if state.tokens >= 1:
+                state.tokens -= 1
+                return
+            await asyncio.sleep((1 - state.tokens) / state.rate)
+
+    def feedback(self, url, status, headers):
+        """Adapt the host's pace to a response: slow down on 429/503, speed back up otherwise"""
+        state = self._host(url)
+        if status in THROTTLE_STATUSES:
+            delay = retry_after(headers)
+            if delay is None:
+                delay = state.backoff
+                state.backoff = min(state.backoff * 2, MAX_BACKOFF)
+            state.blocked_until = max(state.blocked_until, time.monotonic() + min(delay, MAX_BACKOFF))
+            state.rate = max(MIN_RATE, min(state.rate / 2, self.rate))
+            state.tokens = 0
+            self._throttled += 1
+        elif state.rate < self.rate or state.backoff > FIRST_BACKOFF:
+            state.backoff = FIRST_BACKOFF
+            state.rate = min(self.rate, state.rate + self.rate * RECOVERY_STEP)
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            hosts = list(self._hosts.values())
+        return {
+            'hosts': len(hosts),
+            'paused': sum(1 for state in hosts if state.blocked_until > now),
+            'slowed': sum(1 for state in hosts if state.rate < self.rate),
+            'throttled_responses': self._throttled
+        }
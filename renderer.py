@@ -0,0 +1,47 @@
+"""
+Site Mirror Tool - JavaScript rendering
+Runs crawled pages through the browser pool and hands back the DOM their scripts built
+"""
+
+import os
+
+from playwright.async_api import TimeoutError as PlaywrightTimeoutError
+
+import browser_pool
+import crawler
+
+RENDER_TIMEOUT = float(os.environ.get('RENDER_TIMEOUT', 15))  # seconds for a page to load in the browser
+RENDER_IDLE_TIMEOUT = float(os.environ.get('RENDER_IDLE_TIMEOUT', 2))  # seconds then waited for the network to go quiet
+BLOCKED_RESOURCE_TYPES = {'image', 'media', 'font'}  # the crawler fetches these from the rendered DOM itself
+
+
+async def render_html(url, body):
+    """HTML of url after its scripts ran, rendered in a pooled page from the body the crawler already fetched.
+
+    The page itself is not requested again. Scripts, stylesheets and XHR go to the
+    network through the per-host limiter. Images, media and fonts are not loaded.
+    Raises on load failures and after RENDER_TIMEOUT; a page that never goes idle
+    is snapshotted after RENDER_IDLE_TIMEOUT.
+    """
+    served = False
+
+    async def handle(route):
+        nonlocal served
+        request = route.request
+        if not served and request.is_navigation_request() and request.frame == page.main_frame:
+            served = True
+            await route.fulfill(status=200, content_type='text/html', body=body)
+        elif request.resource_type in BLOCKED_RESOURCE_TYPES:
+            await route.abort()
+        else:
+            async with crawler.host_limiter.slot(request.url):
+                await route.continue_()
+
+    async with browser_pool.pool.page() as page:
+        await page.route('**/*', handle)
+        await page.goto(url, wait_until='load', timeout=RENDER_TIMEOUT * 1000)
+        try:
+            await page.wait_for_load_state('networkidle', timeout=RENDER_IDLE_TIMEOUT * 1000)
+        except PlaywrightTimeoutError:
+            pass  # pages that keep polling never go idle; keep what has rendered
+        return await page.content()
@@ -0,0 +1,163 @@
+"""
+Site Mirror Tool - link rewriting
+Points root-relative and same-origin links in a finished mirror at the local copies, one pass per file
+"""
+
+import atexit
+import concurrent.futures
+import html
+import multiprocessing
+import os
+import threading
+from urllib.parse import urljoin, urlparse, urldefrag
+
+from crawler import (CSS_TYPES, HTML_TYPES, SKIP_SCHEMES, _relative_href, scan_css, scan_html,
+                     url_to_local_path)
+
+REWRITE_PROCESSES = int(os.environ.get('REWRITE_PROCESSES', os.cpu_count() or 1))  # rewriter pool size
+# Start workers from a clean process: forking the threaded server could copy a lock another thread holds
+POOL_START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+REWRITE_INLINE_FILES = 32  # mirrors with fewer documents are rewritten in-process; a pool costs more
+REWRITE_BATCHES_PER_PROCESS = 4  # the link map is sent with every batch, so keep batches few
+HTML_EXTENSIONS = ('.html', '.htm', '.xhtml', '.shtml')
+CSS_EXTENSIONS = ('.css',)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class LinkMap:
+    """Which URLs a mirror has a local copy of.
+
+    `files` holds every path relative to the output directory (forward slashes), the
+    top-level directories are the mirrored hosts, and `url_map` adds absolute URLs
+    saved somewhere else, such as images captured by the browser.
+    """
+
+    def __init__(self, files, url_map=None):
+        self.files = files
+        self.hosts = {path.split('/', 1)[0] for path in files if '/' in path}
+        self.url_map = url_map or {}
+
+    @classmethod
+    def scan(cls, output_dir, url_map=None):
+        files = set()
+        for dirpath, _, names in os.walk(output_dir):
+            rel_dir = os.path.relpath(dirpath, output_dir).replace(os.sep, '/')
+            for name in names:
+                files.add(name if rel_dir == '.' else f'{rel_dir}/{name}')
+        return cls(files, url_map)
+
+    def local_path(self, url):
+        """Mirrored file for an absolute URL, or None"""
+        if url in self.url_map:
+            return self.url_map[url]
+        if _host_dir(url) not in self.hosts:
+            return None
+        # Pages and stylesheets may have been saved with an added extension
+        for content_type in (None, HTML_TYPES[0], CSS_TYPES[0]):
+            path = url_to_local_path(url, content_type).replace(os.sep, '/')
+            if path in self.files:
+                return path
+        return None
+
+    def rewrite(self, value, source_path, is_html):
+        """New value for a link found in source_path, or None to keep it"""
+        raw = value.strip()
+        if is_html:
+            raw = html.unescape(raw)
+        if not raw or raw.lower().startswith(SKIP_SCHEMES) or raw.startswith('#'):
+            return None
+        url, fragment = urldefrag(urljoin(_source_url(source_path), raw))
+        if urlparse(url).scheme not in ('http', 'https'):
+            return None
+        target = self.local_path(url)
+        if target is None:
+            return None
+        if not raw.startswith('/') and '://' not in raw and url not in self.url_map:
+            return None  # relative links are already right, or point at something we do not have
+        new = _relative_href(target, source_path)
+        if fragment:
+            new += '#' + fragment
+        return new.replace('&', '&amp;') if is_html else new
+
+
+def _host_dir(url):
+    return url_to_local_path(url).replace(os.sep, '/').split('/', 1)[0]
+
+
+def _source_url(source_path):
+    """URL a mirrored file was fetched from, close enough to resolve links against"""
+    host, _, path = source_path.partition('/')
+    name, plus, port = host.rpartition('+')
+    if plus and port.isdigit():
+        host = f'{name}:{port}'
+    return f'http://{host}/{path}'
+
+
+def rewrite_file(output_dir, local_path, link_map):
+    """Rewrite one HTML or CSS file in a single pass; returns True if it changed"""
+    is_html = local_path.lower().endswith(HTML_EXTENSIONS)
+    full_path = os.path.join(output_dir, local_path)
+    with open(full_path, 'rb') as f:
+        # surrogateescape round-trips any charset byte-for-byte through the rewriter
+        text = f.read().decode('utf-8', errors='surrogateescape')
+    replace = lambda value, kind: link_map.rewrite(value, local_path, is_html)
+    new_text = scan_html(text, replace)[1] if is_html else scan_css(text, replace)[1]
+    if new_text == text:
+        return False
+    # Write a new file rather than truncating: the old one may be a shared blob
+    with open(full_path + '.tmp', 'wb') as f:
+        f.write(new_text.encode('utf-8', errors='surrogateescape'))
+    os.replace(full_path + '.tmp', full_path)
+    return True
+
+
+def _rewrite_batch(output_dir, paths, link_map):
+    """Pool task: (files rewritten, errors) for a batch of documents"""
+    rewritten, errors = 0, []
+    for path in paths:
+        try:
+            rewritten += rewrite_file(output_dir, path, link_map)
+        except OSError as e:
+            errors.append(f'{path}: {e}')
+    return rewritten, errors
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=REWRITE_PROCESSES, mp_context=multiprocessing.get_context(POOL_START_METHOD))
+        return _pool
+
+
+def rewrite_mirror(output_dir, url_map=None, processes=REWRITE_PROCESSES):
+    """Point root-relative and same-origin links in every HTML/CSS file of a mirror at local copies.
+
+    url_map adds {absolute URL: path relative to output_dir} for files saved outside the
+    crawl. Returns {'documents', 'rewritten', 'errors'}.
+    """
+    link_map = LinkMap.scan(output_dir, url_map)
+    documents = sorted(path for path in link_map.files
+                       if path.lower().endswith(HTML_EXTENSIONS + CSS_EXTENSIONS))
+    if processes <= 1 or len(documents) < REWRITE_INLINE_FILES:
+        rewritten, errors = _rewrite_batch(output_dir, documents, link_map)
+    else:
+        batches = min(len(documents), processes * REWRITE_BATCHES_PER_PROCESS)
+        pool = _get_pool()
+        futures = [pool.submit(_rewrite_batch, output_dir, documents[i::batches], link_map)
+                   for i in range(batches)]
+        rewritten, errors = 0, []
+        for future in futures:
+            count, batch_errors = future.result()
+            rewritten += count
+            errors.extend(batch_errors)
+    return {'documents': len(documents), 'rewritten': rewritten, 'errors': errors}
+
+
+@atexit.register
+def shutdown():
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
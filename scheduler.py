@@ -0,0 +1,104 @@
+"""
+Site Mirror Tool - bounded job scheduler
+Fixed-size worker pool fed from a priority/FIFO queue with a maximum depth
+"""
+
+import heapq
+import itertools
+import threading
+
+
+class QueueFull(Exception):
+    """Raised when a job is submitted while the queue is at its maximum depth"""
+
+
+class JobCancelled(Exception):
+    """Raised inside a running job once it notices its cancel event"""
+
+
+class JobScheduler:
+    """Run jobs on a fixed number of worker threads, highest priority first, FIFO within a priority"""
+
+    def __init__(self, workers=4, max_queue=100):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._heap = []  # (-priority, sequence, job_id)
+        self._jobs = {}  # job_id -> (target, args)
+        self._cancel_events = {}  # job_id -> threading.Event, for queued and running jobs
+        self._running = set()
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._started = False  # workers start with the first job, so processes that never queue one have none
+
+    def submit(self, job_id, target, args=(), priority=0):
+        """Queue target(*args, cancel_event=...) to run; raises QueueFull when the queue is full"""
+        with self._condition:
+            if len(self._heap) >= self.max_queue:
+                raise QueueFull(f'Queue is full ({self.max_queue} jobs waiting)')
+            if not self._started:
+                self._started = True
+                for i in range(self.workers):
+                    thread = threading.Thread(target=self._worker, name=f'job-worker-{i}')
+                    thread.daemon = True
+                    thread.start()
+            self._jobs[job_id] = (target, args)
+            self._cancel_events[job_id] = threading.Event()
+            heapq.heappush(self._heap, (-priority, next(self._sequence), job_id))
+            self._condition.notify()
+
+    def position(self, job_id):
+        """1-based position of a queued job, or None if it is not queued"""
+        with self._condition:
+            for index, entry in enumerate(sorted(self._heap)):
+                if entry[2] == job_id:
+                    return index + 1
+        return None
+
+    def cancel(self, job_id):
+        """Cancel a job; returns 'queued' or 'running' for the state it was in, or None"""
+        with self._condition:
+            for index, entry in enumerate(self._heap):
+                if entry[2] == job_id:
+                    self._heap.pop(index)
+                    heapq.heapify(self._heap)
+                    del self._jobs[job_id]
+                    self._cancel_events.pop(job_id).set()
+                    return 'queued'
+            if job_id in self._running:
+                # Running jobs check their event between steps and stop themselves
+                self._cancel_events[job_id].set()
+                return 'running'
+        return None
+
+    def job_ids(self):
+        """IDs of the jobs that are queued or running"""
+        with self._condition:
+            return list(self._cancel_events)
+
+    def stats(self):
+        """Snapshot of pool usage for health reporting"""
+        with self._condition:
+            return {
+                'workers': self.workers,
+                'running': len(self._running),
+                'queued': len(self._heap),
+                'max_queue': self.max_queue
+            }
+
+    def _worker(self):
+        while True:
+            with self._condition:
+                while not self._heap:
+                    self._condition.wait()
+                _, _, job_id = heapq.heappop(self._heap)
+                target, args = self._jobs.pop(job_id)
+                cancel_event = self._cancel_events[job_id]
+                self._running.add(job_id)
+            try:
+                target(*args, cancel_event=cancel_event)
+            except Exception as e:
+                print(f"Job {job_id} crashed: {e}")
+            finally:
+                with self._condition:
+                    self._running.discard(job_id)
+                    self._cancel_events.pop(job_id, None)
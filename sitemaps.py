@@ -0,0 +1,104 @@
+"""
+Site Mirror Tool - sitemap reading
+Expands a sitemap.xml (or sitemap index, gzipped or plain text) into the page URLs it lists
+"""
+
+import xml.etree.ElementTree as ElementTree
+import zlib
+from urllib.parse import urlparse
+
+import crawler
+
+MAX_SITEMAP_BYTES = 50 * 1024 * 1024  # the sitemaps.org limit for one uncompressed file
+MAX_SITEMAP_DEPTH = 3  # nested sitemap indexes followed at most
+
+
+class SitemapError(Exception):
+    """Raised when the top-level sitemap cannot be fetched or parsed"""
+
+
+def _local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def _too_large():
+    return SitemapError(f'Sitemap is larger than {MAX_SITEMAP_BYTES // (1024 * 1024)} MB')
+
+
+def _gunzip(data):
+    """Decompress a gzipped sitemap, giving up once the output passes MAX_SITEMAP_BYTES"""
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    try:
+        output = decompressor.decompress(data, MAX_SITEMAP_BYTES + 1)
+    except zlib.error as e:
+        raise SitemapError(f'Bad gzip data: {e}') from e
+    if len(output) > MAX_SITEMAP_BYTES:
+        raise _too_large()
+    return output
+
+
+def parse_sitemap(data):
+    """('urlset' or 'sitemapindex', [<loc> values]) of a sitemap document; text sitemaps count as urlset"""
+    if data[:2] == b'\x1f\x8b':
+        data = _gunzip(data)
+    if len(data) > MAX_SITEMAP_BYTES:
+        raise _too_large()
+    try:
+        root = ElementTree.fromstring(data)
+    except ElementTree.ParseError:
+        # Plain text sitemap: one URL per line
+        lines = data.decode('utf-8', errors='replace').split()
+        if lines and all(urlparse(line).scheme in ('http', 'https') for line in lines):
+            return 'urlset', lines
+        raise SitemapError('Not a sitemap: neither XML nor a list of URLs')
+    kind = _local_name(root.tag)
+    if kind not in ('urlset', 'sitemapindex'):
+        raise SitemapError(f'Not a sitemap: root element is <{kind}>')
+    locs = [element.text.strip() for element in root.iter()
+            if _local_name(element.tag) == 'loc' and element.text and element.text.strip()]
+    return kind, locs
+
+
+async def _fetch(url):
+    async with crawler.polite_get(url) as resp:
+        if resp.status != 200:
+            raise SitemapError(f'HTTP {resp.status} for {url}')
+        data = bytearray()
+        async for chunk in resp.content.iter_chunked(64 * 1024):
+            data += chunk
+            if len(data) > MAX_SITEMAP_BYTES:
+                raise _too_large()
+        return bytes(data)
+
+
+async def fetch_sitemap_urls(url, max_urls):
+    """Page URLs listed by the sitemap at url, in document order without duplicates, at most max_urls.
+
+    Sitemap indexes are followed up to MAX_SITEMAP_DEPTH levels; a nested sitemap
+    that fails is skipped with a message, the top-level one failing raises SitemapError.
+    """
+    urls = {}  # insertion-ordered set
+    pending = [(url, 0)]
+    seen = set()
+    while pending and len(urls) < max_urls:
+        sitemap_url, depth = pending.pop(0)
+        if sitemap_url in seen:
+            continue
+        seen.add(sitemap_url)
+        try:
+            kind, locs = parse_sitemap(await _fetch(sitemap_url))
+        except Exception as e:
+            if sitemap_url == url:
+                raise SitemapError(str(e)) from e
+            print(f"⚠️ Skipping sitemap {sitemap_url}: {e}")
+            continue
+        if kind == 'sitemapindex':
+            if depth < MAX_SITEMAP_DEPTH:
+                pending.extend((loc, depth + 1) for loc in locs)
+            continue
+        for loc in locs:
+            if urlparse(loc).scheme in ('http', 'https'):
+                urls.setdefault(loc, None)
+                if len(urls) >= max_urls:
+                    break
+    return list(urls)
@@ -1,4 +1,4 @@
-import React, { useState } from 'react';
+import React, { useEffect, useState } from 'react';
 import DownloadForm from './components/DownloadForm';
 import DownloadList from './components/DownloadList';
 import Header from './components/Header';
@@ -19,10 +19,73 @@ interface Downloads {
   [key: string]: DownloadStatus;
 }
 
+interface DownloadSummary extends Partial<DownloadStatus> {
+  id: string;
+}
+
+const API_BASE_URL = 'http://localhost:5001';
+
+const hostname = (url?: string) => {
+  try {
+    return url ? new URL(url).hostname : undefined;
+  } catch {
+    return url;
+  }
+};
+
 const App: React.FC = () => {
   const [downloads, setDownloads] = useState<Downloads>({});
   const [isLoading, setIsLoading] = useState(false);
-  const API_BASE_URL = 'http://localhost:5001';
+
+  // One event stream carries every download: a snapshot, then each change and deletion
+  useEffect(() => {
+    let source: EventSource;
+    let retryTimer: ReturnType<typeof setTimeout> | undefined;
+    let retryDelay = 1000;
+
+    const entry = (prev: DownloadStatus | undefined, summary: DownloadSummary): DownloadStatus => ({
+      ...prev,
+      ...summary,
+      domain: prev?.domain || hostname(summary.url),
+    } as DownloadStatus);
+
+    const connect = () => {
+      source = new EventSource(`${API_BASE_URL}/api/downloads/stream`);
+      source.addEventListener('snapshot', (event) => {
+        retryDelay = 1000;
+        const { downloads: summaries } = JSON.parse((event as MessageEvent).data);
+        setDownloads(prev => (summaries as DownloadSummary[]).reduce<Downloads>((next, summary) => {
+          next[summary.id] = entry(prev[summary.id], summary);
+          return next;
+        }, {}));
+      });
+      source.addEventListener('download', (event) => {
+        const summary: DownloadSummary = JSON.parse((event as MessageEvent).data);
+        setDownloads(prev => ({ ...prev, [summary.id]: entry(prev[summary.id], summary) }));
+      });
+      source.addEventListener('deleted', (event) => {
+        const { id } = JSON.parse((event as MessageEvent).data);
+        setDownloads(prev => {
+          const next = { ...prev };
+          delete next[id];
+          return next;
+        });
+      });
+      source.onerror = () => {
+        // The browser retries dropped connections itself, but gives up on failed ones
+        if (source.readyState === EventSource.CLOSED) {
+          retryTimer = setTimeout(connect, retryDelay);
+          retryDelay = Math.min(retryDelay * 2, 30000);
+        }
+      };
+    };
+
+    connect();
+    return () => {
+      clearTimeout(retryTimer);
+      source.close();
+    };
+  }, []);
 
   const handleStartDownload = async (url: string) => {
     setIsLoading(true);
@@ -36,7 +99,17 @@ const App: React.FC = () => {
       });
       const data = await response.json();
       if (response.ok) {
-        pollDownloadStatus(data.download_id, url);
+        // Shown at once; the stream fills in the rest
+        setDownloads(prev => ({
+          ...prev,
+          [data.download_id]: prev[data.download_id] || {
+            status: 'downloading',
+            progress: 0,
+            message: 'Starting download...',
+            url,
+            domain: hostname(url),
+          }
+        }));
       } else {
         alert(data.error || 'Failed to start download');
       }
@@ -47,46 +120,6 @@ const App: React.FC = () => {
     }
   };
 
-  const pollDownloadStatus = (downloadId: string, url: string) => {
-    const domain = (() => {
-      try {
-        return new URL(url).hostname;
-      } catch {
-        return url;
-      }
-    })();
-    setDownloads(prev => ({
-      ...prev,
-      [downloadId]: {
-        status: 'downloading',
-        progress: 0,
-        message: 'Starting download...',
-        url,
-        domain,
-      }
-    }));
-    const interval = setInterval(async () => {
-      try {
-        const response = await fetch(`${API_BASE_URL}/api/status/${downloadId}`);
-        const status = await response.json();
-        setDownloads(prev => ({
-          ...prev,
-          [downloadId]: {
-            ...prev[downloadId],
-            ...status,
-            domain: prev[downloadId]?.domain || (status.url ? new URL(status.url).hostname : undefined),
-            url: prev[downloadId]?.url || status.url,
-          }
-        }));
-        if (status.status === 'completed' || status.status === 'error') {
-          clearInterval(interval);
-        }
-      } catch (error) {
-        clearInterval(interval);
-      }
-    }, 1000);
-  };
-
   const handleViewDownload = (downloadId: string) => {
     window.open(`${API_BASE_URL}/api/files/${downloadId}`, '_blank');
   };
@@ -6,7 +6,13 @@ echo "🚀 Starting Website Downloader..."
 
 # Check if Python is installed
 if ! command -v python3 &> /dev/null; then
-    echo "❌ Python 3 is not installed. Please install Python 3.7 or higher."
+    echo "❌ Python 3 is not installed. Please install Python 3.9 or higher."
+    exit 1
+fi
+
+# The ASGI server (asgi.py) needs Python 3.9
+if ! python3 -c 'import sys; sys.exit(sys.version_info < (3, 9))'; then
+    echo "❌ Python $(python3 -c 'import platform; print(platform.python_version())') is too old. Please install Python 3.9 or higher."
     exit 1
 fi
 
@@ -28,8 +34,8 @@ pip3 install -r requirements.txt
 echo "📦 Installing Node.js dependencies..."
 npm install
 
-echo "🔧 Starting Flask backend..."
-python3 app.py &
+echo "🔧 Starting backend..."
+python3 asgi.py &
 BACKEND_PID=$!
 
 echo "⏳ Waiting for backend to start..."
@@ -0,0 +1,19 @@
+import os
+import sys
+
+import pytest
+
+# The modules are flat at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def app(tmp_path_factory):
+    """The API module, imported with a scratch working directory for the downloads it writes"""
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp('app'))
+    try:
+        import app
+        yield app
+    finally:
+        os.chdir(cwd)
@@ -0,0 +1,57 @@
+"""
+The archive cache shared by several server processes: an archive one built is served by the
+others, and a starting process leaves builds still in progress alone
+"""
+
+import io
+import os
+import time
+import zipfile
+
+import archives
+from archives import ArchiveCache
+
+
+def site(tmp_path):
+    root = tmp_path / 'site'
+    (root / 'img').mkdir(parents=True)
+    (root / 'index.html').write_text('<html><body>' + 'hello ' * 500 + '</body></html>')
+    (root / 'img' / 'logo.png').write_bytes(b'\x89PNG' + bytes(range(256)) * 8)
+    return archives.walk_entries(str(root))
+
+
+def test_archive_built_by_another_process_is_found(tmp_path):
+    first = ArchiveCache(str(tmp_path / 'cache'), 1 << 20)
+    second = ArchiveCache(str(tmp_path / 'cache'), 1 << 20)
+    assert second.get('a', 'full') is None
+    first.build('a', 'full', archives.iter_zip(site(tmp_path)))
+    path = second.get('a', 'full')
+    assert path == first.get('a', 'full')
+    with zipfile.ZipFile(path) as zipf:
+        assert sorted(zipf.namelist()) == ['img/logo.png', 'index.html']
+        assert zipf.getinfo('img/logo.png').compress_type == zipfile.ZIP_STORED
+    assert second.stats()['archives'] == 1 and second.stats()['bytes'] == os.path.getsize(path)
+
+    first.invalidate('a')
+    assert second.get('a', 'full') is None and second.stats()['bytes'] == 0
+
+
+def test_starting_leaves_other_builds_alone(tmp_path):
+    cache = ArchiveCache(str(tmp_path / 'cache'), 1 << 20)
+    chunks = cache.stream_and_store('a', 'full', archives.iter_zip(site(tmp_path)))
+    received = [next(chunks)]  # the build is in progress, its .part file open
+    abandoned = os.path.join(cache.cache_dir, 'b-full.zip.1.part')
+    with open(abandoned, 'wb') as f:
+        f.write(b'PK')
+    old = time.time() - archives.PART_MAX_AGE - 60
+    os.utime(abandoned, (old, old))
+
+    ArchiveCache(str(tmp_path / 'cache'), 1 << 20)  # another server process starts
+    assert not os.path.exists(abandoned)
+    received.extend(chunks)
+    path = cache.get('a', 'full')
+    with open(path, 'rb') as f:
+        assert f.read() == b''.join(received)
+    with zipfile.ZipFile(io.BytesIO(b''.join(received))) as zipf:
+        assert zipf.testzip() is None
+    assert [name for name in os.listdir(cache.cache_dir) if name.endswith('.part')] == []
@@ -0,0 +1,115 @@
+"""
+File delivery on the ASGI path: byte ranges, conditional requests and precompressed variants
+"""
+
+import asyncio
+import gzip
+import time
+
+import pytest
+
+import benchmark
+
+
+@pytest.fixture(scope='module')
+def asgi(app):
+    """Imported after app, so the job store and downloads live in the scratch directory"""
+    import asgi
+    return asgi
+
+
+def test_byte_range(asgi):
+    assert asgi._byte_range('bytes=0-99', 1000) == (0, 99)
+    assert asgi._byte_range('bytes=900-', 1000) == (900, 999)
+    assert asgi._byte_range('bytes=990-2000', 1000) == (990, 999)  # clamped to the file
+    assert asgi._byte_range('bytes=-100', 1000) == (900, 999)  # the last 100 bytes
+    assert asgi._byte_range('bytes=-5000', 1000) == (0, 999)
+    assert asgi._byte_range('bytes=-0', 1000) is False
+    assert asgi._byte_range('bytes=1000-', 1000) is False  # starts past the end
+    assert asgi._byte_range('bytes=500-100', 1000) is False
+    assert asgi._byte_range('bytes=0-1,5-9', 1000) is None  # several ranges: send it all
+    assert asgi._byte_range('items=0-1', 1000) is None
+
+
+def get(asgi, path, headers=()):
+    """(status, {header: value}, body) of a GET through the ASGI application"""
+    messages = []
+    scope = {'type': 'http', 'method': 'GET', 'path': path, 'query_string': b'',
+             'headers': [(name.lower().encode(), value.encode()) for name, value in headers]}
+
+    async def run():
+        requested = []
+
+        async def receive():
+            if not requested:
+                requested.append(True)
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            await asyncio.Event().wait()  # the client stays connected
+
+        async def send(message):
+            messages.append(message)
+
+        await asgi.application(scope, receive, send)
+
+    asyncio.run(run())
+    start = messages[0]
+    response_headers = {name.decode(): value.decode() for name, value in start['headers']}
+    return start['status'], response_headers, b''.join(m.get('body', b'') for m in messages[1:])
+
+
+@pytest.fixture(scope='module')
+def page(app, asgi):
+    """(download id, body) of a mirrored page large enough to have a gzip variant"""
+    site = benchmark.SyntheticSite(pages=2, images=1, image_kb=1)
+    server = site.serve()
+    url = f'http://127.0.0.1:{server.server_address[1]}/'
+    response = app.app.test_client().post('/api/download', json={'url': url, 'engine': 'async', 'depth': 0})
+    download_id = response.get_json()['download_id']
+    deadline = time.time() + 60
+    while app.job_store.get(download_id)['status'] not in app.TERMINAL_STATUSES:
+        assert time.time() < deadline, 'download did not finish'
+        time.sleep(0.2)
+    server.shutdown()
+    assert app.job_store.get(download_id)['status'] == 'completed'
+    status, headers, body = get(asgi, f'/api/files/{download_id}/index.html')
+    assert status == 200 and 'Content-Encoding' not in {name.title() for name in headers}
+    yield download_id, body
+    app.delete_download(download_id)  # the session's other tests share the job store
+
+
+def test_suffix_range(asgi, page):
+    download_id, body = page
+    status, headers, partial = get(asgi, f'/api/files/{download_id}/index.html', [('Range', 'bytes=-10')])
+    assert status == 206
+    assert headers['content-range'] == f'bytes {len(body) - 10}-{len(body) - 1}/{len(body)}'
+    assert partial == body[-10:]
+
+
+def test_range_past_the_end(asgi, page):
+    download_id, body = page
+    status, headers, _ = get(asgi, f'/api/files/{download_id}/index.html', [('Range', f'bytes={len(body)}-')])
+    assert status == 416
+    assert headers['content-range'] == f'bytes */{len(body)}'
+
+
+def test_if_none_match(asgi, page):
+    download_id, _ = page
+    _, headers, _ = get(asgi, f'/api/files/{download_id}/index.html')
+    etag = headers['etag']
+    assert get(asgi, f'/api/files/{download_id}/index.html', [('If-None-Match', etag)])[0] == 304
+    assert get(asgi, f'/api/files/{download_id}/index.html', [('If-None-Match', f'"other", W/{etag}')])[0] == 304
+    assert get(asgi, f'/api/files/{download_id}/index.html', [('If-None-Match', '"other"')])[0] == 200
+
+
+def test_precompressed_variant(asgi, page):
+    download_id, body = page
+    plain_etag = get(asgi, f'/api/files/{download_id}/index.html')[1]['etag']
+    status, headers, compressed = get(asgi, f'/api/files/{download_id}/index.html', [('Accept-Encoding', 'gzip')])
+    assert status == 200
+    assert headers['content-encoding'] == 'gzip'
+    assert headers['vary'] == 'Accept-Encoding'
+    assert headers['etag'] != plain_etag  # each representation has its own ETag
+    assert len(compressed) < len(body)
+    assert gzip.decompress(compressed) == body
+    refused = get(asgi, f'/api/files/{download_id}/index.html', [('Accept-Encoding', 'gzip;q=0')])
+    assert 'content-encoding' not in refused[1]
@@ -0,0 +1,95 @@
+"""
+The browser pool's size limit, against stand-in browsers (no Chromium needed): browsers that
+are worn out but still serving pages count until they are retired
+"""
+
+import asyncio
+import types
+
+from browser_pool import BrowserPool
+
+
+class FakeContext:
+    def __init__(self):
+        self.pages = []
+
+    async def new_page(self):
+        page = types.SimpleNamespace(close=self.close)
+        self.pages.append(page)
+        return page
+
+    async def clear_cookies(self):
+        pass
+
+    async def close(self):
+        pass
+
+
+class FakeBrowser:
+    def __init__(self, launched):
+        self.connected = True
+        launched.append(self)
+
+    def is_connected(self):
+        return self.connected
+
+    async def new_context(self):
+        return FakeContext()
+
+    async def close(self):
+        self.connected = False
+
+
+def fake_pool(size, max_pages):
+    pool = BrowserPool(size=size, max_pages=max_pages, max_concurrency=10)
+    launched = []
+
+    async def launch():
+        return FakeBrowser(launched)
+
+    pool._playwright = types.SimpleNamespace(chromium=types.SimpleNamespace(launch=launch))
+    return pool, launched
+
+
+def test_worn_out_browsers_in_use_count_against_the_size():
+    pool, launched = fake_pool(size=2, max_pages=1)
+    most = []
+
+    async def visit(done):
+        async with pool.page():
+            most.append(len(pool._browsers))
+            await done.wait()
+
+    async def main():
+        done = asyncio.Event()
+        tasks = [asyncio.ensure_future(visit(done)) for _ in range(5)]
+        for _ in range(20):
+            await asyncio.sleep(0)
+        open_pages = pool.stats()['pages_open']
+        done.set()
+        await asyncio.gather(*tasks)
+        return open_pages
+
+    # Each browser is worn out after its first page, yet five pages still share two browsers
+    assert asyncio.run(main()) == 5
+    assert len(launched) == 2 and max(most) == 2
+    assert pool._browsers == []  # retired once their last page closed
+
+    async def again():
+        async with pool.page():
+            return len(pool._browsers)
+
+    assert asyncio.run(again()) == 1
+    assert len(launched) == 3
+
+
+def test_idle_browsers_are_reused():
+    pool, launched = fake_pool(size=2, max_pages=100)
+
+    async def visits():
+        for _ in range(5):
+            async with pool.page():
+                pass
+
+    asyncio.run(visits())
+    assert len(launched) == 1 and pool.stats()['browsers'] == 1
@@ -0,0 +1,46 @@
+"""
+Cancelling a running download: a cancel that arrives during any phase after the crawl ends the
+job as cancelled instead of completed
+"""
+
+import os
+import threading
+import time
+
+import pytest
+
+import benchmark
+
+
+@pytest.fixture(scope='module')
+def site_url():
+    server = benchmark.SyntheticSite(pages=2, images=1, image_kb=1, seed=3).serve()
+    yield f'http://127.0.0.1:{server.server_address[1]}/'
+    server.shutdown()
+
+
+@pytest.mark.parametrize('phase', ['rewrite', 'dedup', 'manifest'])
+def test_cancel_during_a_phase(app, site_url, monkeypatch, phase):
+    owner, name = {
+        'rewrite': (app.rewriter, 'rewrite_mirror'),
+        'dedup': (app.blob_store, 'ingest'),
+        'manifest': (app.file_manifests, 'build'),
+    }[phase]
+    run = getattr(owner, name)
+    cancel_event = threading.Event()
+
+    def cancelled_meanwhile(*args, **kwargs):
+        cancel_event.set()
+        return run(*args, **kwargs)
+
+    monkeypatch.setattr(owner, name, cancelled_meanwhile)
+    download_id = f'cancel-during-{phase}'
+    app.job_store.create(download_id, {'status': 'queued', 'created': time.time(), 'url': site_url})
+    app.download_site_worker(site_url, download_id, os.path.join(app.DOWNLOAD_DIR, download_id),
+                             engine='async', options={'depth': 0}, cancel_event=cancel_event)
+    status = app.job_store.get(download_id)
+    try:
+        assert status['status'] == 'cancelled'
+        assert list(status['phases'])[-1] == phase  # nothing ran after it
+    finally:
+        app.delete_download(download_id)
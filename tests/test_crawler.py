@@ -0,0 +1,186 @@
+"""
+The async crawler that replaces wget: link extraction, --convert-links style rewriting, depth
+limits and the wget fallback, against a small site served on localhost
+"""
+
+import http.server
+import os
+import shutil
+import subprocess
+import threading
+
+import pytest
+
+import crawler
+
+PNG = b'\x89PNG\r\n\x1a\n' + b'\0' * 64
+
+SITE = {
+    '/': ('text/html', '<!DOCTYPE html><html><head><title>Home</title>'
+                       '<link rel="stylesheet" href="/css/site.css"></head><body>'
+                       '<a href="/docs/a.html#top">docs</a>'
+                       '<a href="/deep/1.html">deep</a>'
+                       '<a href="https://elsewhere.example/page">elsewhere</a>'
+                       '<img src="/img/logo.png" srcset="/img/logo.png 1x, /img/logo@2x.png 2x" alt="logo">'
+                       '<div style="background: url(/img/hero.png)"></div>'
+                       '</body></html>'),
+    '/css/site.css': ('text/css', 'body { background: url("../img/bg.png") }\n@import "print.css";\n'),
+    '/css/print.css': ('text/css', 'body { color: black }\n'),
+    '/docs/a.html': ('text/html', '<html><body><h1 id="top">A</h1><a href="../">home</a></body></html>'),
+    '/deep/1.html': ('text/html', '<html><body><a href="2.html">next</a></body></html>'),
+    '/deep/2.html': ('text/html', '<html><body><a href="3.html">next</a></body></html>'),
+    '/deep/3.html': ('text/html', '<html><body>bottom</body></html>'),
+    '/img/logo.png': ('image/png', PNG),
+    '/img/logo@2x.png': ('image/png', PNG),
+    '/img/hero.png': ('image/png', PNG),
+    '/img/bg.png': ('image/png', PNG),
+}
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        if path not in SITE:
+            self.send_error(404)
+            return
+        content_type, body = SITE[path]
+        body = body.encode() if isinstance(body, str) else body
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope='module')
+def site_url():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_address[1]}/'
+    server.shutdown()
+
+
+def mirror(site_url, output_dir, max_depth):
+    stats, errors, _ = crawler.crawl_site(site_url, str(output_dir), max_depth=max_depth, timeout=60)
+    assert errors == []
+    return stats
+
+
+def mirrored_files(output_dir):
+    return {os.path.relpath(os.path.join(dirpath, name), output_dir).replace(os.sep, '/')
+            for dirpath, _, names in os.walk(output_dir) for name in names}
+
+
+def read(output_dir, path):
+    with open(os.path.join(output_dir, path), encoding='utf-8') as f:
+        return f.read()
+
+
+def test_scan_html_finds_pages_and_requisites():
+    links, _ = crawler.scan_html(SITE['/'][1])
+    assert ('/docs/a.html#top', 'page') in links
+    assert ('https://elsewhere.example/page', 'page') in links
+    assert ('/css/site.css', 'requisite') in links  # a stylesheet <link> is a requisite, not a page
+    assert ('/img/logo.png', 'requisite') in links
+    assert ('/img/logo@2x.png', 'requisite') in links  # from srcset
+    assert ('/img/hero.png', 'requisite') in links  # from an inline style
+
+
+def test_scan_html_rewrites_in_the_same_pass():
+    html = '<a href="/x.html">x</a><img srcset="/a.png 1x, /b.png 2x"><p>/x.html stays</p>'
+    _, new = crawler.scan_html(html, lambda value, kind: 'local' + value)
+    assert new == '<a href="local/x.html">x</a><img srcset="local/a.png 1x, local/b.png 2x"><p>/x.html stays</p>'
+
+
+def test_scan_css_finds_urls_and_imports():
+    links, new = crawler.scan_css(SITE['/css/site.css'][1], lambda value, kind: value.upper())
+    assert links == [('../img/bg.png', 'requisite'), ('print.css', 'requisite')]
+    assert 'url("../IMG/BG.PNG")' in new
+    assert '@import "PRINT.CSS"' in new
+
+
+def test_url_to_local_path_follows_wget_layout():
+    assert crawler.url_to_local_path('http://example.com/') == os.path.join('example.com', 'index.html')
+    assert crawler.url_to_local_path('http://Example.com:8080/a/b') == os.path.join('example.com+8080', 'a', 'b')
+    assert (crawler.url_to_local_path('http://example.com/list?page=2', 'text/html')
+            == os.path.join('example.com', 'list@page=2.html'))
+    assert crawler.url_to_local_path('http://example.com/style', 'text/css') == os.path.join('example.com', 'style.css')
+
+
+def test_crawl_converts_links_to_local_copies(site_url, tmp_path):
+    mirror(site_url, tmp_path, max_depth=1)
+    host = crawler.url_to_local_path(site_url).split(os.sep)[0]
+    index = read(tmp_path, f'{host}/index.html')
+    assert 'href="docs/a.html#top"' in index
+    assert 'href="css/site.css"' in index
+    assert 'srcset="img/logo.png 1x, img/logo@2x.png 2x"' in index
+    assert 'url(img/hero.png)' in index
+    assert 'href="https://elsewhere.example/page"' in index  # off-site links are left alone
+    assert 'href="../index.html"' in read(tmp_path, f'{host}/docs/a.html')
+
+    css = read(tmp_path, f'{host}/css/site.css')
+    assert 'url("../img/bg.png")' in css
+    assert '@import "print.css"' in css
+    for path in ('css/print.css', 'img/logo.png', 'img/logo@2x.png', 'img/hero.png', 'img/bg.png'):
+        assert f'{host}/{path}' in mirrored_files(tmp_path)
+
+
+def test_depth_limits_which_pages_are_followed(site_url, tmp_path):
+    host = crawler.url_to_local_path(site_url).split(os.sep)[0]
+    mirror(site_url, tmp_path / 'zero', max_depth=0)
+    files = mirrored_files(tmp_path / 'zero')
+    assert f'{host}/index.html' in files
+    assert f'{host}/img/logo.png' in files  # requisites of the start page are always fetched
+    assert f'{host}/docs/a.html' not in files
+
+    mirror(site_url, tmp_path / 'two', max_depth=2)
+    files = mirrored_files(tmp_path / 'two')
+    assert {f'{host}/deep/1.html', f'{host}/deep/2.html'} <= files
+    assert f'{host}/deep/3.html' not in files
+    # Like wget, links to pages past the limit point at the live site
+    assert f'href="{site_url}deep/3.html"' in read(tmp_path / 'two', f'{host}/deep/2.html')
+
+    mirror(site_url, tmp_path / 'all', max_depth=None)
+    assert f'{host}/deep/3.html' in mirrored_files(tmp_path / 'all')
+
+
+def test_wget_command_depth(app):
+    def command(max_depth):
+        return app.build_wget_command('http://example.com/', 'out', crawler.CrawlScope(max_depth=max_depth))
+
+    assert '-r' not in command(0)  # wget reads -l 0 as unlimited
+    assert command(2)[command(2).index('-l') + 1] == '2'
+    assert command(None)[command(None).index('-l') + 1] == 'inf'
+    assert {'-k', '-p', '--restrict-file-names=windows', '--html-extension'} <= set(command(1))
+
+
+@pytest.mark.skipif(shutil.which('wget') is None, reason='wget is not installed')
+def test_wget_fallback_mirrors_the_same_layout(app, site_url, tmp_path):
+    scope = crawler.CrawlScope(max_depth=2)
+    subprocess.run(app.build_wget_command(site_url, str(tmp_path / 'wget'), scope),
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=120)
+    crawler.crawl_site(site_url, str(tmp_path / 'async'), scope=scope, timeout=60)
+    host = crawler.url_to_local_path(site_url).split(os.sep)[0]
+    assert f'{host}/deep/2.html' in mirrored_files(tmp_path / 'wget')
+    assert mirrored_files(tmp_path / 'async') == mirrored_files(tmp_path / 'wget')
+
+
+def test_wget_engine_needs_wget(app, monkeypatch):
+    monkeypatch.setattr(app, 'check_wget_installed', lambda: (False, 'wget is not installed'))
+    response = app.app.test_client().post('/api/download', json={'url': 'http://example.com/', 'engine': 'wget'})
+    assert response.status_code == 500
+    assert response.get_json()['message'] == 'wget is not installed'
+
+
+def test_render_needs_the_async_engine(app, monkeypatch):
+    monkeypatch.setattr(app, 'check_wget_installed', lambda: (True, None))
+    response = app.app.test_client().post('/api/download', json={
+        'url': 'http://example.com/', 'engine': 'wget', 'render': True
+    })
+    assert response.status_code == 400
@@ -0,0 +1,82 @@
+"""
+/api/download-in-memory streams a mirror as it is crawled: a large site must not end up in the
+server's memory, and its scratch directory must be gone once the stream ends
+"""
+
+import io
+import json
+import os
+import sys
+import time
+import urllib.request
+import zipfile
+
+import pytest
+
+import benchmark
+
+PAGES = 40
+IMAGES = 400
+IMAGE_KB = 128  # about 50 MB of mostly incompressible images
+MAX_RSS_GROWTH = 0.25  # of the site's size
+
+
+def rss(pid, field='VmRSS'):
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1]) * 1024
+
+
+def scratch_dirs(temp_dir):
+    return [name for name in os.listdir(temp_dir) if name.startswith('mirror-')]
+
+
+@pytest.fixture
+def site():
+    site = benchmark.SyntheticSite(pages=PAGES, images=IMAGES, image_kb=IMAGE_KB, fanout=3, lazy=0)
+    server = site.serve()
+    yield site, f'http://127.0.0.1:{server.server_address[1]}/'
+    server.shutdown()
+
+
+@pytest.fixture
+def api(tmp_path):
+    temp_dir = tmp_path / 'tmp'
+    temp_dir.mkdir()
+    process, url = benchmark.start_api(str(tmp_path), benchmark.free_port(), {'TMPDIR': str(temp_dir)})
+    yield process, url, str(temp_dir)
+    process.terminate()
+    process.wait(timeout=30)
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason='reads RSS from /proc')
+def test_large_mirror_streams_in_bounded_memory(site, api):
+    site, site_url = site
+    process, url, temp_dir = api
+    before = rss(process.pid)
+    request = urllib.request.Request(f'{url}/api/download-in-memory',
+                                     data=json.dumps({'url': site_url, 'depth': None}).encode(),
+                                     headers={'Content-Type': 'application/json'})
+    archive = io.BytesIO()
+    with urllib.request.urlopen(request, timeout=600) as response:
+        assert response.headers['Content-Type'] == 'application/zip'
+        while True:
+            chunk = response.read(64 * 1024)
+            if not chunk:
+                break
+            archive.write(chunk)
+
+    with zipfile.ZipFile(archive) as zf:
+        images = [name for name in zf.namelist() if name.endswith('.png')]
+    assert len(images) == IMAGES + 1  # plus the stylesheet's background
+    assert archive.tell() > site.total_bytes() * 0.9
+
+    growth = rss(process.pid, 'VmHWM') - before
+    assert growth < site.total_bytes() * MAX_RSS_GROWTH, f'server RSS grew by {growth // 1024 ** 2} MB'
+
+    # The scratch directory is removed once the response is closed
+    deadline = time.time() + 10
+    while scratch_dirs(temp_dir) and time.time() < deadline:
+        time.sleep(0.2)
+    assert scratch_dirs(temp_dir) == []
@@ -0,0 +1,82 @@
+"""
+The shared HTTP cache: how long a response stays fresh, lookups and 304 revalidation,
+and one size limit for every server process that shares the directory
+"""
+
+import os
+import time
+from email.utils import formatdate
+
+import pytest
+
+import httpcache
+from httpcache import HTTPCache, freshness
+
+TTL = 3600
+
+
+def test_cache_control_decides_first():
+    assert freshness({'Cache-Control': 'max-age=60'}, TTL) == 60
+    assert freshness({'Cache-Control': 'public, s-maxage=30, max-age=60'}, TTL) == 30
+    assert freshness({'Cache-Control': 'max-age=60', 'Expires': formatdate(time.time() + 600)}, TTL) == 60
+    assert freshness({'Cache-Control': 'no-cache'}, TTL) == 0
+    assert freshness({'Cache-Control': 'no-store, max-age=60'}, TTL) is None
+    assert freshness({'Cache-Control': 'private'}, TTL) is None
+    assert freshness({'Vary': '*'}, TTL) is None
+
+
+def test_expires_counts_from_the_origins_date():
+    now = time.time()
+    assert freshness({'Expires': formatdate(now + 600)}, TTL) == pytest.approx(600, abs=5)
+    # The origin's clock is an hour behind ours: its Expires still means ten minutes from now
+    assert freshness({'Expires': formatdate(now - 3000), 'Date': formatdate(now - 3600)}, TTL) == pytest.approx(600, abs=1)
+    assert freshness({'Expires': formatdate(now - 60)}, TTL) == 0
+    assert freshness({'Expires': '0'}, TTL) == 0  # invalid dates mean already expired
+    assert freshness({'Expires': formatdate(now + 600), 'Date': 'yesterday'}, TTL) == pytest.approx(600, abs=5)
+
+
+def test_default_ttl_when_the_response_says_nothing():
+    assert freshness({}, TTL) == TTL
+    assert freshness({'Last-Modified': formatdate(time.time() - 86400)}, 5) == 5
+
+
+def test_lookup_and_304_refresh(tmp_path):
+    cache = HTTPCache(str(tmp_path), 1 << 20, TTL)
+    url = 'http://example.com/a.css'
+    assert cache.lookup(url) is None
+    assert cache.store(url, url, {'Content-Type': 'text/css; charset=utf-8', 'ETag': '"v1"',
+                                  'Cache-Control': 'no-cache'}, body=b'body { }')
+    assert not cache.store('http://example.com/secret', url, {'Cache-Control': 'no-store'}, body=b'x')
+
+    entry = cache.lookup(url)
+    assert entry['fresh'] is False and entry['content_type'] == 'text/css'
+    with open(entry['path'], 'rb') as f:
+        assert f.read() == b'body { }'
+    assert cache.validators(entry) == {'If-None-Match': '"v1"'}
+
+    cache.refresh(url, {'ETag': '"v2"', 'Cache-Control': 'max-age=60'})
+    entry = cache.lookup(url)
+    assert entry['fresh'] is True and entry['etag'] == '"v2"'
+    assert cache.stats()['revalidated'] == 1
+    # The refreshed metadata is on disk for the next process
+    assert HTTPCache(str(tmp_path), 1 << 20, TTL).lookup(url)['etag'] == '"v2"'
+
+    cache.store(url, url, {'Cache-Control': 'max-age=0'}, body=b'body { color: red }')
+    assert cache.lookup(url)['fresh'] is False
+    assert cache.stats()['bytes'] == len(b'body { color: red }')
+
+
+def test_processes_share_entries_and_one_size_limit(tmp_path, monkeypatch):
+    monkeypatch.setattr(httpcache, 'RESCAN_INTERVAL', 0)
+    first, second = HTTPCache(str(tmp_path), 8000, TTL), HTTPCache(str(tmp_path), 8000, TTL)
+    first.store('http://example.com/shared', 'http://example.com/shared', {}, body=b'x' * 100)
+    assert second.lookup('http://example.com/shared')['fresh'] is True  # stored by the other process
+
+    for n in range(10):
+        for cache in (first, second):
+            cache.store(f'http://example.com/{id(cache)}/{n}', 'http://example.com/', {}, body=b'x' * 900)
+        first.lookup('http://example.com/shared')  # the most recently used entry in either process
+    on_disk = sum(os.path.getsize(os.path.join(dirpath, name)) for dirpath, _, names in os.walk(tmp_path)
+                  for name in names if not name.endswith('.json'))
+    assert on_disk <= 8000
+    assert second.lookup('http://example.com/shared') is not None
@@ -0,0 +1,66 @@
+"""
+Capturing the images a page loads, against a stand-in browser page: every response handler
+has finished before the page is closed, including ones for images that arrive late
+"""
+
+import asyncio
+import os
+import types
+from contextlib import asynccontextmanager
+
+
+class FakeResponse:
+    def __init__(self, page, url, then=None):
+        self.page = page
+        self.url = url
+        self.ok = True
+        self.request = types.SimpleNamespace(resource_type='image')
+        self.then = then  # another image that arrives while this one is being read
+
+    async def body(self):
+        await asyncio.sleep(0.01)
+        if self.then:
+            self.page.emit(self.then)
+        await asyncio.sleep(0.01)
+        return self.url.encode()
+
+
+class FakePage:
+    def __init__(self):
+        self.handlers = []
+        self.closed = False
+
+    def on(self, event, handler):
+        self.handlers.append(handler)
+
+    def remove_listener(self, event, handler):
+        self.handlers.remove(handler)
+
+    def emit(self, response):
+        for handler in list(self.handlers):
+            handler(response)
+
+    async def goto(self, url):
+        late = FakeResponse(self, f'{url}late.png')
+        self.emit(FakeResponse(self, f'{url}first.png', then=late))
+
+    async def eval_on_selector_all(self, selector, script):
+        return []
+
+
+def test_late_image_responses_are_saved_before_the_page_closes(app, monkeypatch, tmp_path):
+    page = FakePage()
+
+    @asynccontextmanager
+    async def borrow():
+        yield page
+        page.closed = True
+
+    monkeypatch.setattr(app.browser_pool, 'pool', types.SimpleNamespace(page=borrow))
+    url = 'http://images.example/'
+    _, captured = asyncio.run(app.collect_page_images(url, capture_dir=str(tmp_path)))
+    assert sorted(captured) == [f'{url}first.png', f'{url}late.png']
+    for response_url, filename in captured.items():
+        with open(os.path.join(tmp_path, filename), 'rb') as f:
+            assert f.read() == response_url.encode()
+    assert page.handlers == []
@@ -0,0 +1,82 @@
+"""
+The janitor's download quota, with the HTTP cache and the blob store both on: it counts only what
+deleting downloads can reclaim, and never deletes a download that would free nothing
+"""
+
+import os
+import time
+
+import pytest
+
+import benchmark
+
+
+@pytest.fixture(scope='module')
+def site_urls():
+    servers = [benchmark.SyntheticSite(pages=4, images=6, image_kb=16, seed=seed).serve() for seed in (1, 2)]
+    yield [f'http://127.0.0.1:{server.server_address[1]}/' for server in servers]
+    for server in servers:
+        server.shutdown()
+
+
+def mirror(app, url):
+    response = app.app.test_client().post('/api/download', json={'url': url, 'engine': 'async', 'depth': 2})
+    download_id = response.get_json()['download_id']
+    deadline = time.time() + 120
+    while app.job_store.get(download_id)['status'] not in app.TERMINAL_STATUSES:
+        assert time.time() < deadline, 'download did not finish'
+        time.sleep(0.2)
+    assert app.job_store.get(download_id)['status'] == 'completed'
+    return download_id
+
+
+def hardlinked_copy(app, download_id):
+    """A finished download whose files are all hardlinks of another's, so deleting it frees nothing"""
+    source = app.job_store.get(download_id)['output_dir']
+    copy_id = f'{download_id}-copy'
+    output_dir = os.path.join(app.DOWNLOAD_DIR, copy_id)
+    for dirpath, _, names in os.walk(source):
+        target_dir = os.path.join(output_dir, os.path.relpath(dirpath, source))
+        os.makedirs(target_dir, exist_ok=True)
+        for name in names:
+            os.link(os.path.join(dirpath, name), os.path.join(target_dir, name))
+    app.job_store.create(copy_id, {'status': 'completed', 'created': time.time(), 'output_dir': output_dir})
+    return copy_id
+
+
+def held_bytes(app, download_ids):
+    files = {}
+    for download_id in download_ids:
+        files.update(app.held_files(download_id, app.job_store.get(download_id)['output_dir']))
+    return sum(files.values())
+
+
+def test_quota_only_counts_and_deletes_what_it_can_reclaim(app, site_urls, monkeypatch):
+    assert app.http_cache is not None and app.blob_store is not None
+    first, second, other = mirror(app, site_urls[0]), mirror(app, site_urls[0]), mirror(app, site_urls[1])
+    copy = hardlinked_copy(app, second)
+    for order, download_id in enumerate((copy, first, second, other)):
+        app.job_store.update(download_id, {'last_access': order + 1})  # copy is the least recently served
+    cached = len(app.http_cache._entries)
+    assert cached
+
+    total = held_bytes(app, (first, second, other, copy))
+    # The HTTP cache, blobs, variants and job store are on disk too, but deleting downloads keeps them
+    assert total < app.tree_bytes(app.DOWNLOAD_DIR)
+
+    monkeypatch.setattr(app, 'DOWNLOAD_QUOTA_BYTES', total - 1)
+    deleted, freed = app.run_janitor()
+    # The copy frees nothing while the download it links to stays; the next one frees its crawl state
+    assert deleted == 1 and freed > 0
+    assert app.job_store.get(copy) is not None
+    assert app.job_store.get(first) is None
+    assert app.janitor_stats['tracked_bytes'] == held_bytes(app, (second, other, copy)) <= total - 1
+
+    # Below what the cache alone takes, downloads still go only as far as deleting them frees space
+    monkeypatch.setattr(app, 'DOWNLOAD_QUOTA_BYTES', 1)
+    app.run_janitor()
+    assert app.job_store.get(copy) is not None  # still shares every file with second until that is gone
+    app.run_janitor()
+    assert [app.job_store.get(i) for i in (second, other, copy)] == [None, None, None]
+    assert app.janitor_stats['tracked_bytes'] == 0
+    assert len(app.http_cache._entries) == cached
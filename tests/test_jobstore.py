@@ -0,0 +1,136 @@
+"""
+Both job stores: records, conditional updates, the change feed and its sequence numbers,
+and telling whether the server process that owns a job still runs
+"""
+
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from jobstore import MemoryJobStore, SQLiteJobStore
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryJobStore()
+    return SQLiteJobStore(str(tmp_path / 'jobs.sqlite3'))
+
+
+def test_delete_is_a_change(store):
+    store.create('a', {'status': 'completed'})
+    store.create('b', {'status': 'completed'})
+    since = store.last_seq()
+    assert store.delete('a')
+    assert store.last_seq() > since
+    assert store.changes(since) == [{'id': 'a', 'seq': store.last_seq(), 'status': 'deleted'}]
+    assert store.changes(since, 'a') == store.changes(since)
+    assert store.changes(since, 'b') == []
+    assert store.get('a') is None
+    assert store.delete('a') is False
+
+
+def test_recreating_a_job_drops_its_deletion(store):
+    store.create('a', {'status': 'completed'})
+    store.delete('a')
+    since = store.last_seq()
+    store.create('a', {'status': 'queued'})
+    assert [change['status'] for change in store.changes(0, 'a')] == ['queued']
+    assert store.changes(since)[0]['seq'] > since
+
+
+def test_expect_lets_exactly_one_writer_claim_a_job(store, tmp_path):
+    if isinstance(store, SQLiteJobStore):
+        # A second connection to the same file stands in for another server process
+        stores = [store, SQLiteJobStore(store.path)]
+    else:
+        stores = [store]
+    store.create('a', {'status': 'queued'})
+    barrier = threading.Barrier(8)
+    claimed = []
+
+    def claim(n):
+        barrier.wait()
+        if stores[n % len(stores)].update('a', {'status': 'starting', 'worker': n}, expect=('queued',)):
+            claimed.append(n)
+
+    threads = [threading.Thread(target=claim, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(claimed) == 1
+    assert store.get('a')['worker'] == claimed[0]
+    assert store.update('a', {'status': 'completed'}, expect=('queued',)) is False
+    assert store.get('a')['status'] == 'starting'
+
+
+def test_every_write_gets_a_higher_seq(store):
+    seqs = [store.last_seq()]
+    store.create('a', {'status': 'queued'})
+    seqs.append(store.last_seq())
+    store.create('b', {'status': 'queued'})
+    seqs.append(store.last_seq())
+    store.update('a', {'status': 'completed'})
+    seqs.append(store.last_seq())
+    store.delete('b')
+    seqs.append(store.last_seq())
+    store.create('c', {'status': 'queued'})  # not the number the deleted b last had
+    seqs.append(store.last_seq())
+    assert seqs == sorted(set(seqs))
+    assert store.update('missing', {'status': 'failed'}) is False
+    assert store.create('a', {'status': 'queued'}) is False
+    assert store.last_seq() == seqs[-1]  # failed writes are not changes
+    assert [change['seq'] for change in store.changes(0)] == sorted(change['seq'] for change in store.changes(0))
+
+
+def test_wait_returns_on_a_change_or_the_timeout(store):
+    since = store.last_seq()
+    started = time.monotonic()
+    assert store.wait(since, 0.2) == since
+    assert time.monotonic() - started >= 0.2
+
+    timer = threading.Timer(0.1, store.create, ('a', {'status': 'queued'}))
+    timer.start()
+    started = time.monotonic()
+    assert store.wait(since, 10) > since
+    assert time.monotonic() - started < 5
+    timer.join()
+    assert store.wait(since, 10) == store.last_seq()  # an earlier change returns at once
+
+
+def test_wait_sees_writes_from_another_process(tmp_path):
+    store = SQLiteJobStore(str(tmp_path / 'jobs.sqlite3'))
+    since = store.last_seq()
+    other = SQLiteJobStore(store.path)  # its writes do not notify store's waiters, so they are polled
+    timer = threading.Timer(0.1, other.create, ('a', {'status': 'queued'}))
+    timer.start()
+    assert store.wait(since, 10) > since
+    timer.join()
+
+
+def test_owner_alive(app):
+    host = socket.gethostname()
+    assert app.owner_alive(app.worker_id()) is True
+    # Our PID, recorded by an earlier server that had it before a restart
+    assert app.owner_alive(f'{host}:{os.getpid()}:earlier') is False
+    assert app.owner_alive(f'elsewhere.example:{os.getpid()}:{app.INSTANCE_ID}') is None
+    assert app.owner_alive('') is None
+
+    child = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(60)'])
+    try:
+        started = app.process_start_time(child.pid)
+        assert app.owner_alive(f'{host}:{child.pid}:{started or "unknown"}') is True
+        assert app.owner_alive(f'{host}:{child.pid}') is True  # records from before instance IDs
+        if started is not None:
+            # The PID was reused by a process that started at another time
+            assert app.owner_alive(f'{host}:{child.pid}:{int(started) - 1}') is False
+    finally:
+        child.kill()
+        child.wait()
+    assert app.owner_alive(f'{host}:{child.pid}:{started}') is False
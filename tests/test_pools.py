@@ -0,0 +1,36 @@
+"""
+Rewriter and image pool workers re-import the server's main module; that must not start the
+server's background work (janitor, job recovery, scheduler threads) inside them
+"""
+
+import os
+import subprocess
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MAIN = '''
+import threading
+import app
+import imageproc
+import rewriter
+
+
+def thread_names():
+    return sorted(thread.name for thread in threading.enumerate())
+
+
+if __name__ == '__main__':
+    print('rewriter', rewriter._get_pool().submit(thread_names).result())
+    print('imageproc', imageproc._get_pool().submit(thread_names).result())
+'''
+
+
+def test_pool_workers_start_no_threads(tmp_path):
+    (tmp_path / 'main.py').write_text(MAIN)
+    result = subprocess.run([sys.executable, 'main.py'], cwd=tmp_path, capture_output=True, text=True,
+                            timeout=120, env=dict(os.environ, PYTHONPATH=REPO_DIR,
+                                                  REWRITE_PROCESSES='1', IMAGE_PROCESSES='1'))
+    assert result.returncode == 0, result.stderr
+    lines = [line for line in result.stdout.splitlines() if line.startswith(('rewriter ', 'imageproc '))]
+    assert lines == ["rewriter ['MainThread']", "imageproc ['MainThread']"]
@@ -0,0 +1,170 @@
+"""
+Per-host politeness on a fake clock: the token bucket's rate and burst, hosts kept apart,
+concurrency slots, and how polite_get backs off on 429 and Retry-After
+"""
+
+import asyncio
+import time
+import types
+from email.utils import formatdate
+
+import pytest
+
+import crawler
+import ratelimit
+from ratelimit import HostLimiter, retry_after
+
+
+class FakeClock:
+    """Stands in for time.monotonic and asyncio.sleep in ratelimit: sleeping just moves the clock"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        self.now += seconds
+        await asyncio.sleep(0)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(ratelimit, 'time', clock)
+    monkeypatch.setattr(ratelimit, 'asyncio', types.SimpleNamespace(Semaphore=asyncio.Semaphore, sleep=clock.sleep))
+    return clock
+
+
+def granted(limiter, clock, url, count):
+    """Clock readings at which each of count requests to url, one after the other, got its slot"""
+    async def take():
+        times = []
+        for _ in range(count):
+            async with limiter.slot(url):
+                times.append(clock.now)
+        return times
+    return asyncio.run(take())
+
+
+def test_rate_and_burst(clock):
+    limiter = HostLimiter(rate=2, burst=3, concurrency=10)
+    assert granted(limiter, clock, 'http://a.example/', 5) == pytest.approx([1000, 1000, 1000, 1000.5, 1001])
+    clock.now += 60  # an idle host saves up no more than its burst
+    start = clock.now
+    assert granted(limiter, clock, 'http://a.example/x', 4) == pytest.approx([start, start, start, start + 0.5])
+
+
+def test_hosts_have_their_own_buckets(clock):
+    limiter = HostLimiter(rate=1, burst=1, concurrency=10)
+    granted(limiter, clock, 'http://a.example/', 3)
+    start = clock.now
+    assert granted(limiter, clock, 'http://b.example/', 1) == [start]
+    assert granted(limiter, clock, 'http://A.example/', 1) == [start + 1]  # host names are case-insensitive
+    limiter.feedback('http://a.example/', 429, {'Retry-After': '30'})
+    assert granted(limiter, clock, 'http://b.example/', 1)[0] < start + 30
+
+
+def test_concurrency_slots(clock):
+    limiter = HostLimiter(rate=1000, burst=1000, concurrency=2)
+    inside = []
+    most = []
+
+    async def fetch(url, done):
+        async with limiter.slot(url):
+            inside.append(url)
+            most.append(len(inside))
+            await done.wait()
+            inside.remove(url)
+
+    async def main():
+        done = asyncio.Event()
+        tasks = [asyncio.ensure_future(fetch('http://a.example/', done)) for _ in range(3)]
+        tasks.append(asyncio.ensure_future(fetch('http://b.example/', done)))
+        for _ in range(10):
+            await asyncio.sleep(0)
+        waiting = sorted(inside)
+        done.set()
+        await asyncio.gather(*tasks)
+        return waiting
+
+    # Two requests to a hold both of its slots; b is not held up by them
+    assert asyncio.run(main()) == ['http://a.example/', 'http://a.example/', 'http://b.example/']
+    assert max(most) == 3
+    assert limiter.stats()['hosts'] == 2
+
+
+def test_throttling_slows_the_host_down(clock):
+    limiter = HostLimiter(rate=4, burst=1, concurrency=10)
+    limiter.feedback('http://a.example/', 429, {'Retry-After': '5'})
+    assert limiter.stats()['paused'] == 1 and limiter.stats()['slowed'] == 1
+    start = clock.now
+    assert granted(limiter, clock, 'http://a.example/', 1)[0] == pytest.approx(start + 5)
+    assert granted(limiter, clock, 'http://a.example/', 1)[0] == pytest.approx(start + 5.5)  # half the rate
+
+    for expected in (1, 2, 4):  # without Retry-After the pause doubles
+        start = clock.now
+        limiter.feedback('http://a.example/', 503, {})
+        assert granted(limiter, clock, 'http://a.example/', 1)[0] >= start + expected
+    limiter.feedback('http://a.example/', 429, {'Retry-After': '3600'})
+    start = clock.now
+    assert granted(limiter, clock, 'http://a.example/', 1)[0] == pytest.approx(start + ratelimit.MAX_BACKOFF)
+
+    for _ in range(100):
+        limiter.feedback('http://a.example/', 200, {})
+    assert limiter.stats()['slowed'] == 0
+    assert limiter.stats()['throttled_responses'] == 5
+
+
+def test_retry_after():
+    assert retry_after({'Retry-After': '120'}) == 120
+    assert retry_after({'Retry-After': formatdate(time.time() + 30, usegmt=True)}) == pytest.approx(30, abs=2)
+    assert retry_after({'Retry-After': 'soon'}) is None
+    assert retry_after({}) is None
+
+
+class FakeResponse:
+    def __init__(self, status, headers):
+        self.status = status
+        self.headers = headers
+
+    def release(self):
+        pass
+
+
+def test_polite_get_waits_out_retry_after(clock, monkeypatch):
+    answers = [FakeResponse(429, {'Retry-After': '7'}), FakeResponse(503, {}), FakeResponse(200, {})]
+    requested = []
+
+    async def get(url, headers=None):
+        requested.append(clock.now)
+        return answers.pop(0)
+
+    async def get_session():
+        return types.SimpleNamespace(get=get)
+
+    monkeypatch.setattr(crawler, 'get_session', get_session)
+    monkeypatch.setattr(crawler, 'host_limiter', HostLimiter(rate=10, burst=10, concurrency=2))
+
+    async def fetch():
+        async with crawler.polite_get('http://a.example/page', retries=2) as resp:
+            return resp.status
+
+    assert asyncio.run(fetch()) == 200
+    assert requested[1] - requested[0] == pytest.approx(7)
+    assert requested[2] - requested[1] >= ratelimit.FIRST_BACKOFF
+
+    # Out of retries, the throttling answer itself is handed back
+    answers.extend([FakeResponse(429, {'Retry-After': '1'})] * 2)
+    requested.clear()
+
+    async def fetch_once():
+        async with crawler.polite_get('http://a.example/page', retries=1) as resp:
+            return resp.status
+
+    assert asyncio.run(fetch_once()) == 429
+    assert len(requested) == 2